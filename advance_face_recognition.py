@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 """
-FRDS2 Face Verification Demo (2 users)
+FRDS2 Face Verification Demo (2 or N users)
 
 What this script does
 ---------------------
@@ -10,22 +10,29 @@ What this script does
      <USER_B>/imgX.png ...
      ...
 
-2) Picks 2 users (either provided via --users or the first 2 valid folders).
+2) Picks users: --users, every folder with --all-users, or the first 2 valid folders.
 
 3) Splits each user's images into enrollment ("offline training") and test ("online verification") sets.
 
 4) Offline enrollment builds compact templates per user from many images by:
    - computing face embeddings with `face_recognition`
-   - simple quality gate (blur + min face size)
+   - quality gate (blur + min face size; optional reduced-resolution pre-check for JPEGs)
    - optional dedup
-   - building either a single centroid or K-means K centroids (recommended K=3..8)
-   - persisting templates to disk as .npy files
+   - building either a single centroid or K-means K centroids (recommended K=3..8);
+     --cluster picks scikit-learn KMeans, MiniBatchKMeans or numpy spherical k-means
+   - persisting templates to disk as .npy files, and the raw embeddings as
+     <user>.enroll.npz so update_user_templates can add images incrementally
 
 5) Online verification evaluates speed/accuracy by simulating claimed-identity checks
    (image + claimed_name -> accept/reject) and produces metrics:
-   - ROC / threshold sweep (TPR, FPR, FNR, Precision/Recall/F1)
+   - exact ROC at every distinct score (TPR, FPR, FNR, Precision/Recall/F1)
    - EER estimate, best-F1 threshold, and a threshold at target FAR
    - Latency estimates: detection+embed and scoring time per image
+   Every test image is embedded once and scored against all users in one
+   [n_test x n_users] matrix, so N-user runs give full impostor statistics.
+   With --stream-log DIR the scores are instead appended to a chunked on-disk log
+   with checkpoints (--resume continues an interrupted run) and the metrics are
+   computed from the log in constant memory.
 
 Usage
 -----
@@ -37,12 +44,13 @@ python fr_verify_demo.py \
   --seed 42 \
   --target-far 0.001
 
-If --users is omitted, the first two valid user folders will be used.
+If --users is omitted, the first two valid user folders will be used;
+pass --all-users to calibrate against every identity under --root.
 
 Dependencies
 ------------
 - face_recognition (dlib-backed)
-- numpy, scikit-learn, opencv-python, tqdm
+- numpy, opencv-python, tqdm; scikit-learn for --cluster kmeans/minibatch (imported lazily)
 
 Notes
 -----
@@ -52,27 +60,33 @@ Notes
 """
 
 import argparse
+import hashlib
 import json
+import os
 import random
+import threading
 import time
-from dataclasses import dataclass
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, fields
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Tuple, Union
 
 import cv2
 import numpy as np
 from tqdm import tqdm
 
+import ann_index
+import quantized_gallery
+import streaming_eval
+import template_gallery
+from embedding_cache import MISS as CACHE_MISS, EmbeddingCache
+
 try:
     import face_recognition
 except Exception as e:
     raise SystemExit("face_recognition is required. pip install face_recognition dlib")
 
-try:
-    from sklearn.cluster import KMeans
-except Exception:
-    KMeans = None  # We'll guard use
-
 
 # -----------------------------
 # Utility dataclasses
@@ -106,73 +120,601 @@ def largest_box(boxes: List[Tuple[int, int, int, int]]) -> Tuple[int, int, int,
     return boxes[int(np.argmax(areas))]
 
 
+def detect_faces(img_rgb: np.ndarray,
+                 model: str = "hog",
+                 detect_max_side: int = None) -> Tuple[List[Tuple[int, int, int, int]], float]:
+    """face_locations, optionally on a downscaled copy of the image.
+
+    With detect_max_side set and the image's longer side above it, detection runs on
+    an INTER_AREA-resized copy whose longer side is detect_max_side, and boxes are mapped
+    back to full-resolution (top, right, bottom, left) coordinates. HOG's smallest
+    detectable face shrinks by the same factor, so keep detect_max_side large enough
+    that faces stay >= ~80 px after scaling.
+    Returns (boxes, scale) where scale is the factor detection ran at (1.0 = full res).
+    """
+    h, w = img_rgb.shape[:2]
+    if not detect_max_side or max(h, w) <= detect_max_side:
+        return face_recognition.face_locations(img_rgb, model=model), 1.0
+
+    scale = detect_max_side / float(max(h, w))
+    small = cv2.resize(img_rgb, (max(1, int(round(w * scale))), max(1, int(round(h * scale)))),
+                       interpolation=cv2.INTER_AREA)
+    small_boxes = face_recognition.face_locations(np.ascontiguousarray(small), model=model)
+    boxes = []
+    for (t, r, b, l) in small_boxes:
+        boxes.append((max(0, int(round(t / scale))), min(w, int(round(r / scale))),
+                      min(h, int(round(b / scale))), max(0, int(round(l / scale)))))
+    return boxes, scale
+
+
+def hint_boxes_to_css(hints, img_shape, pad: float = 0.25) -> List[Tuple[int, int, int, int]]:
+    """Convert OpenCV detections (x, y, w, h) to face_recognition (top, right, bottom, left).
+
+    Each box grows by `pad` * its width/height on every side and is clipped to the image,
+    so the result can serve as a search region around a Haar cascade hit.
+    """
+    h_img, w_img = img_shape[:2]
+    boxes = []
+    for (x, y, w, h) in hints:
+        px, py = int(round(w * pad)), int(round(h * pad))
+        t, b = max(0, int(y) - py), min(h_img, int(y) + int(h) + py)
+        l, r = max(0, int(x) - px), min(w_img, int(x) + int(w) + px)
+        if b > t and r > l:
+            boxes.append((t, r, b, l))
+    return boxes
+
+
+def detect_faces_in_hints(img_rgb: np.ndarray,
+                          hints,
+                          model: str = "hog",
+                          pad: float = 0.25,
+                          refine: bool = True,
+                          detect_max_side: int = None) -> List[Tuple[int, int, int, int]]:
+    """Face boxes from detector hints (OpenCV (x, y, w, h)) instead of a full-frame pass.
+
+    With refine=True, face_locations runs only inside each padded hint region and its
+    boxes are mapped back to image coordinates; hints where it finds nothing are dropped.
+    With refine=False the padded hint boxes are returned as-is.
+    """
+    rois = hint_boxes_to_css(hints, img_rgb.shape, pad=pad)
+    if not refine:
+        return rois
+    boxes = []
+    for (t, r, b, l) in rois:
+        roi = np.ascontiguousarray(img_rgb[t:b, l:r])
+        found, _ = detect_faces(roi, model=model, detect_max_side=detect_max_side)
+        boxes.extend((bt + t, br + l, bb + t, bl + l) for (bt, br, bb, bl) in found)
+    return boxes
+
+
 def laplacian_var(img_bgr: np.ndarray) -> float:
     gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
     return float(cv2.Laplacian(gray, cv2.CV_64F).var())
 
 
+@dataclass
+class GateStats:
+    """Counters of the staged quality gate. Each image lands in exactly one
+    rejected_* bucket or in `accepted`; ms_* are wall times summed per stage."""
+    n_images: int = 0
+    rejected_unreadable: int = 0
+    rejected_file_size: int = 0
+    rejected_dims: int = 0
+    rejected_blur_early: int = 0
+    rejected_blur: int = 0
+    rejected_no_face: int = 0
+    accepted: int = 0
+    ms_read: float = 0.0
+    ms_reduced: float = 0.0
+    ms_full: float = 0.0
+    ms_detect_embed: float = 0.0
+
+    def add(self, other: "GateStats") -> "GateStats":
+        for f in fields(self):
+            setattr(self, f.name, getattr(self, f.name) + getattr(other, f.name))
+        return self
+
+    def to_dict(self) -> Dict[str, float]:
+        return asdict(self)
+
+
+_REDUCED_GRAYSCALE = {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                      8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+EARLY_REJECT_REDUCE = 2
+_JPEG_MAGIC = b"\xff\xd8\xff"
+
+
+def _embed_bgr(img_bgr: np.ndarray,
+               model: str = "hog",
+               min_blur: float = 40.0,
+               min_size: int = 64,
+               detect_max_side: int = None,
+               gate_stats: GateStats = None) -> Tuple[np.ndarray, Tuple[int, int, int, int]]:
+    """Quality gate + detection + embedding on a decoded BGR image (see face_embed_from_path)."""
+    g = gate_stats if gate_stats is not None else GateStats()
+    t0 = time.perf_counter()
+    sharp = laplacian_var(img_bgr) >= min_blur
+    g.ms_full += (time.perf_counter() - t0) * 1000.0
+    if not sharp:
+        g.rejected_blur += 1
+        return None, None
+
+    t0 = time.perf_counter()
+    try:
+        img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+        img_rgb = np.ascontiguousarray(img_rgb)
+        boxes, _ = detect_faces(img_rgb, model=model, detect_max_side=detect_max_side)
+        box = largest_box(boxes) if boxes else None
+        # Boxes are in full-resolution coordinates even when detection ran downscaled
+        if box is None or min(box[2] - box[0], box[1] - box[3]) < min_size:
+            g.rejected_no_face += 1
+            return None, None
+
+        encs = face_recognition.face_encodings(img_rgb, [box])
+        if not encs:
+            g.rejected_no_face += 1
+            return None, None
+        g.accepted += 1
+        return encs[0].astype(np.float32), box
+    finally:
+        g.ms_detect_embed += (time.perf_counter() - t0) * 1000.0
+
+
+def _gated_embed(content: bytes,
+                 model: str = "hog",
+                 min_blur: float = 40.0,
+                 min_size: int = 64,
+                 detect_max_side: int = None,
+                 gate_stats: GateStats = None,
+                 early_reject: bool = False,
+                 reduce_factor: int = EARLY_REJECT_REDUCE) -> Tuple[np.ndarray, Tuple[int, int, int, int]]:
+    """Quality gate over encoded image bytes, with an optional cheap first stage.
+
+    1) early_reject (opt-in, JPEG only): reduced decode (IMREAD_REDUCED_GRAYSCALE_<reduce_factor>,
+       DCT-scaled, so much cheaper than a full decode):
+       - dims: reject if even the full image is smaller than min_size (exact)
+       - blur: reject if the Laplacian variance of the reduced image is < min_blur.
+         This is a heuristic, not a bound: downscaling low-pass filters the image and
+         usually LOWERS the variance (a noisy 640x480 gradient measures 127.6 at full
+         resolution but ~35 reduced), so it can drop images the full-resolution check
+         accepts. Only enable it where that trade is acceptable.
+       Other formats have no reduced decode (OpenCV decodes fully and resizes), so the
+       stage is skipped for them rather than decoding twice.
+    2) full colour decode, exact blur check, detection and embedding (_embed_bgr).
+    """
+    g = gate_stats if gate_stats is not None else GateStats()
+    buf = np.frombuffer(content, np.uint8)
+    if early_reject and content[:3] == _JPEG_MAGIC:
+        t0 = time.perf_counter()
+        small = cv2.imdecode(buf, _REDUCED_GRAYSCALE[reduce_factor])
+        try:
+            if small is None:
+                g.rejected_unreadable += 1
+                return None, None
+            if min(small.shape[:2]) * reduce_factor < min_size:
+                g.rejected_dims += 1
+                return None, None
+            if float(cv2.Laplacian(small, cv2.CV_64F).var()) < min_blur:
+                g.rejected_blur_early += 1
+                return None, None
+        finally:
+            g.ms_reduced += (time.perf_counter() - t0) * 1000.0
+
+    t0 = time.perf_counter()
+    img_bgr = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    g.ms_full += (time.perf_counter() - t0) * 1000.0
+    if img_bgr is None:
+        g.rejected_unreadable += 1
+        return None, None
+    return _embed_bgr(img_bgr, model=model, min_blur=min_blur, min_size=min_size,
+                      detect_max_side=detect_max_side, gate_stats=g)
+
+
+def _read_gated(path: Path, min_file_bytes: int, g: GateStats) -> Union[bytes, None]:
+    """Stat + read stage: None (counted as a rejection) for unreadable or too small files."""
+    g.n_images += 1
+    t0 = time.perf_counter()
+    try:
+        if os.stat(path).st_size < max(1, int(min_file_bytes)):
+            g.rejected_file_size += 1
+            return None
+        return Path(path).read_bytes()
+    except OSError:
+        g.rejected_unreadable += 1
+        return None
+    finally:
+        g.ms_read += (time.perf_counter() - t0) * 1000.0
+
+
+def _embed_cache_key(content: bytes, model: str, min_blur: float, min_size: int,
+                     detect_max_side: int = None, early_reject: bool = False,
+                     reduce_factor: int = EARLY_REJECT_REDUCE, min_file_bytes: int = 0) -> bytes:
+    # Every gate stage is part of the key: the early stage can reject images the full gate
+    # accepts, and a cached file-size rejection only holds for the same threshold
+    return EmbeddingCache.make_key(content, model=model, min_blur=float(min_blur), min_size=int(min_size),
+                                   detect_max_side=int(detect_max_side or 0), early_reject=bool(early_reject),
+                                   reduce_factor=int(reduce_factor), min_file_bytes=int(min_file_bytes))
+
+
 def face_embed_from_path(path: Path,
                          model: str = "hog",
                          min_blur: float = 40.0,
-                         min_size: int = 64) -> Tuple[np.ndarray, Tuple[int, int, int, int]]:
+                         min_size: int = 64,
+                         cache: EmbeddingCache = None,
+                         detect_max_side: int = None,
+                         gate_stats: GateStats = None,
+                         early_reject: bool = False,
+                         min_file_bytes: int = 0) -> Tuple[np.ndarray, Tuple[int, int, int, int]]:
     """Return (embedding(128,), chosen_box) or (None, None) if not usable.
     - model: "hog" | "cnn"
     - min_blur: discard too blurry images
-    - min_size: minimal face box side to keep
+    - min_size: minimal face box side to keep (full-resolution pixels)
+    - detect_max_side: run detection on a copy downscaled to this longer side, then
+      embed from the full-resolution pixels (None = detect at full resolution)
+    - cache: optional EmbeddingCache; results (rejections included) are looked up and
+      stored by image content hash + model + quality-gate params
+    - gate_stats: optional GateStats updated in place with per-stage rejects and times
+    - early_reject: opt-in reduced-resolution dims/blur pre-check for JPEGs (see _gated_embed);
+      it can reject images the full-resolution gate accepts
+    - min_file_bytes: reject files smaller than this before reading them
     """
-    img_bgr = cv2.imread(str(path))
-    if img_bgr is None:
-        return None, None
-    if laplacian_var(img_bgr) < min_blur:
-        return None, None
-
-    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-    img_rgb = np.ascontiguousarray(img_rgb)
-    boxes = face_recognition.face_locations(img_rgb, model=model)
-    if not boxes:
-        return None, None
-    box = largest_box(boxes)
-    if box is None:
-        return None, None
-    t, r, b, l = box
-    if min(b - t, r - l) < min_size:
-        return None, None
-
-    encs = face_recognition.face_encodings(img_rgb, [box])
-    if not encs:
+    g = gate_stats if gate_stats is not None else GateStats()
+    content = _read_gated(path, min_file_bytes, g)
+    if content is None:
         return None, None
-    return encs[0].astype(np.float32), box
+    return _embed_content(content, model=model, min_blur=min_blur, min_size=min_size, cache=cache,
+                          detect_max_side=detect_max_side, gate_stats=g, early_reject=early_reject,
+                          min_file_bytes=min_file_bytes)
+
+
+def _embed_content(content: bytes, model: str, min_blur: float, min_size: int, cache: EmbeddingCache,
+                   detect_max_side: int, gate_stats: GateStats, early_reject: bool,
+                   min_file_bytes: int) -> Tuple[np.ndarray, Tuple[int, int, int, int]]:
+    """face_embed_from_path after the read stage: cache lookup, then _gated_embed."""
+    g = gate_stats
+    key = None
+    if cache is not None:
+        key = _embed_cache_key(content, model, min_blur, min_size, detect_max_side, early_reject,
+                               min_file_bytes=min_file_bytes)
+        hit = cache.get(key)
+        if hit is not CACHE_MISS:
+            return hit
+    emb, box = _gated_embed(content, model=model, min_blur=min_blur, min_size=min_size,
+                            detect_max_side=detect_max_side, gate_stats=g, early_reject=early_reject)
+    if cache is not None:
+        cache.put(key, emb, box)
+    return emb, box
+
+
+def _embed_worker_init() -> None:
+    # One process per core already; keep OpenCV from spawning its own thread pool in each
+    cv2.setNumThreads(1)
+
+
+def _embed_job(args) -> Tuple[np.ndarray, Tuple[int, int, int, int], GateStats, str]:
+    # Top-level so ProcessPoolExecutor can pickle it; the GateStats and the content digest
+    # of the bytes that were read travel back with the result
+    path, model, min_blur, min_size, detect_max_side, early_reject, min_file_bytes = args
+    g = GateStats()
+    content = _read_gated(path, min_file_bytes, g)
+    if content is None:
+        return None, None, g, None
+    emb, box = _embed_content(content, model=model, min_blur=min_blur, min_size=min_size, cache=None,
+                              detect_max_side=detect_max_side, gate_stats=g, early_reject=early_reject,
+                              min_file_bytes=min_file_bytes)
+    return emb, box, g, hashlib.sha256(content).hexdigest()
+
+
+def embed_images(paths: List[Path],
+                 model: str = "hog",
+                 min_blur: float = 40.0,
+                 min_size: int = 64,
+                 workers: int = 1,
+                 chunksize: int = None,
+                 desc: str = "Embedding",
+                 cache: EmbeddingCache = None,
+                 detect_max_side: int = None,
+                 early_reject: bool = False,
+                 min_file_bytes: int = 0) -> Tuple[List[Tuple[np.ndarray, Tuple[int, int, int, int]]], Dict[str, float]]:
+    """Run face_embed_from_path over many images, optionally across a process pool.
+
+    Returns (results, stats): results[i] is the (embedding, box) pair for paths[i]
+    (None, None when rejected), in input order regardless of `workers`; stats has
+    n_images, cache_hits, seconds, images_per_sec and `gate` (GateStats.to_dict()
+    summed over the images that were not cache hits) and `digests`: the sha256 hex of
+    each image's bytes as read here (see _content_digest), None where it was not read.
+    - workers: number of processes; 1 runs serially in this process
+    - chunksize: images handed to a worker per task (default spreads ~4 chunks per worker)
+    - cache: optional EmbeddingCache; lookups and appends happen in this process,
+      only cache misses are embedded
+    - detect_max_side, early_reject, min_file_bytes: see face_embed_from_path
+    """
+    t0 = time.perf_counter()
+    results: List[Tuple[np.ndarray, Tuple[int, int, int, int]]] = [(None, None)] * len(paths)
+    keys: List[bytes] = [None] * len(paths)
+    digests: List[str] = [None] * len(paths)
+    todo = list(range(len(paths)))
+    hits = 0
+    if cache is not None:
+        todo = []
+        for i, p in enumerate(paths):
+            try:
+                content = Path(p).read_bytes()
+            except OSError:
+                continue
+            keys[i] = _embed_cache_key(content, model, min_blur, min_size, detect_max_side, early_reject,
+                                       min_file_bytes=min_file_bytes)
+            digests[i] = hashlib.sha256(content).hexdigest()
+            hit = cache.get(keys[i])
+            if hit is CACHE_MISS:
+                todo.append(i)
+            else:
+                results[i] = hit
+                hits += 1
+
+    jobs = [(paths[i], model, min_blur, min_size, detect_max_side, early_reject, min_file_bytes) for i in todo]
+    if workers <= 1 or len(jobs) <= 1:
+        computed = [_embed_job(j) for j in tqdm(jobs, desc=desc)]
+    else:
+        workers = min(workers, len(jobs))
+        if chunksize is None:
+            chunksize = max(1, len(jobs) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_embed_worker_init) as pool:
+            computed = list(tqdm(pool.map(_embed_job, jobs, chunksize=chunksize), total=len(jobs), desc=desc))
+    gate = GateStats()
+    for i, (emb, box, g, digest) in zip(todo, computed):
+        results[i] = (emb, box)
+        gate.add(g)
+        digests[i] = digests[i] or digest
+        if cache is not None and keys[i] is not None:
+            cache.put(keys[i], emb, box)
+
+    seconds = time.perf_counter() - t0
+    stats = {
+        "n_images": len(paths),
+        "cache_hits": hits,
+        "seconds": seconds,
+        "images_per_sec": len(paths) / seconds if seconds > 0 else 0.0,
+        "gate": gate.to_dict(),
+        "digests": digests,
+    }
+    return results, stats
 
 
 # -----------------------------
 # Enrollment: build templates
 # -----------------------------
 
-def dedup_embeddings(E: np.ndarray, near_cos: float = 0.995) -> np.ndarray:
-    """Drop near-duplicate embeddings by greedy filtering using cosine sim threshold."""
+def _flag_duplicates(E: np.ndarray, rows: np.ndarray, cols: np.ndarray, order: np.ndarray,
+                     near_cos: float, dup: np.ndarray, block: int) -> None:
+    """Set dup[order[i]] for each i in `rows` having a j in `cols` with order[j] < order[i]
+    and E[i] @ E[j] >= near_cos. Columns are processed in tiles of `block`, last tile
+    first: duplicates (consecutive video frames) are usually close behind a row."""
+    rows = rows[~dup[order[rows]]]
+    for c in reversed(range(0, cols.size, block)):
+        if rows.size == 0:
+            return
+        cb = cols[c:c + block]
+        S = E[rows] @ E[cb].T
+        hit = (S >= near_cos) & (order[cb][None, :] < order[rows][:, None])
+        found = hit.any(axis=1)
+        dup[order[rows[found]]] = True
+        rows = rows[~found]
+
+
+def dedup_embeddings(E: np.ndarray, near_cos: float = 0.995,
+                     block: int = 1024, prefilter_min: int = 20000) -> np.ndarray:
+    """Drop near-duplicate embeddings by greedy filtering using cosine sim threshold.
+    See dedup_keep_mask for the rule and the implementation."""
     if E.shape[0] <= 1:
         return E
-    keep = [0]
-    for i in range(1, E.shape[0]):
-        if np.max(E[i] @ E[:i].T) < near_cos:
-            keep.append(i)
-    return E[keep]
+    return E[dedup_keep_mask(E, near_cos=near_cos, block=block, prefilter_min=prefilter_min)]
+
+
+def dedup_keep_mask(E: np.ndarray, near_cos: float = 0.995,
+                    block: int = 1024, prefilter_min: int = 20000) -> np.ndarray:
+    """Boolean [N] mask of the rows dedup_embeddings keeps.
+
+    Row i is dropped iff some earlier row j < i has E[i] @ E[j] >= near_cos (the same
+    rule as the original per-row loop, so keep-sets are identical up to float rounding
+    of the dot products). The similarity matrix is evaluated in block x block tiles, so
+    memory stays O(block^2) and rows already known to be duplicates are not rescored.
+
+    For n >= prefilter_min unit-norm rows, a sorted-projection prefilter is used: rows are
+    sorted by their projection onto the leading principal direction, and since
+    |u.a - u.b| <= ||a - b|| <= sqrt(2 - 2*near_cos) for duplicates, each row block is only
+    compared with the window of rows whose projection lies within that radius. The
+    prefilter is exact (it only skips pairs that cannot reach near_cos) and is skipped when
+    the windows would cover most of the set anyway, e.g. for nearly isotropic embeddings.
+    """
+    n = E.shape[0]
+    dup = np.zeros(n, dtype=bool)
+    if n <= 1:
+        return ~dup
+    norms = np.linalg.norm(E, axis=1)
+    slack = float(np.max(np.abs(norms - 1.0)))
+
+    if n >= prefilter_min and slack < 1e-3:
+        # Leading principal direction via a few power iterations on a sample
+        X = E[:: max(1, n // 4096)].astype(np.float64)
+        X = X - X.mean(axis=0)
+        u = np.random.default_rng(0).standard_normal(E.shape[1])
+        for _ in range(8):
+            u = X.T @ (X @ u)
+            u /= np.linalg.norm(u) + 1e-12
+        p = E @ u.astype(E.dtype)
+        order = np.argsort(p, kind="stable")
+        Es = E[order]
+        ps = p[order]
+        radius = np.sqrt(max(0.0, 2.0 * (1.0 + slack) ** 2 - 2.0 * near_cos)) + 1e-5
+        starts = np.arange(0, n, block)
+        ends = np.minimum(n, starts + block)
+        lo = np.searchsorted(ps, ps[starts] - radius, side="left")
+        hi = np.searchsorted(ps, ps[ends - 1] + radius, side="right")
+        # Only worth it when the windows are narrow compared to the full lower triangle
+        if float(np.mean((hi - lo) / n)) < 0.25:
+            for a, b, l, h in zip(starts, ends, lo, hi):
+                _flag_duplicates(Es, np.arange(a, b), np.arange(l, h), order, near_cos, dup, block)
+            return ~dup
+
+    order = np.arange(n)
+    for a in range(0, n, block):
+        b = min(n, a + block)
+        # only earlier rows can make row i a duplicate: columns [0, b)
+        _flag_duplicates(E, np.arange(a, b), np.arange(0, b), order, near_cos, dup, block)
+
+    return ~dup
+
+
+CLUSTER_METHODS = ("kmeans", "minibatch", "spherical")
+
+
+def _sklearn_cluster(method: str):
+    """KMeans / MiniBatchKMeans class, imported on first use (scikit-learn costs ~2 s to import).
+    None when scikit-learn is not installed."""
+    try:
+        from sklearn.cluster import KMeans, MiniBatchKMeans
+    except Exception:
+        return None
+    return MiniBatchKMeans if method == "minibatch" else KMeans
+
+
+def _spherical_seeds(E: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    # k-means++ seeding with cosine distance 1 - <x, c>
+    C = np.empty((k, E.shape[1]), dtype=E.dtype)
+    C[0] = E[rng.integers(E.shape[0])]
+    d = np.maximum(0.0, 1.0 - E @ C[0]).astype(np.float64)
+    for j in range(1, k):
+        total = d.sum()
+        i = int(rng.choice(E.shape[0], p=d / total)) if total > 0 else int(rng.integers(E.shape[0]))
+        C[j] = E[i]
+        d = np.minimum(d, np.maximum(0.0, 1.0 - E @ C[j]))
+    return C
+
+
+def spherical_kmeans(E: np.ndarray, k: int, n_init: int = 3, max_iter: int = 50,
+                     tol: float = 1e-6, seed: int = 0) -> Tuple[np.ndarray, np.ndarray, float]:
+    """Spherical k-means (cosine geometry) on unit rows E [N, D] with k-means++ seeding.
+
+    Assignment is argmax cosine and each center is the re-normalized sum of its
+    members, so it optimizes the same max-cosine score verification uses. An empty
+    cluster is re-seeded with the point farthest from its center. The best of
+    `n_init` seedings (highest total cosine) is returned as
+    (centers [k, D] unit rows, labels [N], objective).
+    """
+    E = np.asarray(E, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    best = (None, None, -np.inf)
+    for _ in range(max(1, int(n_init))):
+        C = _spherical_seeds(E, k, rng)
+        prev = -np.inf
+        for _ in range(max_iter):
+            S = E @ C.T
+            labels = np.argmax(S, axis=1)
+            sim = S[np.arange(E.shape[0]), labels]
+            obj = float(sim.sum())
+            sums = np.zeros_like(C)
+            for j in range(k):
+                members = labels == j
+                if members.any():
+                    sums[j] = E[members].sum(axis=0)
+                else:
+                    far = int(np.argmin(sim))
+                    sums[j] = E[far]
+                    sim[far] = np.inf
+            C = sums / (np.linalg.norm(sums, axis=1, keepdims=True) + 1e-12)
+            if obj - prev <= tol * max(1.0, abs(obj)):
+                break
+            prev = obj
+        S = E @ C.T
+        labels = np.argmax(S, axis=1)
+        obj = float(S[np.arange(E.shape[0]), labels].sum())
+        if obj > best[2]:
+            best = (C, labels, obj)
+    return best
 
 
 def build_templates(embeds: List[np.ndarray], k_max: int = 5,
-                    min_per_cluster: int = 12) -> np.ndarray:
-    """Return array [K, D] of normalized templates."""
+                    min_per_cluster: int = 12, method: str = "kmeans",
+                    n_init: int = 10, seed: int = 0) -> np.ndarray:
+    """Return array [K, D] of normalized templates.
+
+    method : 'kmeans' (scikit-learn KMeans, the default), 'minibatch' (MiniBatchKMeans)
+             or 'spherical' (spherical_kmeans, numpy only; also used when scikit-learn
+             is not installed). n_init seedings are tried and the best kept.
+    See bench/bench_clustering.py for speed and genuine/impostor scores per method.
+    """
+    if method not in CLUSTER_METHODS:
+        raise ValueError(f"Unknown clustering method {method!r}; expected one of {CLUSTER_METHODS}")
     E = np.stack([l2norm(e) for e in embeds], axis=0)
     E = dedup_embeddings(E, near_cos=0.995)
-    if E.shape[0] < min_per_cluster or k_max <= 1 or KMeans is None:
+    if E.shape[0] < min_per_cluster or k_max <= 1:
         return np.expand_dims(l2norm(np.mean(E, axis=0)), 0)
     k = min(k_max, max(2, E.shape[0] // min_per_cluster))
-    km = KMeans(n_clusters=k, n_init=10, random_state=0)
+    cls = _sklearn_cluster(method) if method != "spherical" else None
+    if cls is None:
+        centers, _, _ = spherical_kmeans(E, k, n_init=n_init, seed=seed)
+        return centers
+    km = cls(n_clusters=k, n_init=n_init, random_state=seed)
     km.fit(E)
     centers = np.stack([l2norm(c) for c in km.cluster_centers_], axis=0)
     return centers
 
 
+def template_counts(embeds: List[np.ndarray], T: np.ndarray) -> np.ndarray:
+    """Number of (deduplicated) embeddings nearest to each template row; the weights
+    update_templates_online needs to continue the clustering later."""
+    E = np.stack([l2norm(e) for e in embeds], axis=0)
+    E = dedup_embeddings(E, near_cos=0.995)
+    return np.bincount(np.argmax(E @ T.T, axis=1), minlength=T.shape[0]).astype(np.int64)
+
+
+def update_templates_online(T: np.ndarray, counts: np.ndarray, new_embeds: List[np.ndarray],
+                            k_max: int = 5, min_per_cluster: int = 12) -> Tuple[np.ndarray, np.ndarray]:
+    """Fold new embeddings into existing templates with one mini-batch k-means step.
+
+    Each center is seeded from T, assigned its nearest new embeddings and moved to
+    the running mean (count-weighted, so a center summarizing 200 images barely
+    moves for one new photo), then re-normalized. When the new total calls for more
+    clusters than exist (same rule as build_templates), extra centers are seeded from
+    the new embeddings farthest from every current center, k-means++ style.
+
+    Returns (templates [K', D] float32, counts [K'] int64).
+    """
+    C = np.asarray(T, dtype=np.float64).copy()
+    n = np.asarray(counts, dtype=np.float64).copy()
+    if len(new_embeds) == 0:
+        return C.astype(np.float32), n.astype(np.int64)
+    X = np.stack([l2norm(e) for e in new_embeds], axis=0).astype(np.float64)
+
+    n_total = int(n.sum()) + X.shape[0]
+    if n_total < min_per_cluster or k_max <= 1:
+        k_target = 1
+    else:
+        k_target = min(k_max, max(2, n_total // min_per_cluster))
+
+    if k_target == 1 and C.shape[0] > 1:
+        C = (n[:, None] * C).sum(axis=0, keepdims=True) / max(1.0, n.sum())
+        n = np.array([n.sum()])
+    while C.shape[0] < k_target:
+        dist = 1.0 - np.max(X @ C.T, axis=1)
+        j = int(np.argmax(dist))
+        if dist[j] <= 1e-6:
+            break
+        C = np.vstack([C, X[j]])
+        n = np.append(n, 0.0)
+
+    assign = np.argmax(X @ C.T, axis=1)
+    sums = np.zeros_like(C)
+    np.add.at(sums, assign, X)
+    m = np.bincount(assign, minlength=C.shape[0]).astype(np.float64)
+    moved = m > 0
+    C[moved] = (n[moved, None] * C[moved] + sums[moved]) / (n[moved] + m[moved])[:, None]
+    n += m
+    C /= np.linalg.norm(C, axis=1, keepdims=True) + 1e-12
+    return C.astype(np.float32), n.astype(np.int64)
+
+
 # -----------------------------
 # Dataset & splitting
 # -----------------------------
@@ -183,9 +725,11 @@ def find_users(root: Path) -> List[str]:
     return users
 
 
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
 def list_images(user_dir: Path) -> List[Path]:
-    exts = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
-    files = [p for p in user_dir.rglob("*") if p.suffix.lower() in exts]
+    files = [p for p in user_dir.rglob("*") if p.suffix.lower() in IMAGE_EXTS]
     files.sort()
     return files
 
@@ -210,121 +754,285 @@ def score_against_templates(q: np.ndarray, T: np.ndarray) -> float:
     return float(np.max(T @ q))
 
 
+def roc_curve(y_true: np.ndarray, scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Exact ROC for the rule accept <=> score >= threshold, at every distinct score.
+
+    Sorts once and takes cumulative sums of the labels. Returns
+    (thresholds, tpr, fpr, tp, fp), thresholds descending; index 0 is the
+    "accept nothing" point (threshold just above the max score, tpr = fpr = 0).
+    """
+    y = np.asarray(y_true).astype(np.int64, copy=False)
+    s = np.asarray(scores)
+    # Ties are grouped below, so an unstable sort is fine (and ~4x faster than stable)
+    order = np.argsort(-s)
+    s = s[order].astype(np.float64)
+    y = y[order]
+    # last index of each run of equal scores
+    last = np.r_[np.flatnonzero(np.diff(s)), s.size - 1]
+    tp = np.cumsum(y)[last]
+    fp = (last + 1) - tp
+    P = max(1, int(tp[-1]))
+    N = max(1, int(fp[-1]))
+    top = np.nextafter(s[0], np.inf)
+    thresholds = np.r_[top, s[last]]
+    tp = np.r_[0, tp]
+    fp = np.r_[0, fp]
+    return thresholds, tp / P, fp / N, tp, fp
+
+
+def verification_metrics(y_true: np.ndarray, scores: np.ndarray, target_far: float = 0.001) -> Dict[str, float]:
+    """EER, best-F1 and target-FAR operating point from the exact ROC (see roc_curve).
+
+    - EER and its threshold are linearly interpolated where FPR crosses FNR.
+    - th_at_target_far is interpolated along the curve to FPR == target_far; it always
+      lies above the next lower score, so accepting at it gives the reported
+      tpr/fpr_at_target_far (the lowest-threshold point with FPR <= target_far).
+    """
+    return metrics_from_roc(roc_curve(y_true, scores), target_far=target_far, n_trials=len(scores))
+
+
+def metrics_from_roc(roc, target_far: float = 0.001, n_trials: int = 0,
+                     interpolate_far: bool = True) -> Dict[str, float]:
+    """verification_metrics for a precomputed (thresholds, tpr, fpr, tp, fp) curve.
+
+    Pass interpolate_far=False when the thresholds are not distinct scores (e.g. histogram
+    bin edges, see streaming_eval): th_at_target_far is then the curve point itself.
+    """
+    thresholds, tpr, fpr, tp, fp = roc
+    fnr = 1.0 - tpr
+
+    # EER: first point where FPR >= FNR, interpolated with the previous one
+    d = fpr - fnr
+    i = int(np.argmax(d >= 0)) if np.any(d >= 0) else len(d) - 1
+    if i == 0 or d[i] == d[i - 1]:
+        eer, th_eer = 0.5 * (fpr[i] + fnr[i]), thresholds[i]
+    else:
+        w = d[i - 1] / (d[i - 1] - d[i])
+        eer = fpr[i - 1] + w * (fpr[i] - fpr[i - 1])
+        th_eer = thresholds[i - 1] + w * (thresholds[i] - thresholds[i - 1])
+
+    # Best F1 over all distinct thresholds
+    prec = tp / np.maximum(1, tp + fp)
+    f1 = 2 * prec * tpr / np.maximum(1e-12, prec + tpr)
+    idx_f1 = int(np.argmax(f1))
+
+    # Threshold at target FAR: lowest threshold with FPR <= target_far
+    valid = np.flatnonzero(fpr <= target_far)
+    if len(valid) == 0:
+        th_far = tpr_far = fpr_far = float("nan")
+    else:
+        j = int(valid[-1])
+        tpr_far, fpr_far, th_far = tpr[j], fpr[j], thresholds[j]
+        if interpolate_far and j + 1 < len(fpr) and fpr[j + 1] > fpr[j]:
+            w = (target_far - fpr[j]) / (fpr[j + 1] - fpr[j])
+            th_far = thresholds[j] + w * (thresholds[j + 1] - thresholds[j])
+
+    return {
+        "eer": float(eer),
+        "th_eer": float(th_eer),
+        "best_f1": float(f1[idx_f1]),
+        "th_best_f1": float(thresholds[idx_f1]),
+        "th_at_target_far": float(th_far),
+        "tpr_at_target_far": float(tpr_far),
+        "fpr_at_target_far": float(fpr_far),
+        "auc": float(np.trapezoid(tpr, fpr)),
+        "n_trials": int(n_trials),
+    }
+
+
+def stack_templates(templates: Dict[str, np.ndarray]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """Stack {user: [K, D]} into (names, T_all [N, D], offsets [U+1]), rows L2-normalized."""
+    names = list(templates.keys())
+    mats = [np.asarray(templates[u], dtype=np.float32) for u in names]
+    T_all = np.concatenate(mats, axis=0)
+    T_all = T_all / (np.linalg.norm(T_all, axis=1, keepdims=True) + 1e-12)
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum([m.shape[0] for m in mats], out=offsets[1:])
+    return names, T_all, offsets
+
+
+def score_matrix(Q: np.ndarray, T_all: np.ndarray, offsets: np.ndarray,
+                 block_rows: int = 4096) -> np.ndarray:
+    """Return S [n_query, n_users] with S[i, u] = max cosine of query i over user u's templates.
+
+    Q rows are L2-normalized here; work is done in row blocks of `block_rows` so the
+    intermediate [block_rows, n_templates] product stays bounded in memory.
+    """
+    Q = np.asarray(Q, dtype=np.float32)
+    Q = Q / (np.linalg.norm(Q, axis=1, keepdims=True) + 1e-12)
+    S = np.empty((Q.shape[0], len(offsets) - 1), dtype=np.float32)
+    for s in range(0, Q.shape[0], block_rows):
+        S[s:s + block_rows] = np.maximum.reduceat(Q[s:s + block_rows] @ T_all.T, offsets[:-1], axis=1)
+    return S
+
+
+def _score_summary(x: np.ndarray, prefix: str) -> Dict[str, float]:
+    if x.size == 0:
+        return {}
+    q = np.percentile(x, [0.1, 1, 50, 99, 99.9])
+    return {
+        f"{prefix}_mean": float(np.mean(x)),
+        f"{prefix}_p0.1": float(q[0]),
+        f"{prefix}_p1": float(q[1]),
+        f"{prefix}_p50": float(q[2]),
+        f"{prefix}_p99": float(q[3]),
+        f"{prefix}_p99.9": float(q[4]),
+        f"{prefix}_max": float(np.max(x)),
+    }
+
+
 def simulate_verification(test_images: List[ImageRecord],
                           templates: Dict[str, np.ndarray],
                           target_far: float = 0.001,
-                          model: str = "hog"):
-    """Simulate claimed-name verification for positives and impostors.
-    Returns metrics and per-image timing.
+                          model: str = "hog",
+                          cache: EmbeddingCache = None,
+                          detect_max_side: int = None):
+    """Simulate claimed-name verification for positives and impostors against N >= 2 users.
+
+    Each test image is embedded once and scored against every user in one vectorized
+    pass (score_matrix), giving one genuine trial (its own user) and N-1 impostor
+    trials per image. Returns metrics (including genuine/impostor score summaries)
+    and per-image timing. Scoring is one batched pass, so there is no per-claim time to
+    take percentiles of: score_ms_mean is that pass amortized per claim and
+    score_matrix_ms is the whole pass.
+    With an EmbeddingCache, previously seen test images are not re-embedded
+    (det_embed timings then reflect cache lookups).
     """
     users = list(templates.keys())
-    if len(users) != 2:
-        raise ValueError("This demo expects exactly 2 users for clear positive/negative trials.")
-
-    # Gather scores
-    y_true = []  # 1 for genuine, 0 for impostor
-    scores = []
-    det_embed_times = []
-    score_times = []
-
-    # For each test image of user U, run two claims: claim U (genuine), claim other (impostor)
-    for rec in tqdm(test_images, desc="Scoring test images"):
-        emb = None
+    if len(users) < 2:
+        raise ValueError("Need at least 2 users for positive/negative trials.")
+    user_idx = {u: i for i, u in enumerate(users)}
+
+    # Embed every usable test image once
+    embeds, owners, det_embed_times = [], [], []
+    for rec in tqdm(test_images, desc="Embedding test images"):
         t0 = time.perf_counter()
-        emb, _ = face_embed_from_path(rec.path, model=model)
+        emb, _ = face_embed_from_path(rec.path, model=model, cache=cache, detect_max_side=detect_max_side)
         t1 = time.perf_counter()
         if emb is None:
             # skip unusable image
             continue
-        for claimed in users:
-            t2 = time.perf_counter()
-            s = score_against_templates(emb, templates[claimed])
-            t3 = time.perf_counter()
-            scores.append(s)
-            y_true.append(1 if (claimed == rec.user) else 0)
-            det_embed_times.append(t1 - t0)
-            score_times.append(t3 - t2)
-
-    y_true = np.array(y_true, dtype=np.int32)
-    scores = np.array(scores, dtype=np.float32)
-    det_embed_times = np.array(det_embed_times, dtype=np.float32)
-    score_times = np.array(score_times, dtype=np.float32)
+        embeds.append(emb)
+        owners.append(user_idx[rec.user])
+        det_embed_times.append(t1 - t0)
 
-    # Threshold sweep
-    if scores.size == 0:
+    if not embeds:
         raise RuntimeError("No test scores computed. Check image quality/detection.")
 
-    ths = np.linspace(-1.0, 1.0, num=1001)
-    tprs, fprs, fnrs, precs, recs, f1s = [], [], [], [], [], []
-    for th in ths:
-        y_pred = (scores >= th).astype(np.int32)
-        TP = int(np.sum((y_pred == 1) & (y_true == 1)))
-        FP = int(np.sum((y_pred == 1) & (y_true == 0)))
-        TN = int(np.sum((y_pred == 0) & (y_true == 0)))
-        FN = int(np.sum((y_pred == 0) & (y_true == 1)))
-        P = max(1, TP + FN)
-        N = max(1, TN + FP)
-        tpr = TP / P
-        fpr = FP / N
-        fnr = FN / P
-        prec = TP / max(1, TP + FP)
-        rec = tpr
-        f1 = 2 * prec * rec / max(1e-12, (prec + rec))
-        tprs.append(tpr)
-        fprs.append(fpr)
-        fnrs.append(fnr)
-        precs.append(prec)
-        recs.append(rec)
-        f1s.append(f1)
-
-    tprs = np.array(tprs)
-    fprs = np.array(fprs)
-    fnrs = np.array(fnrs)
-    f1s = np.array(f1s)
-
-    # EER (where FPR ~= FNR)
-    idx_eer = int(np.argmin(np.abs(fprs - fnrs)))
-    eer = 0.5 * (fprs[idx_eer] + fnrs[idx_eer])
-    th_eer = ths[idx_eer]
-
-    # Best F1 threshold
-    idx_f1 = int(np.argmax(f1s))
-    th_best_f1 = ths[idx_f1]
-    best_f1 = f1s[idx_f1]
-
-    # Threshold at target FAR
-    # Find smallest threshold such that FPR <= target_far
-    valid = np.where(fprs <= target_far)[0]
-    if len(valid) == 0:
-        th_far = float("nan")
-        tpr_far = float("nan")
-        fpr_far = float("nan")
-    else:
-        idx_far = valid[0]
-        th_far = ths[idx_far]
-        tpr_far = tprs[idx_far]
-        fpr_far = fprs[idx_far]
+    # Full [n_test, n_users] score matrix in one pass
+    names, T_all, offsets = stack_templates(templates)
+    t2 = time.perf_counter()
+    S = score_matrix(np.stack(embeds, axis=0), T_all, offsets)
+    t3 = time.perf_counter()
+
+    owners = np.asarray(owners, dtype=np.int64)
+    genuine_mask = owners[:, None] == np.arange(len(users))[None, :]
+    y_true = genuine_mask.ravel().astype(np.int32)
+    scores = S.ravel()
+    det_embed_times = np.array(det_embed_times, dtype=np.float32)
+    score_ms = (t3 - t2) * 1000.0 / scores.size
+
+    metrics = verification_metrics(y_true, scores, target_far=target_far)
+    metrics.update({
+        "n_users": len(users),
+        "n_test_images": int(S.shape[0]),
+        "n_genuine": int(genuine_mask.sum()),
+        "n_impostor": int(scores.size - genuine_mask.sum()),
+    })
+    metrics.update(_score_summary(S[genuine_mask], "genuine"))
+    metrics.update(_score_summary(S[~genuine_mask], "impostor"))
 
     timings = {
         "det_embed_ms_mean": float(np.mean(det_embed_times) * 1000.0),
         "det_embed_ms_p50": float(np.median(det_embed_times) * 1000.0),
         "det_embed_ms_p95": float(np.percentile(det_embed_times, 95) * 1000.0),
-        "score_ms_mean": float(np.mean(score_times) * 1000.0),
-        "score_ms_p50": float(np.median(score_times) * 1000.0),
-        "score_ms_p95": float(np.percentile(score_times, 95) * 1000.0),
+        "score_ms_mean": score_ms,
+        "score_matrix_ms": (t3 - t2) * 1000.0,
     }
 
-    metrics = {
-        "eer": float(eer),
-        "th_eer": float(th_eer),
-        "best_f1": float(best_f1),
-        "th_best_f1": float(th_best_f1),
-        "th_at_target_far": float(th_far),
-        "tpr_at_target_far": float(tpr_far),
-        "fpr_at_target_far": float(fpr_far),
-        "n_trials": int(len(scores)),
-    }
+    return metrics, timings
 
+
+def simulate_verification_streaming(test_images: List[ImageRecord],
+                                    templates: Dict[str, np.ndarray],
+                                    run_dir: Path,
+                                    target_far: float = 0.001,
+                                    model: str = "hog",
+                                    cache: EmbeddingCache = None,
+                                    detect_max_side: int = None,
+                                    resume: bool = False,
+                                    chunk_size: int = 256):
+    """simulate_verification with bounded memory and crash recovery.
+
+    Images are embedded in order and scored in chunks of `chunk_size`; each chunk's
+    [chunk, n_users] score rows and timings are appended to a streaming_eval.ScoreLog
+    in `run_dir` and checkpointed, so `resume=True` continues after the last complete
+    chunk of an interrupted run (same users, templates, test list and settings).
+    Metrics are then computed in one pass over the log from fixed-bin histograms:
+    ROC points are exact at the bin edges (1e-4 apart), percentiles are
+    interpolated within a bin, means and maxima are exact. Returns the same
+    (metrics, timings) keys as simulate_verification, except score_matrix_ms
+    (scoring is timed per chunk).
+    """
+    users = list(templates.keys())
+    if len(users) < 2:
+        raise ValueError("Need at least 2 users for positive/negative trials.")
+    user_idx = {u: i for i, u in enumerate(users)}
+    names, T_all, offsets = stack_templates(templates)
+    run_fp = streaming_eval.fingerprint(names, T_all, offsets, [(str(r.path), r.user) for r in test_images],
+                                        model, detect_max_side, chunk_size)
+    log = streaming_eval.ScoreLog(run_dir, run_fp, resume=resume)
+
+    def flush(idx, owners, embeds, det_ms):
+        S = np.full((len(idx), len(users)), np.nan, dtype=np.float32)
+        ok = np.flatnonzero(np.asarray(owners) >= 0)
+        score_ms = 0.0
+        if ok.size:
+            t0 = time.perf_counter()
+            S[ok] = score_matrix(np.stack([embeds[i] for i in ok]), T_all, offsets)
+            score_ms = (time.perf_counter() - t0) * 1000.0 / (ok.size * len(users))
+        log.append_chunk(np.asarray(idx), np.asarray(owners), S, np.asarray(det_ms),
+                         np.full(len(idx), score_ms, dtype=np.float32))
+
+    idx, owners, embeds, det_ms = [], [], [], []
+    for i in tqdm(range(log.n_done, len(test_images)), desc="Embedding test images",
+                  initial=log.n_done, total=len(test_images)):
+        rec = test_images[i]
+        t0 = time.perf_counter()
+        emb, _ = face_embed_from_path(rec.path, model=model, cache=cache, detect_max_side=detect_max_side)
+        det_ms.append((time.perf_counter() - t0) * 1000.0)
+        idx.append(i)
+        owners.append(user_idx[rec.user] if emb is not None else -1)
+        embeds.append(emb)
+        if len(idx) >= chunk_size:
+            flush(idx, owners, embeds, det_ms)
+            idx, owners, embeds, det_ms = [], [], [], []
+    if idx:
+        flush(idx, owners, embeds, det_ms)
+
+    acc = streaming_eval.accumulate(log)
+    genuine, impostor = acc["genuine"], acc["impostor"]
+    if genuine.n == 0:
+        raise RuntimeError("No test scores computed. Check image quality/detection.")
+
+    metrics = metrics_from_roc(streaming_eval.roc_from_histograms(genuine, impostor), target_far=target_far,
+                               n_trials=genuine.n + impostor.n, interpolate_far=False)
+    metrics.update({
+        "n_users": len(users),
+        "n_test_images": acc["n_images"] - acc["n_unusable"],
+        "n_genuine": genuine.n,
+        "n_impostor": impostor.n,
+    })
+    metrics.update(streaming_eval.histogram_summary(genuine, "genuine"))
+    metrics.update(streaming_eval.histogram_summary(impostor, "impostor"))
+
+    det, sc = acc["det_embed_ms"], acc["score_ms"]
+    timings = {
+        "det_embed_ms_mean": det.mean,
+        "det_embed_ms_p50": det.percentile(50),
+        "det_embed_ms_p95": det.percentile(95),
+        "score_ms_mean": sc.mean,
+    }
     return metrics, timings
 
 
@@ -336,14 +1044,66 @@ def simulate_verification(test_images: List[ImageRecord],
 # Runtime API: single-image verification
 # -----------------------------
 
-def load_templates_for_user(user: str, out_dir: Path) -> np.ndarray:
-    """Load templates for a given user from out_dir/<user>.npy; ensure correct dtype/shape and L2-normalize rows."""
-    npy_path = out_dir / f"{user}.npy"
-    if not npy_path.exists():
-        raise FileNotFoundError(f"Templates not found for user '{user}': {npy_path}")
+class TemplateCache:
+    """Process-wide, thread-safe LRU cache of L2-normalized template matrices.
+
+    Entries are keyed by the template file path and revalidated against the
+    file's (mtime_ns, size) on every lookup, so a re-enrolled user is reloaded
+    without restarting the process. Cached matrices are read-only.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max(1, int(max_entries))
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int], np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, npy_path: Path, loader) -> np.ndarray:
+        """Return the cached matrix for npy_path, calling loader(npy_path) on a miss or stale entry."""
+        st = npy_path.stat()
+        sig = (st.st_mtime_ns, st.st_size)
+        key = str(npy_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == sig:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Load outside the lock so a slow disk read does not block other users
+        T = loader(npy_path)
+        T.setflags(write=False)
+        with self._lock:
+            self._entries[key] = (sig, T)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return T
+
+    def invalidate(self, npy_path: Path = None) -> None:
+        """Drop one entry (or all entries when npy_path is None)."""
+        with self._lock:
+            if npy_path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(npy_path), None)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
+
+
+TEMPLATE_CACHE = TemplateCache(max_entries=int(os.getenv("FR_TEMPLATE_CACHE_SIZE", "1024")))
+
+
+def _read_templates(npy_path: Path) -> np.ndarray:
+    """np.load a template file, validate its shape and return float32 rows L2-normalized."""
     T = np.load(npy_path)
     if T.ndim != 2 or T.shape[1] not in (128, 512):
-        raise ValueError(f"Template shape invalid for {user}: {T.shape}")
+        raise ValueError(f"Template shape invalid for {npy_path.stem}: {T.shape}")
     T = T.astype(np.float32)
     # Ensure rows are normalized (some external templates may not be)
     norms = np.linalg.norm(T, axis=1, keepdims=True) + 1e-12
@@ -351,12 +1111,179 @@ def load_templates_for_user(user: str, out_dir: Path) -> np.ndarray:
     return T
 
 
+def load_templates_for_user(user: str, out_dir: Path, use_cache: bool = True) -> np.ndarray:
+    """Load templates for a given user from out_dir/<user>.npy; ensure correct dtype/shape and L2-normalize rows.
+
+    If out_dir holds a packed gallery (see template_gallery.py) the user's rows are served
+    from it instead, unless <user>.npy was modified after the gallery was written (e.g.
+    copied in, or committed by bulk_enroll before its index sync). Otherwise, with
+    use_cache=True (default) the normalized matrix comes from TEMPLATE_CACHE and is only
+    re-read from disk when the file's mtime or size changes. The returned array is read-only.
+    """
+    npy_path = Path(out_dir) / f"{user}.npy"
+    G = template_gallery.open_gallery(out_dir)
+    if G is not None and user in G:
+        try:
+            stale = npy_path.stat().st_mtime_ns > G.mtime_ns
+        except FileNotFoundError:
+            stale = False
+        if not stale:
+            return G.get(user)
+    if not npy_path.exists():
+        raise FileNotFoundError(f"Templates not found for user '{user}': {npy_path}")
+    if not use_cache:
+        return _read_templates(npy_path)
+    return TEMPLATE_CACHE.get(npy_path, _read_templates)
+
+
+def has_user_templates(user: str, out_dir: Path) -> bool:
+    """True if `user` has templates in out_dir, either as <user>.npy or in the packed gallery."""
+    if (Path(out_dir) / f"{user}.npy").exists():
+        return True
+    G = template_gallery.open_gallery(out_dir)
+    return G is not None and user in G
+
+
+def save_user_templates(user: str, out_dir: Path, T: np.ndarray) -> Path:
+    """Persist templates as out_dir/<user>.npy and keep the packed gallery and ANN index (if any) in sync.
+    The .npy is written to a temp file and renamed over the old one, so readers never see a partial file."""
+    npy_path = Path(out_dir) / f"{user}.npy"
+    tmp = npy_path.with_name(f".{npy_path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, T)
+    os.replace(tmp, npy_path)
+    TEMPLATE_CACHE.invalidate(npy_path)
+    gallery_path = Path(out_dir) / template_gallery.GALLERY_FILENAME
+    if gallery_path.exists():
+        template_gallery.upsert_user(gallery_path, user, T)
+    ann_index.update_user(out_dir, user, T)
+    return npy_path
+
+
+ENROLL_STATE_SUFFIX = ".enroll.npz"
+
+
+def enrollment_state_path(user: str, out_dir: Path) -> Path:
+    """out_dir/<user>.enroll.npz: raw enrollment embeddings kept next to the templates."""
+    return Path(out_dir) / f"{user}{ENROLL_STATE_SUFFIX}"
+
+
+def _content_digest(path: Path) -> str:
+    """sha256 hex of a file's bytes (identifies an enrollment image regardless of its name)."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def save_enrollment_state(user: str, out_dir: Path, embeddings: np.ndarray, templates: np.ndarray,
+                          counts: np.ndarray, sources: List[str], params: Dict = None) -> Path:
+    """Atomically write the state update_user_templates continues from.
+
+    embeddings : [N, D] usable enrollment embeddings (before dedup)
+    templates  : [K, D] current centers, counts : [K] embeddings per center
+    sources    : content digests of the images already embedded
+    params     : template settings the user was enrolled with
+                 ({'k_max', 'min_per_cluster', 'cluster_method'}), reused by updates
+    """
+    path = enrollment_state_path(user, out_dir)
+    tmp = path.with_name(f".{path.stem}.{os.getpid()}.tmp.npz")
+    np.savez(tmp, embeddings=np.asarray(embeddings, dtype=np.float32),
+             templates=np.asarray(templates, dtype=np.float32),
+             counts=np.asarray(counts, dtype=np.int64),
+             sources=np.array(list(sources), dtype=str),
+             params=np.array(json.dumps(params or {})))
+    os.replace(tmp, path)
+    return path
+
+
+def load_enrollment_state(user: str, out_dir: Path) -> Union[Dict[str, np.ndarray], None]:
+    """Return the saved enrollment state of `user` ({'embeddings', 'templates', 'counts',
+    'sources', 'params'}), or None for users enrolled before raw embeddings were persisted.
+    'params' is {} for states written before the template settings were recorded."""
+    path = enrollment_state_path(user, out_dir)
+    if not path.exists():
+        return None
+    with np.load(path, allow_pickle=False) as z:
+        return {"embeddings": z["embeddings"], "templates": z["templates"],
+                "counts": z["counts"], "sources": [str(s) for s in z["sources"]],
+                "params": json.loads(str(z["params"])) if "params" in z.files else {}}
+
+
+def _load_rgb(image) -> np.ndarray:
+    """Return a contiguous RGB array for `image`, or None if it cannot be decoded.
+
+    `image` may be a file path (str/Path), raw encoded bytes (e.g. an HTTP upload),
+    or an already decoded OpenCV ndarray (BGR, BGRA or grayscale).
+    """
+    if isinstance(image, np.ndarray):
+        img = image
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        img = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+    else:
+        img = cv2.imread(str(image))
+    if img is None or img.size == 0:
+        return None
+    if img.ndim == 2:
+        code = cv2.COLOR_GRAY2RGB
+    elif img.shape[2] == 4:
+        code = cv2.COLOR_BGRA2RGB
+    else:
+        code = cv2.COLOR_BGR2RGB
+    return np.ascontiguousarray(cv2.cvtColor(img, code))
+
+
+def _detect_faces(img_rgb: np.ndarray, model: str,
+                  detect_max_side: int = None) -> Tuple[List[Tuple[int, int, int, int]], float, float]:
+    """Timed detect_faces; return (boxes, detect_ms, detect_scale). detect_ms includes the resize."""
+    t_det0 = time.perf_counter()
+    boxes, scale = detect_faces(img_rgb, model=model, detect_max_side=detect_max_side)
+    t_det1 = time.perf_counter()
+    return boxes, (t_det1 - t_det0) * 1000.0, scale
+
+
+def _detect_faces_hinted(img_rgb: np.ndarray, model: str, hints, pad: float, refine: bool,
+                         detect_max_side: int = None) -> Tuple[List[Tuple[int, int, int, int]], float, float, str]:
+    """Like _detect_faces but starting from detector hints; return (boxes, detect_ms, detect_scale, mode).
+
+    mode is 'hint' (padded hints used as boxes), 'hint_roi' (refined inside the hints) or
+    'full' when refinement found no face in any hint and the whole frame was searched.
+    """
+    t_det0 = time.perf_counter()
+    boxes = detect_faces_in_hints(img_rgb, hints, model=model, pad=pad, refine=refine,
+                                  detect_max_side=detect_max_side)
+    detect_ms = (time.perf_counter() - t_det0) * 1000.0
+    if boxes:
+        return boxes, detect_ms, 1.0, "hint_roi" if refine else "hint"
+    # A cascade false positive must not hide a face elsewhere in the frame
+    boxes, full_ms, scale = _detect_faces(img_rgb, model, detect_max_side)
+    return boxes, detect_ms + full_ms, scale, "full"
+
+
+def _rejection(claimed_user: str, threshold: float, k_templates, reason: str,
+               detect_ms: float = 0.0, detect_scale: float = 1.0) -> dict:
+    """Verification result for an image that produced no score."""
+    return {
+        "claimed_user": claimed_user,
+        "decision": False,
+        "score": None,
+        "threshold": threshold,
+        "box": None,
+        "timing": {"detect_ms": detect_ms, "embed_ms": 0.0, "score_ms": 0.0, "pipeline_ms": detect_ms,
+                   "detect_scale": detect_scale},
+        "k_templates": k_templates,
+        "reason": reason,
+    }
+
+
 def verify_user_image(claimed_user: str,
-                      image_path: str,
+                      image_path: Union[str, bytes, np.ndarray],
                       out_dir: str = "user_templates",
                       model: str = "hog",
                       threshold: float = 0.95,
-                      return_all: bool = False):
+                      return_all: bool = False,
+                      detect_max_side: int = None,
+                      hint_boxes=None,
+                      hint_pad: float = 0.25,
+                      refine_hints: bool = True):
     """
     Verify a single image against a claimed user.
 
@@ -364,8 +1291,9 @@ def verify_user_image(claimed_user: str,
     ----------
     claimed_user : str
         Username whose templates to load (expects <out_dir>/<user>.npy).
-    image_path : str
-        Path to the input image.
+    image_path : str | bytes | np.ndarray
+        Path to the input image, its raw encoded bytes, or a decoded BGR ndarray
+        (as returned by cv2.imdecode), so request handlers need no temp file.
     out_dir : str
         Directory containing the saved templates.
     model : str
@@ -374,56 +1302,52 @@ def verify_user_image(claimed_user: str,
         Cosine similarity threshold to accept as the claimed user.
     return_all : bool
         If True, return a list of results for all detected faces; otherwise return the best matching face.
+    detect_max_side : int
+        If set, detect on a copy downscaled to this longer side and encode from the
+        full-resolution pixels (see detect_faces). None detects at full resolution.
+    hint_boxes : sequence of (x, y, w, h), optional
+        Face boxes already found by a cheaper detector (e.g. the Haar cascade in
+        /capture_face). Detection then runs only inside each box padded by hint_pad
+        (refine_hints=True) or uses the padded boxes directly (refine_hints=False),
+        instead of a full-frame pass. Falls back to full-frame detection when no
+        face is found inside any hint.
+    hint_pad : float
+        Padding added to each hint box, as a fraction of its width/height per side.
+    refine_hints : bool
+        Run the face locator inside the padded hints (default) rather than trusting them.
 
     Returns
     -------
     dict or list[dict]
         Each result dict has keys: {
           'claimed_user', 'decision' (True/False), 'score' (float),
-          'threshold' (float), 'box' (t, r, b, l), 'timing': {detect_ms, embed_ms, score_ms, pipeline_ms},
+          'threshold' (float), 'box' (t, r, b, l),
+          'timing': {detect_ms, embed_ms, score_ms, pipeline_ms, detect_scale,
+                     detect_mode ('full'|'hint'|'hint_roi')},
           'k_templates' (int)
         }
     """
     T = load_templates_for_user(claimed_user, Path(out_dir))
 
-    t0 = time.perf_counter()
-    img_bgr = cv2.imread(str(image_path))
-    if img_bgr is None:
-        return {
-            "claimed_user": claimed_user,
-            "decision": False,
-            "score": None,
-            "threshold": threshold,
-            "box": None,
-            "timing": {"detect_ms": 0.0, "embed_ms": 0.0, "score_ms": 0.0, "pipeline_ms": 0.0},
-            "k_templates": int(T.shape[0]),
-            "reason": "image_not_found",
-        }
+    img_rgb = _load_rgb(image_path)
+    if img_rgb is None:
+        return _rejection(claimed_user, threshold, int(T.shape[0]), "image_not_found")
 
-    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-    img_rgb = np.ascontiguousarray(img_rgb)
-
-    t_det0 = time.perf_counter()
-    boxes = face_recognition.face_locations(img_rgb, model=model)
-    t_det1 = time.perf_counter()
+    if hint_boxes is not None and len(hint_boxes) > 0:
+        boxes, detect_ms, detect_scale, detect_mode = _detect_faces_hinted(
+            img_rgb, model, hint_boxes, hint_pad, refine_hints, detect_max_side)
+    else:
+        boxes, detect_ms, detect_scale = _detect_faces(img_rgb, model, detect_max_side)
+        detect_mode = "full"
     if not boxes:
-        return {
-            "claimed_user": claimed_user,
-            "decision": False,
-            "score": None,
-            "threshold": threshold,
-            "box": None,
-            "timing": {"detect_ms": (t_det1 - t_det0) * 1000.0, "embed_ms": 0.0, "score_ms": 0.0, "pipeline_ms": (t_det1 - t_det0) * 1000.0},
-            "k_templates": int(T.shape[0]),
-            "reason": "no_face_detected",
-        }
+        rejection = _rejection(claimed_user, threshold, int(T.shape[0]), "no_face_detected", detect_ms, detect_scale)
+        rejection["timing"]["detect_mode"] = detect_mode
+        return rejection
 
     # Encode all detected faces
     t_emb0 = time.perf_counter()
     encs = face_recognition.face_encodings(img_rgb, boxes)
     t_emb1 = time.perf_counter()
-
-    detect_ms = (t_det1 - t_det0) * 1000.0
     embed_ms = (t_emb1 - t_emb0) * 1000.0
 
     results = []
@@ -445,6 +1369,8 @@ def verify_user_image(claimed_user: str,
                 "embed_ms": embed_ms,
                 "score_ms": score_ms,
                 "pipeline_ms": pipeline_ms,
+                "detect_scale": detect_scale,
+                "detect_mode": detect_mode,
             },
             "k_templates": int(T.shape[0]),
         })
@@ -455,6 +1381,380 @@ def verify_user_image(claimed_user: str,
     return best
 
 
+def verify_user_images_batch(pairs,
+                             out_dir: str = "user_templates",
+                             model: str = "hog",
+                             threshold: float = 0.95,
+                             return_all: bool = False,
+                             detect_max_side: int = None):
+    """
+    Verify many (claimed_user, image) pairs in one call. Each image may be a path,
+    raw encoded bytes or a decoded BGR ndarray, as in verify_user_image.
+
+    Each distinct claimed user's templates are loaded once, every image is decoded,
+    detected and embedded, and all faces are then scored in one batched product, each
+    face against its own claimed user's templates only (M faces x K templates, not
+    M x every claimed template).
+
+    Returns
+    -------
+    list
+        One entry per input pair, in input order, shaped like verify_user_image's return
+        value (a dict, or a list of dicts when return_all=True). 'timing.score_ms' is the
+        batch scoring time divided by the number of faces scored. Pairs whose user has no
+        templates get reason='templates_not_found' instead of raising.
+    """
+    pairs = list(pairs)
+    out = Path(out_dir)
+
+    # Templates: each distinct user once
+    user_ids: Dict[str, int] = {}
+    mats: List[np.ndarray] = []
+    for user, _ in pairs:
+        if user in user_ids:
+            continue
+        try:
+            mats.append(load_templates_for_user(user, out))
+            user_ids[user] = len(mats) - 1
+        except FileNotFoundError:
+            user_ids[user] = -1
+    # Decode, detect and embed every image
+    items: List[object] = [None] * len(pairs)
+    face_item, face_user, face_box, face_enc = [], [], [], []
+    for i, (user, image) in enumerate(pairs):
+        uid = user_ids[user]
+        if uid < 0:
+            items[i] = _rejection(user, threshold, None, "templates_not_found")
+            continue
+        k_templates = int(mats[uid].shape[0])
+        img_rgb = _load_rgb(image)
+        if img_rgb is None:
+            items[i] = _rejection(user, threshold, k_templates, "image_not_found")
+            continue
+        boxes, detect_ms, detect_scale = _detect_faces(img_rgb, model, detect_max_side)
+        if not boxes:
+            items[i] = _rejection(user, threshold, k_templates, "no_face_detected", detect_ms, detect_scale)
+            continue
+        t_emb0 = time.perf_counter()
+        encs = face_recognition.face_encodings(img_rgb, boxes)
+        t_emb1 = time.perf_counter()
+        items[i] = (detect_ms, (t_emb1 - t_emb0) * 1000.0, detect_scale)
+        for box, enc in zip(boxes, encs):
+            face_item.append(i)
+            face_user.append(uid)
+            face_box.append(box)
+            face_enc.append(l2norm(enc.astype(np.float32)))
+
+    # Every face against its own claimed user's templates, padded to [U, K_max, D]
+    scores = np.zeros(0, dtype=np.float32)
+    score_ms = 0.0
+    if face_enc:
+        t_s0 = time.perf_counter()
+        k = np.array([m.shape[0] for m in mats])
+        padded = np.zeros((len(mats), int(k.max()), mats[0].shape[1]), dtype=np.float32)
+        for uid, m in enumerate(mats):
+            padded[uid, :m.shape[0]] = m
+        fu = np.asarray(face_user)
+        S = np.einsum("md,mkd->mk", np.stack(face_enc, axis=0), padded[fu])  # [M, K_max]
+        S[np.arange(S.shape[1])[None, :] >= k[fu][:, None]] = -np.inf
+        scores = S.max(axis=1)
+        t_s1 = time.perf_counter()
+        score_ms = (t_s1 - t_s0) * 1000.0 / len(face_enc)
+
+    per_item_faces: Dict[int, List[dict]] = {}
+    for item, uid, box, score in zip(face_item, face_user, face_box, scores):
+        user = pairs[item][0]
+        detect_ms, embed_ms, detect_scale = items[item]
+        per_item_faces.setdefault(item, []).append({
+            "claimed_user": user,
+            "decision": bool(score >= threshold),
+            "score": float(score),
+            "threshold": threshold,
+            "box": box,
+            "timing": {
+                "detect_ms": detect_ms,
+                "embed_ms": embed_ms,
+                "score_ms": score_ms,
+                "pipeline_ms": detect_ms + embed_ms + score_ms,
+                "detect_scale": detect_scale,
+            },
+            "k_templates": int(mats[uid].shape[0]),
+        })
+
+    results = []
+    for i, item in enumerate(items):
+        if isinstance(item, dict):
+            results.append(item)
+        elif return_all:
+            results.append(per_item_faces[i])
+        else:
+            results.append(max(per_item_faces[i], key=lambda r: r["score"]))
+    return results
+
+
+# -----------------------------
+# Runtime API: 1:N identification over the whole gallery
+# -----------------------------
+
+class _DirGalleryCache:
+    """Stacked [N, D] matrix of every <user>.npy in a directory (used when no packed gallery exists).
+
+    Rebuilt only when the set of files or any file's (mtime_ns, size) changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[tuple, Tuple[List[str], np.ndarray, np.ndarray]]] = {}
+
+    def get(self, out_dir: Path) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        out_dir = Path(out_dir)
+        if not out_dir.is_dir():
+            raise FileNotFoundError(f"Templates directory not found: {out_dir}")
+        files = []
+        with os.scandir(out_dir) as it:
+            for e in it:
+                if e.name.endswith(".npy") and not e.name.startswith(".") and e.is_file():
+                    st = e.stat()
+                    files.append((e.name[:-4], st.st_mtime_ns, st.st_size))
+        files.sort(key=lambda f: (f[0].lower(), f[0]))
+        sig = tuple(files)
+        key = str(out_dir)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == sig:
+                return entry[1]
+
+        names = [f[0] for f in files]
+        mats = [load_templates_for_user(n, out_dir) for n in names]
+        offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum([m.shape[0] for m in mats], out=offsets[1:])
+        T_all = np.concatenate(mats, axis=0) if mats else np.zeros((0, 128), dtype=np.float32)
+        T_all.setflags(write=False)
+        result = (names, T_all, offsets)
+        with self._lock:
+            self._entries[key] = (sig, result)
+        return result
+
+
+_DIR_GALLERY_CACHE = _DirGalleryCache()
+
+
+class _FreshGalleryCache:
+    """Packed gallery with the <user>.npy files written after it layered on top.
+
+    Applies load_templates_for_user's rule to the whole gallery: a .npy newer than the
+    gallery replaces that user's rows, and one missing from it adds the user. The directory is only rescanned
+    when its mtime changes (templates are written with a rename, which updates it) or the
+    gallery is reopened; with no newer files the gallery's own memory map is returned.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[object, int, Tuple[List[str], np.ndarray, np.ndarray]]] = {}
+
+    def get(self, out_dir: Path, G) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        out_dir = Path(out_dir)
+        dir_mtime = os.stat(out_dir).st_mtime_ns
+        key = str(out_dir)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is G and entry[1] == dir_mtime:
+                return entry[2]
+
+        newer = template_gallery.newer_npy_users(out_dir, G)
+        if not newer:
+            result = (G.names, G.matrix, G.offsets)
+        else:
+            templates = {n: G.get(n) for n in G.names}
+            for n in newer:
+                templates[n] = _read_templates(out_dir / f"{n}.npy")
+            names = sorted(templates, key=lambda n: (n.lower(), n))
+            offsets = np.zeros(len(names) + 1, dtype=np.int64)
+            np.cumsum([templates[n].shape[0] for n in names], out=offsets[1:])
+            T_all = np.concatenate([templates[n] for n in names], axis=0).astype(np.float32, copy=False)
+            T_all.setflags(write=False)
+            result = (names, T_all, offsets)
+        with self._lock:
+            self._entries[key] = (G, dir_mtime, result)
+        return result
+
+
+_FRESH_GALLERY_CACHE = _FreshGalleryCache()
+
+
+def load_gallery_matrix(out_dir: Path) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """Return (names, T_all [N, D], offsets [U+1]) covering every enrolled user.
+
+    Rows of names[i] are T_all[offsets[i]:offsets[i + 1]]. Served from the packed
+    gallery when present (with any <user>.npy newer than it taking precedence, as in
+    load_templates_for_user), otherwise stacked from the per-user .npy files and cached.
+    """
+    G = template_gallery.open_gallery(out_dir)
+    if G is not None:
+        return _FRESH_GALLERY_CACHE.get(Path(out_dir), G)
+    return _DIR_GALLERY_CACHE.get(Path(out_dir))
+
+
+def rank_users(q: np.ndarray, T_all: np.ndarray, offsets: np.ndarray,
+               top_k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+    """Score q against every template in one matrix product, reduce per user with max,
+    and return (user_indices, scores) of the top_k users sorted by descending score."""
+    n_users = len(offsets) - 1
+    if n_users <= 0 or T_all.shape[0] == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    S = T_all @ l2norm(q)
+    starts = offsets[:-1]
+    counts = np.diff(offsets)
+    # reduceat needs valid start indices; users without rows get -inf
+    user_scores = np.maximum.reduceat(S, np.minimum(starts, S.shape[0] - 1))
+    user_scores[counts == 0] = -np.inf
+    k = max(1, min(int(top_k), n_users))
+    if k < n_users:
+        idx = np.argpartition(-user_scores, k - 1)[:k]
+    else:
+        idx = np.arange(n_users)
+    idx = idx[np.argsort(-user_scores[idx], kind="stable")]
+    return idx, user_scores[idx]
+
+
+def identify_image(image_path: Union[str, bytes, np.ndarray],
+                   top_k: int = 5,
+                   out_dir: str = "user_templates",
+                   model: str = "hog",
+                   threshold: float = 0.95,
+                   use_ann: bool = None,
+                   n_probe: int = ann_index.DEFAULT_N_PROBE,
+                   detect_max_side: int = None,
+                   quantized: str = None,
+                   rescore: int = 32):
+    """
+    Identify the largest face in an image against every enrolled user (1:N).
+    image_path may be a path, raw encoded bytes or a decoded BGR ndarray.
+
+    use_ann : None (default) searches the IVF index when <out_dir>/gallery.ivf.npz exists and
+        falls back to exact search otherwise; True requires the index; False forces exact search.
+    n_probe : inverted lists scanned per query when searching the index (recall/latency knob).
+    detect_max_side : detect on a downscaled copy (see detect_faces); None = full resolution.
+    quantized : 'float16' | 'int8' | None. For exact (non-IVF) search, rank users on a quantized
+        copy of the gallery first and rescore the best `rescore` users in float32
+        (see quantized_gallery.py). Scores of returned matches are exact.
+
+    Returns
+    -------
+    dict with keys: {
+      'matches' : [{'user', 'score'}, ...] top_k users by descending max-cosine score,
+      'identified' : best user if its score >= threshold else None,
+      'threshold', 'box' (t, r, b, l), 'n_users', 'n_templates',
+      'search' ('exact' | 'ivf' | 'float16' | 'int8'),
+      'timing': {detect_ms, embed_ms, score_ms, pipeline_ms, detect_scale}
+    }
+    plus 'reason' ('image_not_found' | 'no_face_detected') when no face could be scored.
+    """
+    index = ann_index.open_index(out_dir) if use_ann is not False else None
+    if use_ann and index is None:
+        raise FileNotFoundError(f"No ANN index in {out_dir}; build it with `python ann_index.py build {out_dir}`")
+    qgallery = None
+    if index is not None:
+        names, n_templates = index.names, index.n_rows
+    else:
+        names, T_all, offsets = load_gallery_matrix(Path(out_dir))
+        n_templates = int(T_all.shape[0])
+        if quantized:
+            qgallery = quantized_gallery.quantized_for(str(Path(out_dir).resolve()), names, T_all, offsets, quantized)
+
+    result = {
+        "matches": [],
+        "identified": None,
+        "threshold": threshold,
+        "box": None,
+        "n_users": len(names),
+        "n_templates": n_templates,
+        "search": "ivf" if index is not None else (qgallery.dtype if qgallery is not None else "exact"),
+        "timing": {"detect_ms": 0.0, "embed_ms": 0.0, "score_ms": 0.0, "pipeline_ms": 0.0, "detect_scale": 1.0},
+    }
+
+    img_rgb = _load_rgb(image_path)
+    if img_rgb is None:
+        result["reason"] = "image_not_found"
+        return result
+
+    boxes, detect_ms, detect_scale = _detect_faces(img_rgb, model, detect_max_side)
+    if not boxes:
+        result["timing"].update(detect_ms=detect_ms, pipeline_ms=detect_ms, detect_scale=detect_scale)
+        result["reason"] = "no_face_detected"
+        return result
+    box = largest_box(boxes)
+
+    t_emb0 = time.perf_counter()
+    encs = face_recognition.face_encodings(img_rgb, [box])
+    t_emb1 = time.perf_counter()
+    embed_ms = (t_emb1 - t_emb0) * 1000.0
+
+    t_s0 = time.perf_counter()
+    q = encs[0].astype(np.float32)
+    if index is not None:
+        idx, scores = index.search(q, top_k=top_k, n_probe=n_probe)
+    elif qgallery is not None:
+        idx, scores = qgallery.rank(l2norm(q), T_all, top_k=top_k, rescore=rescore)
+    else:
+        idx, scores = rank_users(q, T_all, offsets, top_k=top_k)
+    t_s1 = time.perf_counter()
+    score_ms = (t_s1 - t_s0) * 1000.0
+
+    matches = [{"user": names[i], "score": float(sc)} for i, sc in zip(idx, scores)]
+    result.update(
+        matches=matches,
+        identified=matches[0]["user"] if matches and matches[0]["score"] >= threshold else None,
+        box=box,
+        timing={
+            "detect_ms": detect_ms,
+            "embed_ms": embed_ms,
+            "score_ms": score_ms,
+            "pipeline_ms": detect_ms + embed_ms + score_ms,
+            "detect_scale": detect_scale,
+        },
+    )
+    return result
+
+
+# -----------------------------
+# Runtime API: warm-up
+# -----------------------------
+
+def warm_up_models(out_dir: str = "user_templates", model: str = "hog",
+                   quantized: str = None) -> Dict[str, float]:
+    """Pay the first-request costs up front: dlib's detector, shape predictor and encoder,
+    and the template gallery.
+
+    Runs one detection and one encoding on a synthetic image (the encoding uses a fixed
+    centred box, so the landmark and ResNet models run even though no face is found),
+    then loads the gallery (load_gallery_matrix, which also fills TEMPLATE_CACHE for a
+    directory of .npy files), reads every row once so a memory-mapped packed gallery is
+    resident, and builds the quantized copy when `quantized` is set.
+    Returns the time of each step in ms and the gallery size.
+    """
+    rng = np.random.default_rng(0)
+    img_rgb = cv2.GaussianBlur((rng.random((160, 160, 3)) * 255).astype(np.uint8), (0, 0), 2.0)
+    t0 = time.perf_counter()
+    detect_faces(img_rgb, model=model)
+    t1 = time.perf_counter()
+    face_recognition.face_encodings(img_rgb, [(40, 120, 120, 40)])
+    t2 = time.perf_counter()
+    n_users = n_templates = 0
+    try:
+        names, T_all, offsets = load_gallery_matrix(Path(out_dir))
+        n_users, n_templates = len(names), int(T_all.shape[0])
+        if n_templates:
+            float(np.asarray(T_all, dtype=np.float32).sum())
+            if quantized:
+                quantized_gallery.quantized_for(str(Path(out_dir).resolve()), names, T_all, offsets, quantized)
+    except FileNotFoundError:
+        pass
+    t3 = time.perf_counter()
+    return {"detect_ms": (t1 - t0) * 1000.0, "encode_ms": (t2 - t1) * 1000.0, "gallery_ms": (t3 - t2) * 1000.0,
+            "n_users": n_users, "n_templates": n_templates}
+
+
 # -----------------------------
 # Runtime API: enroll a new user from a folder
 # -----------------------------
@@ -468,7 +1768,15 @@ def enroll_user_from_folder(user: str,
                             overwrite: bool = False,
                             verbose: bool = False,
                             min_blur: float = 40.0,
-                            min_size: int = 64):
+                            min_size: int = 64,
+                            workers: int = 1,
+                            cache: EmbeddingCache = None,
+                            detect_max_side: int = None,
+                            image_paths: List[Path] = None,
+                            cluster_method: str = "kmeans",
+                            n_init: int = 10,
+                            early_reject: bool = False,
+                            min_file_bytes: int = 0):
     """
     Create or refresh templates for a user from a folder of images.
 
@@ -493,19 +1801,35 @@ def enroll_user_from_folder(user: str,
         Print diagnostics.
     min_blur : float, min_size : int
         Quality gates for enrollment.
+    workers : int
+        Processes used for decoding, quality gate and embedding (1 = serial).
+    cache : EmbeddingCache
+        Optional embedding cache; unchanged images are not re-embedded.
+    detect_max_side : int
+        Detect on images downscaled to this longer side (None = full resolution).
+    image_paths : list of Path
+        Images to enroll, already listed (e.g. by bulk_enroll's dataset scan);
+        folder_path is then not scanned.
+    cluster_method : str, n_init : int
+        Clustering backend and number of seedings for build_templates
+        ('kmeans' | 'minibatch' | 'spherical').
+    early_reject : bool, min_file_bytes : int
+        Cheap quality-gate stages run before the full decode (see face_embed_from_path).
 
     Returns
     -------
     dict with keys: {
         'user', 'status' ('created'|'overwritten'|'exists'|'no_images'|'no_usable_images'),
-        'templates_path', 'k', 'n_images', 'n_usable'
+        'templates_path', 'k', 'n_images', 'n_usable', 'images_per_sec',
+        'gate' (per-stage quality-gate rejects and ms, see GateStats)
     }
     """
     out = Path(out_dir)
     out.mkdir(parents=True, exist_ok=True)
     npy_path = out / f"{user}.npy"
 
-    if npy_path.exists() and not overwrite:
+    existed = has_user_templates(user, out)
+    if existed and not overwrite:
         return {
             "user": user,
             "status": "exists",
@@ -517,7 +1841,7 @@ def enroll_user_from_folder(user: str,
 
     # Gather images
     folder = Path(folder_path)
-    if not folder.exists() or not folder.is_dir():
+    if image_paths is None and (not folder.exists() or not folder.is_dir()):
         return {
             "user": user,
             "status": "no_images",
@@ -526,7 +1850,7 @@ def enroll_user_from_folder(user: str,
             "n_images": 0,
             "n_usable": 0,
         }
-    paths = list_images(folder)
+    paths = list_images(folder) if image_paths is None else [Path(p) for p in image_paths]
     if len(paths) == 0:
         return {
             "user": user,
@@ -538,13 +1862,16 @@ def enroll_user_from_folder(user: str,
         }
 
     # Encode and filter
-    embeds = []
     if verbose:
         print(f"[Enroll] {user}: scanning {len(paths)} images in {folder}")
-    for p in tqdm(paths, desc=f"Embedding {user}"):
-        e, _ = face_embed_from_path(p, model=model, min_blur=min_blur, min_size=min_size)
-        if e is not None:
-            embeds.append(e)
+    results, embed_stats = embed_images(paths, model=model, min_blur=min_blur, min_size=min_size,
+                                        workers=workers, desc=f"Embedding {user}", cache=cache,
+                                        detect_max_side=detect_max_side, early_reject=early_reject,
+                                        min_file_bytes=min_file_bytes)
+    embeds = [e for e, _ in results if e is not None]
+    if verbose:
+        print(f"[Enroll] {user}: {embed_stats['images_per_sec']:.1f} images/sec with {workers} worker(s)")
+        print(f"[Enroll] {user}: quality gate {embed_stats['gate']}")
     n_usable = len(embeds)
     if n_usable == 0:
         return {
@@ -554,25 +1881,150 @@ def enroll_user_from_folder(user: str,
             "k": None,
             "n_images": len(paths),
             "n_usable": 0,
+            "images_per_sec": embed_stats["images_per_sec"],
+            "gate": embed_stats["gate"],
         }
 
     # Build templates
-    T = build_templates(embeds, k_max=k_max, min_per_cluster=min_per_cluster).astype(np.float32)
-    if npy_path.exists() and overwrite:
-        try:
-            npy_path.unlink()
-        except Exception:
-            pass
-    np.save(npy_path, T)
+    T = build_templates(embeds, k_max=k_max, min_per_cluster=min_per_cluster,
+                        method=cluster_method, n_init=n_init).astype(np.float32)
+    # Raw embeddings first: update_user_templates continues from this state. The old
+    # <user>.npy stays in place until save_user_templates atomically replaces it.
+    save_enrollment_state(user, out, np.stack(embeds), T, template_counts(embeds, T),
+                          [d for d in embed_stats["digests"] if d is not None],
+                          params={"k_max": k_max, "min_per_cluster": min_per_cluster,
+                                  "cluster_method": cluster_method})
+    save_user_templates(user, out, T)
 
     return {
         "user": user,
-        "status": "overwritten" if overwrite and npy_path.exists() else "created",
+        "status": "overwritten" if overwrite and existed else "created",
         "templates_path": str(npy_path),
         "k": int(T.shape[0]),
         "n_images": len(paths),
         "n_usable": n_usable,
+        "images_per_sec": embed_stats["images_per_sec"],
+        "gate": embed_stats["gate"],
+    }
+
+
+def update_user_templates(user: str,
+                          new_images,
+                          out_dir: str = "user_templates",
+                          model: str = "hog",
+                          k_max: int = None,
+                          min_per_cluster: int = None,
+                          verbose: bool = False,
+                          min_blur: float = 40.0,
+                          min_size: int = 64,
+                          workers: int = 1,
+                          cache: EmbeddingCache = None,
+                          detect_max_side: int = None,
+                          early_reject: bool = False,
+                          min_file_bytes: int = 0):
+    """
+    Add new images to an enrolled user without re-embedding the old ones.
+
+    Only images not embedded before (by content) go through the quality gate and
+    the embedder. Their embeddings are deduplicated against the stored ones and
+    folded into the existing centers with update_templates_online; the raw
+    embeddings and the new templates are then written atomically.
+
+    Parameters
+    ----------
+    user : str
+        Enrolled username (templates at <out_dir>/<user>.npy).
+    new_images : list of str/Path, or a folder path
+        Images to add; a directory is searched recursively.
+    out_dir, model, k_max, min_per_cluster, verbose, min_blur, min_size, workers, cache, detect_max_side,
+    early_reject, min_file_bytes
+        As in enroll_user_from_folder. k_max and min_per_cluster default to the values
+        the user was enrolled with (recorded in the enrollment state), else 5 and 12.
+
+    Returns
+    -------
+    dict with keys: {
+        'user', 'status' ('updated'|'no_templates'|'no_new_images'|'no_usable_images'),
+        'templates_path', 'k', 'n_images', 'n_new', 'n_usable', 'n_total', 'gate' (when images were embedded)
     }
+    Users enrolled before raw embeddings were persisted are updated from their
+    templates alone, each center weighted as min_per_cluster embeddings.
+    """
+    out = Path(out_dir)
+    npy_path = out / f"{user}.npy"
+    result = {"user": user, "status": None, "templates_path": str(npy_path), "k": None,
+              "n_images": 0, "n_new": 0, "n_usable": 0, "n_total": None}
+    if not has_user_templates(user, out):
+        result.update(status="no_templates", templates_path=None)
+        return result
+
+    if isinstance(new_images, (str, Path)) and Path(new_images).is_dir():
+        paths = list_images(Path(new_images))
+    else:
+        paths = [Path(p) for p in new_images]
+    result["n_images"] = len(paths)
+
+    state = load_enrollment_state(user, out)
+    enrolled = state["params"] if state is not None else {}
+    params = {"k_max": int(k_max if k_max is not None else enrolled.get("k_max", 5)),
+              "min_per_cluster": int(min_per_cluster if min_per_cluster is not None
+                                     else enrolled.get("min_per_cluster", 12)),
+              "cluster_method": enrolled.get("cluster_method", "kmeans")}
+    k_max, min_per_cluster = params["k_max"], params["min_per_cluster"]
+    if state is None:
+        T = np.array(load_templates_for_user(user, out, use_cache=False), dtype=np.float32)
+        state = {"embeddings": np.zeros((0, T.shape[1]), dtype=np.float32), "templates": T,
+                 "counts": np.full(T.shape[0], min_per_cluster, dtype=np.int64), "sources": []}
+
+    # Skip images already embedded (same content) and repeats within new_images
+    seen = set(state["sources"])
+    new_paths, new_sources = [], []
+    for p in paths:
+        try:
+            digest = _content_digest(p)
+        except OSError:
+            continue
+        if digest not in seen:
+            seen.add(digest)
+            new_paths.append(p)
+            new_sources.append(digest)
+    result["n_new"] = len(new_paths)
+    if not new_paths:
+        result.update(status="no_new_images", k=int(state["templates"].shape[0]),
+                      n_total=int(state["embeddings"].shape[0]))
+        return result
+
+    results, embed_stats = embed_images(new_paths, model=model, min_blur=min_blur, min_size=min_size,
+                                        workers=workers, desc=f"Embedding {user}", cache=cache,
+                                        detect_max_side=detect_max_side, early_reject=early_reject,
+                                        min_file_bytes=min_file_bytes)
+    embeds = [e for e, _ in results if e is not None]
+    result["n_usable"] = len(embeds)
+    result["gate"] = embed_stats["gate"]
+    if verbose:
+        print(f"[Update] {user}: {len(embeds)}/{len(new_paths)} new images usable "
+              f"({embed_stats['images_per_sec']:.1f} images/sec)")
+    sources = state["sources"] + new_sources
+    if not embeds:
+        # Remember the rejected images so they are not re-embedded next time
+        save_enrollment_state(user, out, state["embeddings"], state["templates"], state["counts"], sources,
+                              params=params)
+        result.update(status="no_usable_images", k=int(state["templates"].shape[0]),
+                      n_total=int(state["embeddings"].shape[0]))
+        return result
+
+    # Dedup the new rows against the stored ones (same rule as build_templates)
+    E_old = state["embeddings"]
+    E_new = np.stack(embeds).astype(np.float32)
+    E_all = np.concatenate([E_old, E_new], axis=0)
+    keep = dedup_keep_mask(np.stack([l2norm(e) for e in E_all]), near_cos=0.995)[E_old.shape[0]:]
+    T, counts = update_templates_online(state["templates"], state["counts"], list(E_new[keep]),
+                                        k_max=k_max, min_per_cluster=min_per_cluster)
+
+    save_enrollment_state(user, out, E_all, T, counts, sources, params=params)
+    save_user_templates(user, out, T)
+    result.update(status="updated", k=int(T.shape[0]), n_total=int(E_all.shape[0]))
+    return result
 
 
 def is_name_not_in_list(name: str) -> bool:
@@ -644,7 +2096,8 @@ def is_name_not_in_list(name: str) -> bool:
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument('--root', type=str, required=True, help='Path to FRDS2 root folder')
-    ap.add_argument('--users', type=str, default='', help='Comma-separated two users to include')
+    ap.add_argument('--users', type=str, default='', help='Comma-separated users to include (2 or more)')
+    ap.add_argument('--all-users', action='store_true', help='Evaluate every user folder under --root (N-user mode); users with < 10 images are skipped')
     ap.add_argument('--enroll-ratio', type=float, default=0.7, help='Fraction of images for enrollment')
     ap.add_argument('--seed', type=int, default=42)
     ap.add_argument('--k', type=int, default=5, help='Max K-means centroids per user (templates)')
@@ -652,30 +2105,47 @@ def main():
     ap.add_argument('--target-far', type=float, default=0.001, help='Target false accept rate for threshold selection')
     ap.add_argument('--out', type=str, default='user_templates', help='Directory to save templates and splits')
     ap.add_argument('--min-per-cluster', type=int, default=12, help='Minimum samples per KMeans cluster before using multi-centroid')
+    ap.add_argument('--cluster', type=str, default='kmeans', choices=list(CLUSTER_METHODS), help='Template clustering backend (spherical = numpy spherical k-means)')
+    ap.add_argument('--n-init', type=int, default=10, help='Clustering seedings per user (best kept)')
     ap.add_argument('--verbose', action='store_true', help='Print extra diagnostics during enrollment/verification')
     ap.add_argument('--skip-enroll', action='store_true', help='Skip building embeddings/templates and load existing templates from --out directory')
+    ap.add_argument('--workers', type=int, default=1, help='Processes used for enrollment embedding (1 = serial)')
+    ap.add_argument('--detect-max-side', type=int, default=None, help='Detect faces on images downscaled to this longer side (default: full resolution)')
+    ap.add_argument('--early-reject', action='store_true', help='Blur/size pre-check on a reduced-resolution decode of JPEGs before the full decode (faster on noisy folders, may reject images the full check accepts)')
+    ap.add_argument('--min-file-bytes', type=int, default=0, help='Reject image files smaller than this without reading them')
+    ap.add_argument('--embed-cache', type=str, default='', help='Embedding cache file reused across runs (e.g. user_templates/embeddings.cache)')
+    ap.add_argument('--stream-log', type=str, default='', help='Run directory for streaming evaluation: per-image scores are logged in chunks and metrics computed from the log in constant memory')
+    ap.add_argument('--resume', action='store_true', help='Continue an interrupted --stream-log run (use with --skip-enroll so templates match)')
+    ap.add_argument('--chunk-size', type=int, default=256, help='Test images per --stream-log chunk/checkpoint')
     args = ap.parse_args()
 
     root = Path(args.root)
     out_dir = Path(args.out)
     out_dir.mkdir(parents=True, exist_ok=True)
+    cache = EmbeddingCache(args.embed_cache) if args.embed_cache else None
 
     users = []
     if args.users:
         users = [u.strip() for u in args.users.split(',') if u.strip()]
+    elif args.all_users:
+        users = find_users(root)
     else:
         users = find_users(root)[:2]
 
-    if len(users) != 2:
-        raise SystemExit(f"Need exactly 2 users. Got: {users}")
-
     # Build splits
     splits: Dict[str, Split] = {}
     for u in users:
         paths = list_images(root / u)
         if len(paths) < 10:
+            if args.all_users:
+                print(f"Skipping {u}: too few images ({len(paths)})")
+                continue
             raise SystemExit(f"User {u} has too few images ({len(paths)}). Need >= 10.")
         splits[u] = make_split(paths, u, ratio=args.enroll_ratio, seed=args.seed)
+    users = [u for u in users if u in splits]
+
+    if len(users) < 2:
+        raise SystemExit(f"Need at least 2 users. Got: {users}")
 
     # Persist split for reproducibility
     split_json = {
@@ -691,22 +2161,24 @@ def main():
     if args.skip_enroll:
         # Load precomputed templates from disk
         for u in users:
-            npy_path = out_dir / f"{u}.npy"
-            if not npy_path.exists():
-                raise SystemExit(f"--skip-enroll set but templates not found for {u}: {npy_path}")
-            T = np.load(npy_path)
-            if T.ndim != 2 or T.shape[1] not in (128, 512):
-                raise SystemExit(f"Template shape invalid for {u}: {T.shape}")
-            templates[u] = T.astype(np.float32)
-            print(f"Loaded templates: {u}.npy with shape {templates[u].shape}")
+            try:
+                templates[u] = load_templates_for_user(u, out_dir)
+            except FileNotFoundError:
+                raise SystemExit(f"--skip-enroll set but templates not found for {u} in {out_dir}")
+            except ValueError as e:
+                raise SystemExit(str(e))
+            print(f"Loaded templates: {u} with shape {templates[u].shape}")
     else:
         for u in users:
-            embeds = []
             print(f"[Enrollment] {u}: {len(splits[u].enroll)} images")
-            for rec in tqdm(splits[u].enroll, desc=f"Embedding {u}"):
-                e, _ = face_embed_from_path(rec.path, model=args.model)
-                if e is not None:
-                    embeds.append(e)
+            results, embed_stats = embed_images([rec.path for rec in splits[u].enroll], model=args.model,
+                                                workers=args.workers, desc=f"Embedding {u}", cache=cache,
+                                                detect_max_side=args.detect_max_side, early_reject=args.early_reject,
+                                                min_file_bytes=args.min_file_bytes)
+            embeds = [e for e, _ in results if e is not None]
+            print(f"[Enrollment] {u}: {embed_stats['images_per_sec']:.1f} images/sec with {args.workers} worker(s)")
+            if args.verbose:
+                print(f"[Enrollment] {u}: quality gate {embed_stats['gate']}")
             if len(embeds) < 3:
                 raise SystemExit(f"Not enough usable enroll embeddings for {u} (got {len(embeds)}).")
             # Diagnostics: how many survive dedup? and what K will we use?
@@ -717,19 +2189,35 @@ def main():
                     print(f"[Enrollment] {u}: usable={len(embeds)} after_dedup={E_dedup.shape[0]}")
             except Exception:
                 pass
-            T = build_templates(embeds, k_max=args.k, min_per_cluster=args.min_per_cluster)
+            T = build_templates(embeds, k_max=args.k, min_per_cluster=args.min_per_cluster,
+                                method=args.cluster, n_init=args.n_init)
             if args.verbose:
                 print(f"[Enrollment] {u}: templates K={T.shape[0]}")
             templates[u] = T.astype(np.float32)
-            np.save(out_dir / f"{u}.npy", templates[u])
+            save_enrollment_state(u, out_dir, np.stack(embeds), templates[u], template_counts(embeds, templates[u]),
+                                  [d for d in embed_stats["digests"] if d is not None],
+                                  params={"k_max": args.k, "min_per_cluster": args.min_per_cluster,
+                                          "cluster_method": args.cluster})
+            save_user_templates(u, out_dir, templates[u])
             print(f"Saved templates: {u}.npy with shape {templates[u].shape}")
 
     # Online verification (evaluation)
-    test_images = splits[users[0]].test + splits[users[1]].test
-    metrics, timings = simulate_verification(test_images, templates, target_far=args.target_far, model=args.model)
+    test_images = [rec for u in users for rec in splits[u].test]
+    if args.stream_log:
+        try:
+            metrics, timings = simulate_verification_streaming(
+                test_images, templates, Path(args.stream_log), target_far=args.target_far, model=args.model,
+                cache=cache, detect_max_side=args.detect_max_side, resume=args.resume, chunk_size=args.chunk_size)
+        except (FileExistsError, ValueError) as e:
+            raise SystemExit(str(e))
+    else:
+        metrics, timings = simulate_verification(test_images, templates, target_far=args.target_far, model=args.model,
+                                                 cache=cache, detect_max_side=args.detect_max_side)
+    if cache is not None:
+        print(f"Embedding cache: {cache.stats()}")
 
     print("\n================= RESULTS =================")
-    print(f"Users: {users}")
+    print(f"Users ({len(users)}): {users if len(users) <= 10 else users[:10] + ['...']}")
     print(json.dumps(metrics, indent=2))
     print("\nTimings (ms):")
     for k, v in timings.items():
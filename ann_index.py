@@ -0,0 +1,289 @@
+"""
+Approximate nearest-neighbour index for large-gallery identification
+
+IVF-Flat over the stored templates: templates are partitioned into `n_lists`
+inverted lists by spherical k-means on a sample, and a query only scores the
+templates in its `n_probe` closest lists. `n_probe` is the recall/latency knob:
+n_probe == n_lists is exact search, small values trade recall for speed.
+
+The index lives next to the templates as <templates_dir>/gallery.ivf.npz and is
+updated incrementally (per user, no re-training) when a user is (re-)enrolled.
+
+Usage
+-----
+python ann_index.py build user_templates --n-lists 256
+python ann_index.py info user_templates
+"""
+
+import argparse
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import template_gallery
+
+INDEX_FILENAME = "gallery.ivf.npz"
+DEFAULT_N_PROBE = 8
+
+
+def _normalize_rows(X: np.ndarray) -> np.ndarray:
+    X = np.asarray(X, dtype=np.float32)
+    return X / (np.linalg.norm(X, axis=1, keepdims=True) + 1e-12)
+
+
+def train_centroids(X: np.ndarray, n_lists: int, n_iter: int = 15,
+                    sample_size: int = 64, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on at most `sample_size * n_lists` rows of X; returns [n_lists, D] unit centroids."""
+    rng = np.random.default_rng(seed)
+    n = X.shape[0]
+    n_lists = max(1, min(int(n_lists), n))
+    m = min(n, sample_size * n_lists)
+    S = X[rng.choice(n, size=m, replace=False)] if m < n else X
+    S = _normalize_rows(S)
+    C = S[rng.choice(S.shape[0], size=n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = np.argmax(S @ C.T, axis=1)
+        sums = np.zeros_like(C)
+        np.add.at(sums, assign, S)
+        counts = np.bincount(assign, minlength=n_lists)
+        empty = counts == 0
+        if np.any(empty):
+            # Re-seed empty lists with random sample rows
+            sums[empty] = S[rng.choice(S.shape[0], size=int(empty.sum()), replace=False)]
+        C = _normalize_rows(sums)
+    return C
+
+
+class IVFIndex:
+    """Inverted-file index over unit-norm templates.
+
+    Rows are stored grouped by list: list i owns vectors[list_offsets[i]:list_offsets[i + 1]],
+    and labels[j] is the index into `names` of the user that owns row j.
+    """
+
+    def __init__(self, centroids: np.ndarray, vectors: np.ndarray, labels: np.ndarray,
+                 list_offsets: np.ndarray, names: List[str]):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.list_offsets = np.asarray(list_offsets, dtype=np.int64)
+        self.names = list(names)
+
+    @property
+    def n_lists(self) -> int:
+        return int(self.centroids.shape[0])
+
+    @property
+    def n_rows(self) -> int:
+        return int(self.vectors.shape[0])
+
+    # -----------------------------
+    # Construction
+    # -----------------------------
+
+    @classmethod
+    def build(cls, names: List[str], T_all: np.ndarray, offsets: np.ndarray,
+              n_lists: Optional[int] = None, n_iter: int = 15, seed: int = 0) -> "IVFIndex":
+        """Train centroids on the gallery rows and assign every row to its list.
+        Default n_lists is ~sqrt(n_rows), so a list holds about sqrt(n_rows) rows."""
+        X = _normalize_rows(T_all)
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(max(1, X.shape[0]))))
+        if X.shape[0] == 0:
+            C = np.zeros((1, T_all.shape[1] if T_all.ndim == 2 else 128), dtype=np.float32)
+        else:
+            C = train_centroids(X, n_lists, n_iter=n_iter, seed=seed)
+        labels = np.repeat(np.arange(len(names), dtype=np.int64), np.diff(offsets))
+        index = cls(C, np.zeros((0, C.shape[1]), np.float32), np.zeros(0, np.int64),
+                    np.zeros(C.shape[0] + 1, np.int64), names)
+        index._set_rows(X, labels)
+        return index
+
+    def _assign(self, X: np.ndarray) -> np.ndarray:
+        out = np.empty(X.shape[0], dtype=np.int64)
+        for s in range(0, X.shape[0], 65536):
+            out[s:s + 65536] = np.argmax(X[s:s + 65536] @ self.centroids.T, axis=1)
+        return out
+
+    def _row_lists(self) -> np.ndarray:
+        return np.repeat(np.arange(self.n_lists, dtype=np.int64), np.diff(self.list_offsets))
+
+    def _set_rows(self, X: np.ndarray, labels: np.ndarray, lists: Optional[np.ndarray] = None) -> None:
+        if lists is None:
+            lists = self._assign(X) if X.shape[0] else np.zeros(0, np.int64)
+        order = np.argsort(lists, kind="stable")
+        self.vectors = np.ascontiguousarray(X[order], dtype=np.float32)
+        self.labels = labels[order]
+        counts = np.bincount(lists, minlength=self.n_lists)
+        self.list_offsets = np.zeros(self.n_lists + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.list_offsets[1:])
+
+    def upsert_user(self, user: str, T: np.ndarray) -> None:
+        """Replace `user`'s rows with T, assigning them to the existing lists (no re-training)."""
+        lists = self._row_lists()
+        if user in self.names:
+            uid = self.names.index(user)
+            keep = self.labels != uid
+            X, labels, lists = self.vectors[keep], self.labels[keep], lists[keep]
+        else:
+            uid = len(self.names)
+            self.names.append(user)
+            X, labels = self.vectors, self.labels
+        T = _normalize_rows(T)
+        self._set_rows(np.concatenate([X, T], axis=0),
+                       np.concatenate([labels, np.full(T.shape[0], uid, dtype=np.int64)]),
+                       np.concatenate([lists, self._assign(T)]))
+
+    def remove_user(self, user: str) -> bool:
+        if user not in self.names:
+            return False
+        uid = self.names.index(user)
+        keep = self.labels != uid
+        labels = self.labels[keep]
+        labels[labels > uid] -= 1
+        del self.names[uid]
+        self._set_rows(self.vectors[keep], labels, self._row_lists()[keep])
+        return True
+
+    # -----------------------------
+    # Search
+    # -----------------------------
+
+    def search(self, q: np.ndarray, top_k: int = 5,
+               n_probe: int = DEFAULT_N_PROBE) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (user_indices, scores) of the top_k users among the n_probe closest lists,
+        scored by per-user max cosine, sorted by descending score."""
+        q = np.asarray(q, dtype=np.float32)
+        q = q / (np.linalg.norm(q) + 1e-12)
+        n_probe = max(1, min(int(n_probe), self.n_lists))
+        cs = self.centroids @ q
+        if n_probe < self.n_lists:
+            probe = np.argpartition(-cs, n_probe - 1)[:n_probe]
+        else:
+            probe = np.arange(self.n_lists)
+
+        starts = self.list_offsets[probe]
+        ends = self.list_offsets[probe + 1]
+        rows = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)]) if len(probe) else np.zeros(0, np.int64)
+        if rows.size == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        scores = self.vectors[rows] @ q
+        labels = self.labels[rows]
+
+        # Per-user max: sort by score, keep each user's first (best) occurrence
+        order = np.argsort(-scores, kind="stable")
+        uniq, first = np.unique(labels[order], return_index=True)
+        first.sort()
+        best = order[first[:max(1, int(top_k))]]
+        return labels[best], scores[best]
+
+    # -----------------------------
+    # Persistence
+    # -----------------------------
+
+    def save(self, path) -> Path:
+        """Write the index atomically (np.savez to a temp file, then os.replace)."""
+        path = Path(path)
+        tmp = path.with_name(f".{path.stem}.{os.getpid()}.tmp.npz")
+        np.savez(tmp, centroids=self.centroids, vectors=self.vectors, labels=self.labels,
+                 list_offsets=self.list_offsets, names=np.array(self.names, dtype=str))
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path) -> "IVFIndex":
+        with np.load(path, allow_pickle=False) as z:
+            return cls(z["centroids"], z["vectors"], z["labels"], z["list_offsets"],
+                       [str(n) for n in z["names"]])
+
+
+# -----------------------------
+# Process-wide open indexes
+# -----------------------------
+
+_open_lock = threading.Lock()
+_open_indexes: Dict[str, Tuple[Tuple[int, int], IVFIndex]] = {}
+
+
+def open_index(templates_dir) -> Optional[IVFIndex]:
+    """Return the index stored in `templates_dir`, or None if none was built.
+    Reloaded only when the file's (mtime_ns, size) changes."""
+    path = Path(templates_dir) / INDEX_FILENAME
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    sig = (st.st_mtime_ns, st.st_size)
+    key = str(path)
+    with _open_lock:
+        entry = _open_indexes.get(key)
+        if entry is not None and entry[0] == sig:
+            return entry[1]
+    index = IVFIndex.load(path)
+    with _open_lock:
+        _open_indexes[key] = (sig, index)
+    return index
+
+
+def update_user(templates_dir, user: str, T: Optional[np.ndarray]) -> bool:
+    """Incrementally apply one user's new templates (or removal when T is None) to an existing index.
+    Returns False if no index has been built for templates_dir."""
+    return update_users(templates_dir, {user: T})
+
+
+def update_users(templates_dir, templates: Dict[str, Optional[np.ndarray]]) -> bool:
+    """update_user for many users with a single load/save of the index, under the same
+    kind of cross-process lock as gallery updates (template_gallery.gallery_lock), so
+    concurrent enrollments don't drop each other's changes."""
+    path = Path(templates_dir) / INDEX_FILENAME
+    if not path.exists():
+        return False
+    with template_gallery.gallery_lock(path):
+        index = IVFIndex.load(path)
+        changed = False
+        for user, T in templates.items():
+            if T is None:
+                changed |= index.remove_user(user)
+            else:
+                index.upsert_user(user, T)
+                changed = True
+        if changed:
+            index.save(path)
+    return True
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build/inspect the IVF index of a templates directory")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_build = sub.add_parser("build", help=f"Train and write <dir>/{INDEX_FILENAME}")
+    p_build.add_argument("templates_dir", type=str)
+    p_build.add_argument("--n-lists", type=int, default=None, help="Inverted lists (default ~sqrt(rows))")
+    p_build.add_argument("--n-iter", type=int, default=15)
+    p_build.add_argument("--seed", type=int, default=0)
+    p_info = sub.add_parser("info", help="Print index summary")
+    p_info.add_argument("templates_dir", type=str)
+    args = ap.parse_args()
+
+    if args.cmd == "build":
+        # Imported here: building needs the stacked gallery, searching does not
+        from advance_face_recognition import load_gallery_matrix
+        names, T_all, offsets = load_gallery_matrix(Path(args.templates_dir))
+        index = IVFIndex.build(names, np.asarray(T_all), offsets, n_lists=args.n_lists,
+                               n_iter=args.n_iter, seed=args.seed)
+        path = index.save(Path(args.templates_dir) / INDEX_FILENAME)
+        print(f"Built IVF index: {len(index.names)} users, {index.n_rows} rows, {index.n_lists} lists -> {path}")
+    else:
+        index = open_index(args.templates_dir)
+        if index is None:
+            raise SystemExit(f"No index in {args.templates_dir}")
+        sizes = np.diff(index.list_offsets)
+        print(json.dumps({"n_users": len(index.names), "n_rows": index.n_rows, "n_lists": index.n_lists,
+                          "list_size_mean": float(sizes.mean()), "list_size_max": int(sizes.max())}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
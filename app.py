@@ -1,19 +1,23 @@
+import startup
 from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
-import pandas as pd
-from rapidfuzz import process, fuzz
 import logging
-import cv2
+import threading
 import time
 import os
 import numpy as np
-from advance_face_recognition import verify_user_image,is_name_not_in_list
-import mysql.connector
 from datetime import datetime
-import logs_db
-import images_space
-from flask import Flask, request, jsonify
-import os
-from werkzeug.utils import secure_filename
+import metrics
+import name_index
+import verification_service
+from verification_service import ServiceBusy, ServiceTimeout
+
+# Heavy dependencies are imported on first use or by warm_up(), not at import time,
+# so pages that don't need them are served as soon as the process starts (see startup.py)
+cv2 = startup.lazy("cv2")
+mysql_connector = startup.lazy("mysql.connector")
+afr = startup.lazy("advance_face_recognition")  # face_recognition / dlib
+logs_db = startup.lazy("logs_db")
+images_space = startup.lazy("images_space")  # boto3
 
 
 app = Flask(__name__)
@@ -34,6 +38,38 @@ logging.basicConfig(
         logging.StreamHandler()
     ]
 )
+# Phone uploads can be 12MP; FACE_DETECT_MAX_SIDE=1024 detects faces on a copy downscaled
+# to that longer side and encodes from the full-resolution pixels. Off by default: small
+# faces in large photos can be missed on the downscaled copy.
+DETECT_MAX_SIDE = int(os.getenv("FACE_DETECT_MAX_SIDE", "0")) or None
+# 'int8' / 'float16' ranks /face-identification on a quantized gallery copy (see quantized_gallery.py)
+GALLERY_QUANTIZED = os.getenv("FACE_GALLERY_QUANTIZED") or None
+# Watchlist local_screening matches names against (held in memory by name_index.py)
+SCREENING_LIST = "data.xlsx"
+
+# Face jobs run in a worker pool when FACE_WORKERS > 0 (inline otherwise); see verification_service.py
+face_service = verification_service.from_env("user_templates", quantized=GALLERY_QUANTIZED)
+
+
+metrics.REGISTRY.gauge_callback("face_service_in_flight", "Jobs running or queued in the verification service",
+                                lambda: face_service.stats()["in_flight"])
+metrics.REGISTRY.gauge_callback("face_service_queue_depth", "Jobs waiting for a verification worker",
+                                lambda: face_service.queue_depth)
+
+
+def _service_unavailable(e):
+    metrics.SERVICE_REJECTIONS.inc(reason="busy" if isinstance(e, ServiceBusy) else "timeout")
+    body = {"error": "busy" if isinstance(e, ServiceBusy) else "timeout", "message": str(e)}
+    body.update(face_service.stats())
+    response = jsonify(body)
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
+
+app.register_error_handler(ServiceBusy, _service_unavailable)
+app.register_error_handler(ServiceTimeout, _service_unavailable)
+
 ROLE_MAP = {
     0: "x",
     1: "y",
@@ -43,11 +79,8 @@ ROLE_MAP = {
 def local_screening(name, filepath, threshold=60):
     logging.info(f"local_screening called with name='{name}', file='{filepath}'")
     try:
-        df = pd.read_excel(filepath, usecols=[0], header=0)
-        names_list = df.iloc[:, 0].dropna().astype(str).tolist()
-        logging.debug(f"Loaded {len(names_list)} names from {filepath}")
-
-        best_match = process.extractOne(name, names_list, scorer=fuzz.ratio)
+        # Parsed once and kept in memory; re-read only when the file changes (see name_index.py)
+        best_match = name_index.get_index(filepath).best_match(name)
         logging.debug(f"Best match result: {best_match}")
 
         if best_match and best_match[1] >= threshold:
@@ -76,45 +109,133 @@ def local_screening(name, filepath, threshold=60):
         }
 
 
-face_cascade = cv2.CascadeClassifier(
-    cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-)
+_face_cascade = None
+_face_cascade_lock = threading.Lock()
+
+
+def get_face_cascade():
+    """Haar face cascade, built on first use (or by warm_up)."""
+    global _face_cascade
+    if _face_cascade is None:
+        with _face_cascade_lock:
+            if _face_cascade is None:
+                _face_cascade = cv2.CascadeClassifier(
+                    cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+                )
+    return _face_cascade
+
+
+WARMUP_MODULES = ("cv2", "advance_face_recognition", "rapidfuzz.process", "rapidfuzz.fuzz",
+                  "mysql.connector", "logs_db", "images_space")
+_warm_up_thread = None
+# Set once warm_up() has finished; /ready answers 503 until then
+_ready = threading.Event()
+_warm_up_state = {"status": "not_started"}
+
+
+def warm_up():
+    """Get the process ready for real traffic, then flip /ready to 200.
+
+    Imports the lazy dependencies, builds the Haar cascade, loads the screening
+    name index and warms the face service: dlib's detector, landmark and encoder
+    models run once on a synthetic image and the template gallery is loaded into
+    memory, in every worker when FACE_WORKERS > 0 (see
+    advance_face_recognition.warm_up_models).
+
+    Run by start_warm_up() when the app is started directly; under a WSGI server call
+    it from the worker start hook (e.g. gunicorn post_worker_init), not at import time,
+    so nothing is loading while the server forks.
+    """
+    startup.set_phase("warmup")
+    _warm_up_state.update(status="running")
+    t0 = time.perf_counter()
+    try:
+        startup.load_all(WARMUP_MODULES)
+        get_face_cascade()
+        name_index.get_index(SCREENING_LIST).refresh()
+        service = face_service.warm_up()
+        _warm_up_state.update(status="ready", seconds=time.perf_counter() - t0, service=service)
+        _ready.set()
+        logging.info(f"Warm-up finished in {_warm_up_state['seconds']:.2f}s: {service}")
+    except Exception as e:
+        _warm_up_state.update(status="failed", seconds=time.perf_counter() - t0, error=str(e))
+        logging.error(f"Warm-up failed: {e}", exc_info=True)
+    finally:
+        startup.mark("warmup_done")
+        startup.set_phase("request")
+
+
+def start_warm_up():
+    """Run warm_up() once in a background thread; requests are served meanwhile."""
+    global _warm_up_thread
+    if _warm_up_thread is None:
+        _warm_up_thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+        _warm_up_thread.start()
+    return _warm_up_thread
 
 
-def checkface(image_path):
+def _describe_image(image):
+    if isinstance(image, np.ndarray):
+        return f"<frame {image.shape[1]}x{image.shape[0]}>"
+    if isinstance(image, (bytes, bytearray)):
+        return f"<{len(image)} bytes>"
+    return str(image)
+
+
+def checkface(image, raw_bytes=None, hint_boxes=None):
+    """Verify `image` (a path, raw encoded bytes or a decoded BGR frame) for the current user.
+
+    raw_bytes, if given, is the original upload and is what gets archived to Spaces;
+    otherwise bytes/paths are archived as-is and frames are JPEG-encoded once for the archive.
+    hint_boxes are (x, y, w, h) face boxes the caller already found (Haar cascade);
+    detection then only searches around them instead of the whole frame.
+    """
     global current_username
-    logging.info(f"checkface called with image_path: {image_path}, name: {current_username}")
+    logging.info(f"checkface called with image: {_describe_image(image)}, name: {current_username}")
 
     if not current_username:
         return {"verified": False, "status": "denied", "message": "Username missing"}
 
-    if not os.path.exists(image_path):
+    if isinstance(image, str) and not os.path.exists(image):
         return {"verified": False, "status": "denied", "message": "Image file not found"}
-    if not is_name_not_in_list(current_username):
+    if not afr.is_name_not_in_list(current_username):
         return {"verified": False, "status": "denied", "message": "access denied"}
 
     try:
-        result = verify_user_image(
+        result = face_service.verify(
             claimed_user=current_username,
-            image_path=image_path,
+            image_path=image,
             out_dir="user_templates",
             model="hog",
-            threshold=0.91
+            threshold=0.91,
+            detect_max_side=DETECT_MAX_SIDE,
+            hint_boxes=hint_boxes
         )
+        metrics.record_verification(result, endpoint="checkface")
         decision = result.get("decision", False)
         acc = result.get("score", 0.99)
 
-        rid = logs_db.log_face_event(current_username, "203.0.113.42", decision, acc)
-        images_space.upload_to_spaces(image_path, key=f"{rid}.jpg")
+        with metrics.timed(metrics.DB_LOG_SECONDS):
+            rid = logs_db.log_face_event(current_username, "203.0.113.42", decision, acc)
+        if raw_bytes is None:
+            raw_bytes = image
+            if isinstance(image, np.ndarray):
+                ok, buf = cv2.imencode(".jpg", image)
+                raw_bytes = buf.tobytes() if ok else None
+        if raw_bytes is not None:
+            with metrics.timed(metrics.SPACES_UPLOAD_SECONDS):
+                images_space.upload_to_spaces(raw_bytes, key=f"{rid}.jpg")
 
         if decision:
-            logging.info(f"Face verification successful for {current_username}, image: {image_path}")
+            logging.info(f"Face verification successful for {current_username}, image: {_describe_image(image)}")
             logs_db.update_last_user(current_username)
             return {"verified": True, "status": "approved", "name": current_username}
         else:
-            logging.info(f"Face verification failed for {current_username}, image: {image_path}")
+            logging.info(f"Face verification failed for {current_username}, image: {_describe_image(image)}")
             return {"verified": False, "status": "denied", "name": current_username}
 
+    except (ServiceBusy, ServiceTimeout):
+        raise
     except Exception as e:
         logging.error(f"Error during face verification for {current_username}: {e}")
         return {"verified": False, "status": "denied", "message": str(e)}
@@ -177,7 +298,7 @@ def capture_good_face(save_path="static/captured_face.jpg", timeout=15):
             gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
             gray = cv2.equalizeHist(gray)
 
-            faces = face_cascade.detectMultiScale(
+            faces = get_face_cascade().detectMultiScale(
                 gray,
                 scaleFactor=1.1,
                 minNeighbors=5,
@@ -296,7 +417,7 @@ def check_name():
     username = request.form.get('username', '').strip()
     logging.debug(f"Username received: '{username}'")
 
-    filepath = "data.xlsx"
+    filepath = SCREENING_LIST
     result = local_screening(username, filepath, threshold=60)
 
     if result["status"] == "success":
@@ -313,7 +434,7 @@ def auth():
     username = request.form.get('username', '').strip()
     logging.debug(f"Username received: '{username}'")
 
-    filepath = "data.xlsx"
+    filepath = SCREENING_LIST
     result = local_screening(username, filepath, threshold=60)
 
     if result["status"] == "success":
@@ -351,27 +472,23 @@ def upload_picture():
             logging.error("No current username set for upload verification")
             return jsonify({"success": False, "message": "No user session found"}), 400
 
-        # Save uploaded file temporarily
-        save_path = "static/uploaded_face.jpg"
-        os.makedirs(os.path.dirname(save_path), exist_ok=True)
-        uploaded_file.save(save_path)
-
-        # Directly run face verification
-        verification_result = checkface(save_path)
+        # Verify straight from the uploaded bytes (no temp file)
+        data = uploaded_file.read()
+        verification_result = checkface(data)
 
-        size = os.path.getsize(save_path)
+        size = len(data)
         logging.info(
-            f"Picture saved at {save_path} ({size} bytes), verification: {verification_result}"
+            f"Picture received ({size} bytes), verification: {verification_result}"
         )
 
         return jsonify({
             "success": True,
-            "path": f"/{save_path}",
-            "image_path": save_path,
             "file_size": size,
             "verification_result": verification_result,
         })
 
+    except (ServiceBusy, ServiceTimeout):
+        raise
     except Exception as e:
         logging.error(f"Error in upload_picture route: {str(e)}", exc_info=True)
         return jsonify({
@@ -396,8 +513,8 @@ def capture_face():
             logging.error("No image file in request")
             return jsonify({"success": False, "message": "No image uploaded"}), 400
 
-        image_bytes = np.frombuffer(uploaded.read(), np.uint8)
-        frame = cv2.imdecode(image_bytes, cv2.IMREAD_COLOR)
+        raw = uploaded.read()
+        frame = cv2.imdecode(np.frombuffer(raw, np.uint8), cv2.IMREAD_COLOR)
         if frame is None:
             logging.error("Failed to decode uploaded image")
             return jsonify({"success": False, "message": "Invalid image"}), 400
@@ -405,7 +522,7 @@ def capture_face():
         # 2) detect faces
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
         gray = cv2.equalizeHist(gray)
-        faces = face_cascade.detectMultiScale(
+        faces = get_face_cascade().detectMultiScale(
             gray,
             scaleFactor=1.1,
             minNeighbors=5,
@@ -418,25 +535,22 @@ def capture_face():
         if len(faces) == 0:
             return jsonify({"success": False, "message": "No face detected"}), 200
 
-        # 3) save and return
-        save_path = "static/captured_face.jpg"
-        os.makedirs(os.path.dirname(save_path), exist_ok=True)
-        cv2.imwrite(save_path, frame)
+        # 3) verify the decoded frame directly, searching only around the cascade hits;
+        #    archive the original upload bytes
+        verification_result = checkface(frame, raw_bytes=raw, hint_boxes=faces)
 
-        verification_result = checkface(save_path)
-
-        size = os.path.getsize(save_path)
+        size = len(raw)
         logging.info(
-            f"Face saved: {save_path} ({size} bytes), verification: {verification_result}"
+            f"Face received ({size} bytes), verification: {verification_result}"
         )
         return jsonify({
             "success": True,
-            "path": f"/{save_path}",
-            "image_path": save_path,
             "file_size": size,
             "verification_result": verification_result,
         })
 
+    except (ServiceBusy, ServiceTimeout):
+        raise
     except Exception as e:
         logging.error(f"Error in capture_face route: {str(e)}", exc_info=True)
         return jsonify({
@@ -446,7 +560,7 @@ def capture_face():
 
 # DB connection (replace with actual credentials)
 def get_connection():
-    return mysql.connector.connect(
+    return mysql_connector.connect(
         host="dewan-db-mysql-do-user-19563317-0.e.db.ondigitalocean.com",
         port="25060",
         user="doadmin",
@@ -681,22 +795,73 @@ def verify():
     if not claimed_user or not image:
         return jsonify({"error": "Missing name or image"}), 400
 
-    # Save uploaded image securely
-    filename = secure_filename(image.filename)
-    image_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-    image.save(image_path)
-
-    # Call your verification function
-    res = verify_user_image(
+    # Call your verification function on the uploaded bytes (no temp file)
+    res = face_service.verify(
         claimed_user=claimed_user,
-        image_path=image_path,
+        image_path=image.read(),
+        out_dir="user_templates",
+        model="hog",
+        threshold=0.91,
+        detect_max_side=DETECT_MAX_SIDE
+    )
+    metrics.record_verification(res, endpoint="face-recognition")
+
+    return jsonify(res)
+
+
+@app.route("/face-identification", methods=["POST"])
+def identify():
+    image = request.files.get("image")
+    if not image:
+        return jsonify({"error": "Missing image"}), 400
+    try:
+        top_k = int(request.form.get("top_k", 5))
+    except ValueError:
+        return jsonify({"error": "top_k must be an integer"}), 400
+
+    res = face_service.identify(
+        image_path=image.read(),
+        top_k=top_k,
         out_dir="user_templates",
         model="hog",
-        threshold=0.91
+        threshold=0.91,
+        detect_max_side=DETECT_MAX_SIDE,
+        quantized=GALLERY_QUANTIZED
     )
+    metrics.record_verification(res, endpoint="face-identification")
 
     return jsonify(res)
 
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus text exposition of the in-process metrics (see metrics.py)."""
+    return metrics.REGISTRY.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """Liveness: the process is up and serving requests (no model or database access)."""
+    return jsonify({"status": "ok"}), 200
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Readiness: 200 once warm_up() has loaded the models and gallery, 503 before (or if it failed)."""
+    body = dict(_warm_up_state, ready=_ready.is_set())
+    return jsonify(body), 200 if _ready.is_set() else 503
+
+
+@app.route("/debug/import-times", methods=["GET"])
+def import_times():
+    """Startup summary: app import time, lazy dependency loads by cost and phase, what is still unloaded."""
+    return jsonify(startup.import_report())
+
+
+startup.mark("app_imported")
+startup.set_phase("request")
+
 if __name__ == '__main__':
     logging.info("Starting Flask app on port 5000")
+    start_warm_up()
     app.run(debug=True, port=8000)
\ No newline at end of file
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Recall@k vs latency of the IVF index (ann_index.py) against exact search (rank_users)
+
+Builds synthetic galleries of unit-norm 128-d templates (K per user, clustered
+around a per-user centre like real enrollments), queries them with noisy
+probes of random users, and reports for each n_probe:
+  - recall@k : overlap of the IVF top-k users with the exact top-k users
+  - recall@1 : how often the exact best user is also the IVF best user
+  - per-query latency
+On isotropic synthetic data ranks 2..k are near-ties among impostors, so
+recall@1 is the number that tracks identification accuracy.
+
+Usage
+-----
+python bench/bench_ann.py --sizes 10000,100000,1000000 --top-k 5 --queries 200
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ann_index import IVFIndex  # noqa: E402
+from advance_face_recognition import rank_users  # noqa: E402
+
+
+def synthetic_gallery(n_rows: int, k: int = 5, dim: int = 128, spread: float = 0.4, seed: int = 0):
+    """Return (T_all [n_rows, dim], offsets [U+1], centers [U, dim]) with k rows per user."""
+    rng = np.random.default_rng(seed)
+    n_users = max(1, n_rows // k)
+    centers = rng.standard_normal((n_users, dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    T_all = np.empty((n_users * k, dim), dtype=np.float32)
+    for s in range(0, n_users, 50000):
+        c = centers[s:s + 50000]
+        noise = rng.standard_normal((c.shape[0], k, dim)).astype(np.float32) * (spread / np.sqrt(dim))
+        block = (c[:, None, :] + noise).reshape(-1, dim)
+        T_all[s * k:s * k + block.shape[0]] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    offsets = np.arange(0, n_users * k + 1, k, dtype=np.int64)
+    return T_all, offsets, centers
+
+
+def _ms(xs):
+    xs = np.asarray(xs) * 1000.0
+    return {"mean": float(xs.mean()), "p50": float(np.median(xs)), "p95": float(np.percentile(xs, 95))}
+
+
+def run(n_rows: int, probes, top_k: int, n_queries: int, seed: int):
+    T_all, offsets, centers = synthetic_gallery(n_rows, seed=seed)
+    names = [f"user_{i}" for i in range(len(offsets) - 1)]
+    rng = np.random.default_rng(seed + 1)
+    who = rng.integers(0, len(names), size=n_queries)
+    Q = centers[who] + rng.standard_normal((n_queries, T_all.shape[1])).astype(np.float32) * (0.5 / np.sqrt(T_all.shape[1]))
+
+    t0 = time.perf_counter()
+    index = IVFIndex.build(names, T_all, offsets, seed=seed)
+    build_s = time.perf_counter() - t0
+
+    exact, exact_t = [], []
+    for q in Q:
+        t0 = time.perf_counter()
+        idx, _ = rank_users(q, T_all, offsets, top_k=top_k)
+        exact_t.append(time.perf_counter() - t0)
+        exact.append(idx.tolist())
+
+    rows = []
+    for n_probe in probes:
+        hits, top1, lat = 0, 0, []
+        for q, ref in zip(Q, exact):
+            t0 = time.perf_counter()
+            idx, _ = index.search(q, top_k=top_k, n_probe=n_probe)
+            lat.append(time.perf_counter() - t0)
+            hits += len(set(ref) & set(idx.tolist()))
+            top1 += int(len(idx) > 0 and idx[0] == ref[0])
+        rows.append({"n_probe": int(n_probe), "recall_at_k": hits / float(top_k * n_queries),
+                     "recall_at_1": top1 / float(n_queries), "ms": _ms(lat)})
+
+    return {"n_rows": int(T_all.shape[0]), "n_users": len(names), "n_lists": index.n_lists,
+            "build_s": build_s, "exact_ms": _ms(exact_t), "ivf": rows}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=str, default="10000,100000,1000000", help="Comma-separated gallery sizes (rows)")
+    ap.add_argument("--probes", type=str, default="1,2,4,8,16,32,64")
+    ap.add_argument("--top-k", type=int, default=5)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", type=str, default="", help="Optional path to write results as JSON")
+    args = ap.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    probes = [int(p) for p in args.probes.split(",") if p.strip()]
+    results = []
+    for n in sizes:
+        r = run(n, probes, args.top_k, args.queries, args.seed)
+        results.append(r)
+        print(f"\n== {r['n_rows']} rows / {r['n_users']} users, {r['n_lists']} lists (build {r['build_s']:.1f}s) ==")
+        print(f"  exact            p50={r['exact_ms']['p50']:.3f} ms  p95={r['exact_ms']['p95']:.3f} ms")
+        for row in r["ivf"]:
+            print(f"  n_probe={row['n_probe']:<4d} recall@1={row['recall_at_1']:.3f}  "
+                  f"recall@{args.top_k}={row['recall_at_k']:.3f}  "
+                  f"p50={row['ms']['p50']:.3f} ms  p95={row['ms']['p95']:.3f} ms")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
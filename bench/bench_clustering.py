@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+Template clustering backends compared on speed and genuine/impostor scores
+
+For every clustering config (method:n_init, see build_templates) each user's
+enrollment embeddings are split 70/30 (seeded), templates are built from the
+70% and the held-out 30% is scored against every user's templates
+(score_matrix). Reported per config:
+  - build time per user (mean / p95) and total
+  - genuine score distribution (mean, p1, p5, p50) = held-out vs own templates
+  - impostor p99 / p99.9 / max, EER and TPR at --target-far (verification_metrics)
+plus the one-off scikit-learn import time the lazy import now defers.
+
+Embeddings come from <templates>/<user>.enroll.npz (written by enrollment);
+without any, a seeded synthetic set of multi-modal users is generated
+(each user = a few pose/lighting modes around an identity direction).
+
+Usage
+-----
+python bench/bench_clustering.py --templates user_templates
+python bench/bench_clustering.py --synthetic-users 100 --configs kmeans:10,kmeans:3,minibatch:3,spherical:3,spherical:1
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import advance_face_recognition as afr  # noqa: E402
+
+
+def load_embeddings(templates: str):
+    out = {}
+    for p in sorted(Path(templates).glob(f"*{afr.ENROLL_STATE_SUFFIX}")):
+        user = p.name[:-len(afr.ENROLL_STATE_SUFFIX)]
+        state = afr.load_enrollment_state(user, Path(templates))
+        if state is not None and state["embeddings"].shape[0] >= 10:
+            out[user] = state["embeddings"].astype(np.float32)
+    return out
+
+
+def synthetic_embeddings(n_users: int, seed: int, dim: int = 128):
+    rng = np.random.default_rng(seed)
+    out = {}
+    for u in range(n_users):
+        ident = rng.standard_normal(dim)
+        ident /= np.linalg.norm(ident)
+        n_modes = int(rng.integers(1, 5))
+        modes = ident + 0.9 * rng.standard_normal((n_modes, dim)) / np.sqrt(dim)
+        n = int(rng.integers(60, 600))
+        X = modes[rng.integers(n_modes, size=n)] + 0.8 * rng.standard_normal((n, dim)) / np.sqrt(dim)
+        out[f"user_{u}"] = (X / np.linalg.norm(X, axis=1, keepdims=True)).astype(np.float32)
+    return out
+
+
+def split(embeddings, ratio: float, seed: int):
+    rng = np.random.default_rng(seed)
+    enroll, test = {}, {}
+    for u, E in embeddings.items():
+        order = rng.permutation(E.shape[0])
+        n = max(1, int(E.shape[0] * ratio))
+        enroll[u], test[u] = E[order[:n]], E[order[n:]]
+    return enroll, test
+
+
+def run_config(method: str, n_init: int, enroll, test, k_max: int, min_per_cluster: int, target_far: float):
+    templates, times = {}, []
+    for u, E in enroll.items():
+        t0 = time.perf_counter()
+        templates[u] = afr.build_templates(list(E), k_max=k_max, min_per_cluster=min_per_cluster,
+                                           method=method, n_init=n_init).astype(np.float32)
+        times.append(time.perf_counter() - t0)
+    names, T_all, offsets = afr.stack_templates(templates)
+    owners = np.concatenate([np.full(test[u].shape[0], i) for i, u in enumerate(names)])
+    S = afr.score_matrix(np.concatenate([test[u] for u in names]), T_all, offsets)
+    genuine_mask = owners[:, None] == np.arange(len(names))[None, :]
+    g, imp = S[genuine_mask], S[~genuine_mask]
+    m = afr.verification_metrics(genuine_mask.ravel().astype(np.int32), S.ravel(), target_far=target_far)
+    t = np.asarray(times) * 1000.0
+    return {
+        "config": f"{method}:{n_init}",
+        "build_ms_mean": float(t.mean()), "build_ms_p95": float(np.percentile(t, 95)),
+        "build_s_total": float(t.sum() / 1000.0),
+        "templates_mean_k": float(np.mean([T.shape[0] for T in templates.values()])),
+        "genuine_mean": float(g.mean()), "genuine_p1": float(np.percentile(g, 1)),
+        "genuine_p5": float(np.percentile(g, 5)), "genuine_p50": float(np.median(g)),
+        "impostor_p99": float(np.percentile(imp, 99)), "impostor_p99.9": float(np.percentile(imp, 99.9)),
+        "impostor_max": float(imp.max()),
+        "eer": m["eer"], "tpr_at_target_far": m["tpr_at_target_far"],
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--templates", type=str, default="user_templates", help="Directory with <user>.enroll.npz")
+    ap.add_argument("--synthetic-users", type=int, default=60, help="Synthetic users when no .enroll.npz is found")
+    ap.add_argument("--configs", type=str, default="kmeans:10,kmeans:3,minibatch:3,spherical:3,spherical:1")
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--min-per-cluster", type=int, default=12)
+    ap.add_argument("--enroll-ratio", type=float, default=0.7)
+    ap.add_argument("--target-far", type=float, default=0.001)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", type=str, default="", help="Optional path to write results as JSON")
+    args = ap.parse_args()
+
+    embeddings = load_embeddings(args.templates)
+    source = args.templates
+    if len(embeddings) < 2:
+        embeddings = synthetic_embeddings(args.synthetic_users, args.seed)
+        source = f"synthetic ({args.synthetic_users} users)"
+    enroll, test = split(embeddings, args.enroll_ratio, args.seed)
+
+    t0 = time.perf_counter()
+    have_sklearn = afr._sklearn_cluster("kmeans") is not None
+    import_s = time.perf_counter() - t0
+
+    results = []
+    for spec in args.configs.split(","):
+        method, _, n_init = spec.strip().partition(":")
+        if method != "spherical" and not have_sklearn:
+            print(f"  {spec}: scikit-learn not installed (would fall back to spherical), skipped")
+            continue
+        results.append(run_config(method, int(n_init or 10), enroll, test, args.k, args.min_per_cluster,
+                                  args.target_far))
+
+    n_emb = sum(E.shape[0] for E in embeddings.values())
+    print(f"{source}: {len(embeddings)} users, {n_emb} embeddings; scikit-learn import {import_s:.2f}s")
+    print(f"  {'config':<13s} {'build ms':>9s} {'p95':>8s} {'total s':>8s} {'K':>5s}  {'gen mean':>8s} {'gen p1':>7s}"
+          f" {'gen p5':>7s} {'imp p99.9':>9s} {'EER':>7s} {'TPR@FAR':>7s}")
+    for r in results:
+        print(f"  {r['config']:<13s} {r['build_ms_mean']:9.2f} {r['build_ms_p95']:8.2f} {r['build_s_total']:8.2f}"
+              f" {r['templates_mean_k']:5.2f}  {r['genuine_mean']:8.4f} {r['genuine_p1']:7.4f} {r['genuine_p5']:7.4f}"
+              f" {r['impostor_p99.9']:9.4f} {r['eer']:7.4f} {r['tpr_at_target_far']:7.4f}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({"source": source, "sklearn_import_s": import_s,
+                                               "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
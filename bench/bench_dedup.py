@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+dedup_embeddings: blocked/prefiltered implementation vs the original per-row loop
+
+Generates video-like enrollment sets (bursts of near-identical frames drifting
+around a few poses, plus unrelated faces), runs the original greedy loop and
+the current dedup_embeddings on the same input, checks that both keep exactly
+the same rows and reports wall time. "blocked" disables the projection
+prefilter; "auto" lets dedup_embeddings consider it at every size (it still
+falls back to plain tiles when the projection windows are not selective).
+
+Usage
+-----
+python bench/bench_dedup.py --sizes 1000,10000,50000
+python bench/bench_dedup.py --sizes 50000 --legacy-max 0      # skip the slow loop
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from advance_face_recognition import dedup_embeddings  # noqa: E402
+
+
+def legacy_dedup(E: np.ndarray, near_cos: float = 0.995) -> np.ndarray:
+    """The original implementation, kept here as the reference."""
+    if E.shape[0] <= 1:
+        return E
+    keep = [0]
+    for i in range(1, E.shape[0]):
+        if np.max(E[i] @ E[:i].T) < near_cos:
+            keep.append(i)
+    return E[keep]
+
+
+def synthetic_frames(n: int, dim: int = 128, burst: int = 20, seed: int = 0) -> np.ndarray:
+    """Unit-norm rows: bursts of `burst` frames random-walking from a pose, shuffled lightly."""
+    rng = np.random.default_rng(seed)
+    n_bursts = max(1, n // burst)
+    starts = rng.standard_normal((n_bursts, dim)).astype(np.float32)
+    starts /= np.linalg.norm(starts, axis=1, keepdims=True)
+    steps = rng.standard_normal((n_bursts, burst, dim)).astype(np.float32) * (0.06 / np.sqrt(dim))
+    E = (starts[:, None, :] + np.cumsum(steps, axis=1)).reshape(-1, dim)[:n]
+    if E.shape[0] < n:
+        E = np.concatenate([E, rng.standard_normal((n - E.shape[0], dim)).astype(np.float32)])
+    return E / np.linalg.norm(E, axis=1, keepdims=True)
+
+
+def _time(fn, *args, **kw):
+    t0 = time.perf_counter()
+    out = fn(*args, **kw)
+    return out, time.perf_counter() - t0
+
+
+def run(n: int, near_cos: float, legacy_max: int, seed: int):
+    E = synthetic_frames(n, seed=seed)
+    row = {"n": n, "near_cos": near_cos}
+    blocked, row["blocked_s"] = _time(dedup_embeddings, E, near_cos=near_cos, prefilter_min=n + 1)
+    auto, row["auto_s"] = _time(dedup_embeddings, E, near_cos=near_cos, prefilter_min=0)
+    row["kept"] = int(blocked.shape[0])
+    row["blocked_eq_auto"] = bool(np.array_equal(blocked, auto))
+    if n <= legacy_max:
+        ref, row["legacy_s"] = _time(legacy_dedup, E, near_cos=near_cos)
+        row["blocked_eq_legacy"] = bool(np.array_equal(ref, blocked))
+        row["auto_eq_legacy"] = bool(np.array_equal(ref, auto))
+    return row
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=str, default="1000,10000,50000")
+    ap.add_argument("--near-cos", type=float, default=0.995)
+    ap.add_argument("--legacy-max", type=int, default=50000, help="Largest n to also run the original loop on")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", type=str, default="", help="Optional path to write results as JSON")
+    args = ap.parse_args()
+
+    results = []
+    for n in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        r = run(n, args.near_cos, args.legacy_max, args.seed)
+        results.append(r)
+        line = (f"n={r['n']:<7d} kept={r['kept']:<7d} blocked={r['blocked_s']:.3f}s  "
+                f"auto={r['auto_s']:.3f}s  same={r['blocked_eq_auto']}")
+        if "legacy_s" in r:
+            line += (f"  legacy={r['legacy_s']:.3f}s  same_as_legacy="
+                     f"{r['blocked_eq_legacy'] and r['auto_eq_legacy']}"
+                     f"  speedup={r['legacy_s'] / max(1e-9, min(r['blocked_s'], r['auto_s'])):.1f}x")
+        print(line)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+Memory and score error of the quantized gallery (quantized_gallery.py) vs float32
+
+Loads a templates directory (default user_templates) with load_gallery_matrix and,
+for float16 and int8, reports:
+  - gallery bytes vs float32
+  - per-template score error |approx - exact| over all (query, template) pairs
+  - per-user max-score error (what the first pass ranks on)
+  - top-k agreement with exact rank_users after rescoring, and latency
+Queries are every template row plus a noisy copy of it (genuine-like) and a
+random unit vector (impostor-like), so both ends of the score range are covered.
+--tile N repeats the gallery N times (with small jitter) to time larger galleries.
+
+Usage
+-----
+python bench/bench_quantized.py --templates user_templates --top-k 5 --rescore 32
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from quantized_gallery import QUANT_DTYPES, QuantizedGallery  # noqa: E402
+from advance_face_recognition import load_gallery_matrix, rank_users  # noqa: E402
+
+
+def _stats(x):
+    x = np.abs(np.asarray(x, dtype=np.float64))
+    return {"mean": float(x.mean()), "p99": float(np.percentile(x, 99)), "max": float(x.max())}
+
+
+def _ms(xs):
+    xs = np.asarray(xs) * 1000.0
+    return {"p50": float(np.median(xs)), "p95": float(np.percentile(xs, 95))}
+
+
+def make_queries(T_all: np.ndarray, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    noisy = T_all + rng.standard_normal(T_all.shape).astype(np.float32) * (0.5 / np.sqrt(T_all.shape[1]))
+    rand = rng.standard_normal(T_all.shape).astype(np.float32)
+    Q = np.concatenate([T_all, noisy, rand], axis=0)
+    return Q / np.linalg.norm(Q, axis=1, keepdims=True)
+
+
+def tile_gallery(names, T_all, offsets, n: int, seed: int):
+    if n <= 1:
+        return names, T_all, offsets
+    rng = np.random.default_rng(seed)
+    T = np.concatenate([T_all] + [T_all + rng.standard_normal(T_all.shape).astype(np.float32) * 0.02
+                                  for _ in range(n - 1)], axis=0)
+    T /= np.linalg.norm(T, axis=1, keepdims=True)
+    counts = np.tile(np.diff(offsets), n)
+    offs = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offs[1:])
+    return [f"{nm}#{i}" for i in range(n) for nm in names], T, offs
+
+
+def run(templates: str, top_k: int, rescore: int, n_queries: int, tile: int, seed: int):
+    names, T_all, offsets = load_gallery_matrix(Path(templates))
+    names, T_all, offsets = tile_gallery(names, np.asarray(T_all, dtype=np.float32), offsets, tile, seed)
+    Q = make_queries(T_all, seed)
+    rng = np.random.default_rng(seed + 1)
+    Q = Q[rng.choice(Q.shape[0], size=min(n_queries, Q.shape[0]), replace=False)]
+
+    exact_S = Q @ T_all.T
+    exact_rank, exact_t = [], []
+    for q in Q:
+        t0 = time.perf_counter()
+        idx, _ = rank_users(q, T_all, offsets, top_k=top_k)
+        exact_t.append(time.perf_counter() - t0)
+        exact_rank.append(idx)
+    starts = offsets[:-1]
+    exact_user = np.maximum.reduceat(exact_S, starts, axis=1)
+
+    out = {"templates": templates, "n_users": len(names), "n_rows": int(T_all.shape[0]), "dim": int(T_all.shape[1]),
+           "n_queries": int(Q.shape[0]), "float32_bytes": int(T_all.nbytes), "exact_ms": _ms(exact_t), "quantized": []}
+    for dtype in QUANT_DTYPES:
+        G = QuantizedGallery.from_matrix(names, T_all, offsets, dtype)
+        approx_S = np.stack([G.approx_scores(q) for q in Q])
+        approx_user = np.maximum.reduceat(approx_S, starts, axis=1)
+        same, lat, score_err = 0, [], []
+        for q, ref, ref_row in zip(Q, exact_rank, exact_user):
+            t0 = time.perf_counter()
+            idx, sc = G.rank(q, T_all, top_k=top_k, rescore=rescore)
+            lat.append(time.perf_counter() - t0)
+            same += int(np.array_equal(idx, ref))
+            score_err.append(np.max(np.abs(sc - ref_row[idx])))
+        out["quantized"].append({
+            "dtype": dtype,
+            "bytes": G.nbytes,
+            "ratio": G.nbytes / float(T_all.nbytes),
+            "template_score_err": _stats(approx_S - exact_S),
+            "user_score_err": _stats(approx_user - exact_user),
+            "topk_same_as_exact": same / float(Q.shape[0]),
+            "returned_score_err_max": float(np.max(score_err)),
+            "ms": _ms(lat),
+        })
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--templates", type=str, default="user_templates")
+    ap.add_argument("--top-k", type=int, default=5)
+    ap.add_argument("--rescore", type=int, default=32)
+    ap.add_argument("--queries", type=int, default=600)
+    ap.add_argument("--tile", type=int, default=1, help="Repeat the gallery N times to time larger galleries")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", type=str, default="", help="Optional path to write results as JSON")
+    args = ap.parse_args()
+
+    r = run(args.templates, args.top_k, args.rescore, args.queries, args.tile, args.seed)
+    print(f"{r['templates']}: {r['n_users']} users, {r['n_rows']} templates x {r['dim']}, {r['n_queries']} queries")
+    print(f"  float32  {r['float32_bytes'] / 1024:.1f} KiB   exact p50={r['exact_ms']['p50']:.3f} ms")
+    for q in r["quantized"]:
+        print(f"  {q['dtype']:<8s} {q['bytes'] / 1024:.1f} KiB ({q['ratio']:.2f}x)  "
+              f"template err mean={q['template_score_err']['mean']:.2e} max={q['template_score_err']['max']:.2e}  "
+              f"user err max={q['user_score_err']['max']:.2e}  "
+              f"top-{args.top_k} same={q['topk_same_as_exact']:.3f}  returned err={q['returned_score_err_max']:.1e}  "
+              f"p50={q['ms']['p50']:.3f} ms")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(r, indent=2))
+
+
+if __name__ == "__main__":
+    main()
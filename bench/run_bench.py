@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""
+Stage-level benchmark of the verification pipeline
+
+Times each stage of advance_face_recognition separately over a fixed image set
+and synthetic galleries:
+  image stages   : decode, decode_reduced (staged quality gate), color (BGR->RGB),
+                   blur (laplacian_var), detect (detect_faces), encode (face_encodings)
+  gallery stages : template_load (cold .npy read / warm TemplateCache hit),
+                   score_1to1 (one user's templates), score_1toN (rank_users) per size
+and reports mean/p50/p95/p99 in ms plus throughput for every stage.
+
+Images come from --images (files or directories, sorted, so the set is fixed);
+without it a seeded synthetic set is generated. When detection finds no face
+the encoder is timed on a centred box, so every stage always has samples.
+
+The JSON output (--json) carries the git commit and library versions; pass a
+previous run as --compare to print per-stage p50 changes. The exit status is 1
+when any stage got slower than --tolerance, so the runner can gate CI.
+
+Usage
+-----
+python bench/run_bench.py --images static --repeat 5 --json bench_$(git rev-parse --short HEAD).json
+python bench/run_bench.py --images static --compare bench_base.json --tolerance 0.15
+"""
+
+import argparse
+import hashlib
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import advance_face_recognition as afr  # noqa: E402
+import face_recognition  # noqa: E402
+
+
+def summarize(samples_s, items_per_sample: int = 1):
+    x = np.asarray(samples_s, dtype=np.float64) * 1000.0
+    mean = float(x.mean())
+    return {"n": int(x.size), "mean_ms": mean, "p50_ms": float(np.percentile(x, 50)),
+            "p95_ms": float(np.percentile(x, 95)), "p99_ms": float(np.percentile(x, 99)),
+            "throughput_per_s": 1000.0 * items_per_sample / mean if mean > 0 else 0.0}
+
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - t0
+
+
+def load_image_set(specs, n_synthetic: int, seed: int):
+    """Return [(name, encoded_bytes)] from files/dirs in `specs`, or a seeded synthetic set."""
+    files = []
+    for spec in specs:
+        p = Path(spec)
+        if p.is_dir():
+            files.extend(sorted(f for f in p.rglob("*") if f.suffix.lower() in afr.IMAGE_EXTS))
+        elif p.is_file():
+            files.append(p)
+    if files:
+        return [(str(f), f.read_bytes()) for f in files]
+
+    rng = np.random.default_rng(seed)
+    out = []
+    for i in range(n_synthetic):
+        h, w = [(480, 640), (720, 1280), (1080, 1920)][i % 3]
+        img = cv2.GaussianBlur((rng.random((h, w, 3)) * 255).astype(np.uint8), (0, 0), 1.5)
+        ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        out.append((f"synthetic_{i}_{w}x{h}.jpg", buf.tobytes()))
+    return out
+
+
+def bench_images(images, repeat: int, model: str, detect_max_side):
+    stages = {k: [] for k in ("decode", "decode_reduced", "color", "blur", "detect", "encode")}
+    n_faces = 0
+    for _, content in images:
+        buf = np.frombuffer(content, np.uint8)
+        for r in range(repeat):
+            img_bgr, dt = timed(cv2.imdecode, buf, cv2.IMREAD_COLOR)
+            if img_bgr is None:
+                break
+            stages["decode"].append(dt)
+            stages["decode_reduced"].append(timed(cv2.imdecode, buf, cv2.IMREAD_REDUCED_GRAYSCALE_2)[1])
+            img_rgb, dt = timed(lambda im: np.ascontiguousarray(cv2.cvtColor(im, cv2.COLOR_BGR2RGB)), img_bgr)
+            stages["color"].append(dt)
+            stages["blur"].append(timed(afr.laplacian_var, img_bgr)[1])
+            (boxes, _), dt = timed(afr.detect_faces, img_rgb, model=model, detect_max_side=detect_max_side)
+            stages["detect"].append(dt)
+            if boxes:
+                box = afr.largest_box(boxes)
+                n_faces += int(r == 0)
+            else:
+                h, w = img_rgb.shape[:2]
+                s = min(h, w) // 3
+                box = (h // 2 - s // 2, w // 2 + s // 2, h // 2 + s // 2, w // 2 - s // 2)
+            stages["encode"].append(timed(face_recognition.face_encodings, img_rgb, [box])[1])
+    return {k: summarize(v) for k, v in stages.items() if v}, n_faces
+
+
+def synthetic_gallery(n_users: int, k: int, dim: int = 128, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    T_all = rng.standard_normal((n_users * k, dim)).astype(np.float32)
+    T_all /= np.linalg.norm(T_all, axis=1, keepdims=True)
+    offsets = np.arange(0, n_users * k + 1, k, dtype=np.int64)
+    return T_all, offsets
+
+
+def bench_gallery(sizes, k: int, n_queries: int, seed: int):
+    out = {}
+    rng = np.random.default_rng(seed + 1)
+    Q = rng.standard_normal((n_queries, 128)).astype(np.float32)
+    Q /= np.linalg.norm(Q, axis=1, keepdims=True)
+
+    # template_load: cold np.load + normalize vs warm TemplateCache hit
+    with tempfile.TemporaryDirectory() as tmp:
+        T_all, _ = synthetic_gallery(200, k, seed=seed)
+        for i in range(200):
+            np.save(Path(tmp) / f"user_{i}.npy", T_all[i * k:(i + 1) * k])
+        cold = [timed(afr.load_templates_for_user, f"user_{i}", Path(tmp), use_cache=False)[1] for i in range(200)]
+        for i in range(200):
+            afr.load_templates_for_user(f"user_{i}", Path(tmp))
+        warm = [timed(afr.load_templates_for_user, f"user_{i}", Path(tmp))[1] for i in range(200)]
+        afr.TEMPLATE_CACHE.invalidate()
+    out["template_load_cold"] = summarize(cold)
+    out["template_load_warm"] = summarize(warm)
+
+    T = T_all[:k]
+    out["score_1to1"] = summarize([timed(lambda q: float(np.max(T @ q)), q)[1] for q in Q])
+    for n_users in sizes:
+        T_all, offsets = synthetic_gallery(n_users, k, seed=seed)
+        out[f"score_1toN_{n_users}"] = summarize([timed(afr.rank_users, q, T_all, offsets, 5)[1] for q in Q])
+    return out
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=Path(__file__).resolve().parent, timeout=10).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "numpy": np.__version__, "opencv": cv2.__version__, "cv2_threads": cv2.getNumThreads()}
+
+
+def compare(current, baseline, tolerance: float) -> bool:
+    """Print p50 changes per stage; return True if any stage regressed beyond tolerance."""
+    regressed = False
+    print(f"\nvs baseline {baseline.get('env', {}).get('commit')} (tolerance {tolerance:.0%}):")
+    if baseline.get("image_set") != current["image_set"]:
+        print("  WARNING: image sets differ; image-stage numbers are not comparable")
+    for name, cur in current["stages"].items():
+        base = baseline.get("stages", {}).get(name)
+        if base is None:
+            print(f"  {name:<22s} new")
+            continue
+        change = cur["p50_ms"] / base["p50_ms"] - 1.0 if base["p50_ms"] > 0 else 0.0
+        flag = ""
+        if change > tolerance:
+            flag, regressed = "  REGRESSION", True
+        print(f"  {name:<22s} {base['p50_ms']:9.3f} -> {cur['p50_ms']:9.3f} ms  ({change:+.1%}){flag}")
+    return regressed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--images", type=str, nargs="*", default=[], help="Image files/directories (fixed set)")
+    ap.add_argument("--synthetic", type=int, default=6, help="Synthetic images when --images is empty")
+    ap.add_argument("--repeat", type=int, default=3, help="Timed passes per image")
+    ap.add_argument("--model", type=str, default="hog", choices=["hog", "cnn"])
+    ap.add_argument("--detect-max-side", type=int, default=None)
+    ap.add_argument("--gallery-sizes", type=str, default="100,10000,100000", help="Users per synthetic gallery")
+    ap.add_argument("--k", type=int, default=5, help="Templates per synthetic user")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", type=str, default="", help="Write results as JSON")
+    ap.add_argument("--compare", type=str, default="", help="Baseline JSON from a previous run")
+    ap.add_argument("--tolerance", type=float, default=0.10, help="Allowed p50 slowdown before flagging")
+    args = ap.parse_args()
+
+    images = load_image_set(args.images, args.synthetic, args.seed)
+    image_stages, n_faces = bench_images(images, args.repeat, args.model, args.detect_max_side)
+    gallery_stages = bench_gallery([int(s) for s in args.gallery_sizes.split(",") if s.strip()],
+                                   args.k, args.queries, args.seed)
+    result = {
+        "env": environment(),
+        "config": vars(args),
+        "n_images": len(images),
+        "image_set": hashlib.sha256(b"".join(hashlib.sha256(c).digest() for _, c in images)).hexdigest()[:16],
+        "n_images_with_face": n_faces,
+        "stages": {**image_stages, **gallery_stages},
+    }
+
+    print(f"{len(images)} images ({n_faces} with a detected face), repeat={args.repeat}, model={args.model}")
+    print(f"  {'stage':<22s} {'mean':>9s} {'p50':>9s} {'p95':>9s} {'p99':>9s}  {'per s':>10s}")
+    for name, st in result["stages"].items():
+        print(f"  {name:<22s} {st['mean_ms']:9.3f} {st['p50_ms']:9.3f} {st['p95_ms']:9.3f} {st['p99_ms']:9.3f}"
+              f"  {st['throughput_per_s']:10.1f}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2))
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        if compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
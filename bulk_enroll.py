@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+"""
+Bulk enrollment of a whole FRDS2-style dataset
+
+Scans every <root>/<user>/ folder in one walk, records each user's image set
+(relative path, size, mtime) as a digest in <out>/enroll_manifest.json and
+enrolls only the users whose image set or enrollment settings changed since
+the last run.
+
+Users are enrolled in parallel worker processes (one user per job). Workers
+write into <out>/.bulk_staging/; the parent moves the finished <user>.npy and
+<user>.enroll.npz into <out> and appends the user's manifest entry to
+<out>/enroll_manifest.journal, so an interrupted run resumes where it stopped.
+The journal is folded into the manifest at the start and end of each run, so a
+run costs one manifest write per run, not one per user. The packed gallery and ANN index
+(if present) are updated once at the end for every user not yet applied to
+them, including users committed by an earlier interrupted run. A user whose
+enrollment raises (e.g. on a corrupt image) is reported with status "error"
+and retried on the next run; the other users are unaffected.
+
+Usage
+-----
+python bulk_enroll.py --root FRDS2 --out user_templates --workers 8
+python bulk_enroll.py --root FRDS2 --out user_templates --dry-run      # list what would be enrolled
+python bulk_enroll.py --root FRDS2 --out user_templates --force        # re-enroll everyone
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+
+import advance_face_recognition as afr
+import ann_index
+import template_gallery
+from embedding_cache import CACHE_MAGIC, EmbeddingCache
+
+MANIFEST_FILENAME = "enroll_manifest.json"
+JOURNAL_FILENAME = "enroll_manifest.journal"
+MANIFEST_VERSION = 1
+STAGING_DIRNAME = ".bulk_staging"
+
+# (relative path, size, mtime_ns)
+FileEntry = Tuple[str, int, int]
+
+
+# -----------------------------
+# Dataset scan & manifest
+# -----------------------------
+
+def _dir_id(path: str) -> Tuple[int, int]:
+    st = os.stat(path)  # follows symlinks; DirEntry.stat() has no inode on Windows
+    return st.st_dev, st.st_ino
+
+
+def _scan_tree(top: str, base: str, out: List[FileEntry], seen: set) -> None:
+    """Collect images under top. Directory symlinks are followed, but each directory
+    (by device and inode) is walked once, so a symlink loop can't recurse forever."""
+    with os.scandir(top) as it:
+        for e in it:
+            if e.is_dir(follow_symlinks=True):
+                dir_id = _dir_id(e.path)
+                if dir_id not in seen:
+                    seen.add(dir_id)
+                    _scan_tree(e.path, base, out, seen)
+            elif os.path.splitext(e.name)[1].lower() in afr.IMAGE_EXTS:
+                st = e.stat()
+                out.append((os.path.relpath(e.path, base), int(st.st_size), int(st.st_mtime_ns)))
+
+
+def scan_dataset(root: Path) -> Dict[str, List[FileEntry]]:
+    """One walk over root: {user: sorted [(path relative to root, size, mtime_ns)]} for every user folder."""
+    users: Dict[str, List[FileEntry]] = {}
+    with os.scandir(root) as it:
+        for e in it:
+            if e.is_dir(follow_symlinks=True):
+                files: List[FileEntry] = []
+                _scan_tree(e.path, str(root), files, {_dir_id(e.path)})
+                files.sort()
+                users[e.name] = files
+    return dict(sorted(users.items()))
+
+
+def files_digest(files: List[FileEntry]) -> str:
+    return hashlib.sha256(json.dumps(files).encode("utf-8")).hexdigest()
+
+
+def load_manifest(out_dir: Path) -> Dict:
+    """The manifest with any journal entries of an interrupted run applied."""
+    path = Path(out_dir) / MANIFEST_FILENAME
+    manifest = {"version": MANIFEST_VERSION, "users": {}}
+    if path.exists():
+        loaded = json.loads(path.read_text())
+        if loaded.get("version") == MANIFEST_VERSION:
+            manifest = loaded
+    journal = Path(out_dir) / JOURNAL_FILENAME
+    if journal.exists() and "settings" in manifest:
+        with open(journal, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # torn last line of a crashed run
+                manifest["users"][record["user"]] = record["entry"]
+    return manifest
+
+
+def save_manifest(out_dir: Path, manifest: Dict) -> None:
+    """Write the whole manifest atomically and drop the journal it now includes."""
+    path = Path(out_dir) / MANIFEST_FILENAME
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(manifest, indent=1))
+    os.replace(tmp, path)
+    (Path(out_dir) / JOURNAL_FILENAME).unlink(missing_ok=True)
+
+
+def append_manifest_entry(out_dir: Path, user: str, entry: Dict) -> None:
+    """Record one user's entry in the journal (one line, flushed to disk)."""
+    with open(Path(out_dir) / JOURNAL_FILENAME, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"user": user, "entry": entry}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def plan(scan: Dict[str, List[FileEntry]], manifest: Dict, settings: Dict, out_dir: Path,
+         force: bool = False) -> Tuple[List[str], List[str], List[str]]:
+    """Split users into (to_enroll, up_to_date, gone). A user is up to date when its file
+    list and the enrollment settings match the manifest and its templates still exist
+    (or its last enrollment found nothing usable in the same files)."""
+    to_enroll, up_to_date = [], []
+    same_settings = manifest.get("settings") == settings
+    for user, files in scan.items():
+        entry = manifest["users"].get(user)
+        ok = (not force and same_settings and entry is not None
+              and entry["digest"] == files_digest(files)
+              and (entry["status"] not in ("created", "overwritten") or afr.has_user_templates(user, out_dir)))
+        (up_to_date if ok else to_enroll).append(user)
+    gone = sorted(u for u in manifest["users"] if u not in scan)
+    return to_enroll, up_to_date, gone
+
+
+# -----------------------------
+# Enrollment workers
+# -----------------------------
+
+_worker_cache: Optional[EmbeddingCache] = None
+
+
+def _worker_init(cache_path: str) -> None:
+    global _worker_cache
+    cv2.setNumThreads(1)
+    # Each process appends to the shared cache file with one write per record
+    _worker_cache = EmbeddingCache(cache_path) if cache_path else None
+
+
+def _enroll_job(args) -> Dict:
+    user, root, rel_paths, staging, settings = args
+    t0 = time.perf_counter()
+    res = afr.enroll_user_from_folder(user, str(Path(root) / user), out_dir=staging, overwrite=True,
+                                      image_paths=[Path(root) / p for p in rel_paths],
+                                      cache=_worker_cache, **settings)
+    res["seconds"] = time.perf_counter() - t0
+    return res
+
+
+def _commit(user: str, staging: Path, out_dir: Path) -> bool:
+    """Move a user's staged templates and enrollment state into out_dir. Returns whether they existed before."""
+    existed = afr.has_user_templates(user, out_dir)
+    state = afr.enrollment_state_path(user, staging)
+    if state.exists():
+        os.replace(state, afr.enrollment_state_path(user, out_dir))
+    os.replace(staging / f"{user}.npy", out_dir / f"{user}.npy")
+    return existed
+
+
+def sync_indexes(out_dir: Path, manifest: Dict) -> List[str]:
+    """Apply every committed-but-unindexed user to the packed gallery / ANN index in one pass."""
+    users = [u for u, e in manifest["users"].items() if e.get("indexed") is False]
+    if not users:
+        return []
+    gallery_path = out_dir / template_gallery.GALLERY_FILENAME
+    # Read the committed .npy files: the packed gallery still holds these users' old rows
+    templates = {u: afr._read_templates(out_dir / f"{u}.npy") for u in users}
+    if gallery_path.exists():
+        template_gallery.upsert_users(gallery_path, templates)
+    ann_index.update_users(out_dir, templates)
+    for u in users:
+        manifest["users"][u]["indexed"] = True
+    save_manifest(out_dir, manifest)
+    return users
+
+
+def bulk_enroll(root, out_dir, workers: int = 1, settings: Dict = None, cache_path: str = "",
+                force: bool = False, dry_run: bool = False, verbose: bool = False) -> Dict:
+    """Enroll every changed user under root into out_dir. Returns a run summary."""
+    root, out_dir = Path(root), Path(out_dir)
+    settings = dict(settings or {})
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    t0 = time.perf_counter()
+    scan = scan_dataset(root)
+    scan_s = time.perf_counter() - t0
+    manifest = load_manifest(out_dir)
+    to_enroll, up_to_date, gone = plan(scan, manifest, settings, out_dir, force=force)
+    summary = {"root": str(root), "n_users": len(scan), "n_images": sum(len(f) for f in scan.values()),
+               "scan_s": scan_s, "to_enroll": len(to_enroll), "up_to_date": len(up_to_date), "gone": gone,
+               "results": {}}
+    if dry_run:
+        summary["would_enroll"] = to_enroll
+        return summary
+
+    # Settings are recorded up front: every entry written from here on was enrolled with them
+    if manifest.get("settings") != settings:
+        manifest["users"] = {u: e for u, e in manifest["users"].items() if u not in to_enroll}
+    manifest["settings"] = settings
+    manifest["root"] = str(root.resolve())
+    for u in gone:
+        manifest["users"].pop(u, None)
+    save_manifest(out_dir, manifest)
+
+    staging = out_dir / STAGING_DIRNAME
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir()
+    if cache_path and not Path(cache_path).exists():
+        # Create it here so concurrent workers don't each write the magic header
+        Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        Path(cache_path).write_bytes(CACHE_MAGIC)
+
+    def finish(res: Dict) -> None:
+        user = res["user"]
+        summary["results"][user] = res
+        if res["status"] == "error":
+            # Not recorded in the manifest, so the next run retries the user
+            print(f"[bulk] {user}: enrollment failed: {res['error']}")
+            return
+        files = scan[user]
+        entry = {"digest": files_digest(files), "n_files": len(files), "status": res["status"], "k": res.get("k"),
+                 "n_usable": res.get("n_usable"), "enrolled_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        if res["status"] in ("created", "overwritten"):
+            existed = _commit(user, staging, out_dir)
+            entry["status"] = res["status"] = "overwritten" if existed else "created"
+            entry["indexed"] = False
+        manifest["users"][user] = entry
+        append_manifest_entry(out_dir, user, entry)
+        if verbose:
+            print(f"[bulk] {user}: {res['status']} k={res.get('k')} usable={res.get('n_usable')}/{res.get('n_images')}"
+                  f" in {res['seconds']:.1f}s")
+
+    def failed(user: str, e: Exception) -> Dict:
+        return {"user": user, "status": "error", "error": f"{type(e).__name__}: {e}"}
+
+    jobs = [(u, str(root), [f[0] for f in scan[u]], str(staging), settings) for u in to_enroll]
+    t1 = time.perf_counter()
+    # One user's failure (e.g. a corrupt image) is recorded and the run goes on
+    if workers <= 1:
+        _worker_init(cache_path)
+        for job in jobs:
+            try:
+                res = _enroll_job(job)
+            except Exception as e:
+                res = failed(job[0], e)
+            finish(res)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_worker_init, initargs=(cache_path,)) as ex:
+            futures = {ex.submit(_enroll_job, job): job[0] for job in jobs}
+            for fut in as_completed(futures):
+                try:
+                    res = fut.result()
+                except Exception as e:
+                    res = failed(futures[fut], e)
+                finish(res)
+    summary["enroll_s"] = time.perf_counter() - t1
+    summary["errors"] = sorted(u for u, res in summary["results"].items() if res["status"] == "error")
+    summary["indexed"] = sync_indexes(out_dir, manifest)
+    save_manifest(out_dir, manifest)  # folds this run's journal into the manifest
+    shutil.rmtree(staging, ignore_errors=True)
+    return summary
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Enroll every user folder under --root, skipping unchanged users")
+    ap.add_argument("--root", type=str, required=True, help="Dataset root with one folder per user")
+    ap.add_argument("--out", type=str, default="user_templates", help="Templates directory")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Users enrolled in parallel")
+    ap.add_argument("--model", type=str, default="hog", choices=["hog", "cnn"])
+    ap.add_argument("--k", type=int, default=5, help="Max K-means centroids per user")
+    ap.add_argument("--min-per-cluster", type=int, default=12)
+    ap.add_argument("--cluster", type=str, default="kmeans", choices=list(afr.CLUSTER_METHODS))
+    ap.add_argument("--n-init", type=int, default=10, help="Clustering seedings per user")
+    ap.add_argument("--min-blur", type=float, default=40.0)
+    ap.add_argument("--min-size", type=int, default=64)
+    ap.add_argument("--detect-max-side", type=int, default=None)
+    ap.add_argument("--early-reject", action="store_true",
+                    help="Reduced-resolution blur/size pre-check for JPEGs (may reject images the full check accepts)")
+    ap.add_argument("--min-file-bytes", type=int, default=0, help="Reject image files smaller than this unread")
+    ap.add_argument("--embed-cache", type=str, default="", help="Embedding cache file shared by the workers")
+    ap.add_argument("--force", action="store_true", help="Re-enroll every user")
+    ap.add_argument("--dry-run", action="store_true", help="Only report which users would be enrolled")
+    ap.add_argument("--verbose", action="store_true")
+    args = ap.parse_args()
+
+    settings = {"model": args.model, "k_max": args.k, "min_per_cluster": args.min_per_cluster,
+                "min_blur": args.min_blur, "min_size": args.min_size, "detect_max_side": args.detect_max_side,
+                "cluster_method": args.cluster, "n_init": args.n_init, "early_reject": args.early_reject,
+                "min_file_bytes": args.min_file_bytes}
+    s = bulk_enroll(args.root, args.out, workers=args.workers, settings=settings, cache_path=args.embed_cache,
+                    force=args.force, dry_run=args.dry_run, verbose=args.verbose)
+    print(f"Scanned {s['n_users']} users / {s['n_images']} images in {s['scan_s']:.2f}s: "
+          f"{s['to_enroll']} to enroll, {s['up_to_date']} up to date")
+    if s["gone"]:
+        print(f"No longer in the dataset (templates kept): {s['gone']}")
+    if args.dry_run:
+        print(f"Would enroll: {s['would_enroll']}")
+        return
+    counts: Dict[str, int] = {}
+    for res in s["results"].values():
+        counts[res["status"]] = counts.get(res["status"], 0) + 1
+    print(f"Enrolled in {s['enroll_s']:.1f}s: {counts}; index/gallery updated for {len(s['indexed'])} users")
+    if s["errors"]:
+        print(f"Failed (retried on the next run): {s['errors']}")
+
+
+if __name__ == "__main__":
+    main()
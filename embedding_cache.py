@@ -0,0 +1,107 @@
+"""
+Content-addressed embedding cache
+
+Maps (image content, detector model, quality-gate parameters) -> (128-d embedding, box)
+so re-running enrollment or evaluation with different clustering/threshold
+settings does not re-run dlib on unchanged images. Rejected images are cached
+too (as "no embedding"), so they are not re-decoded either.
+
+File layout: an 8-byte magic followed by fixed-size, append-only records
+  key (32 bytes, sha256) | usable (u8) | pad (3) | box t,r,b,l (4 x i32) | embedding (128 x f32)
+A torn record at the end of the file (crash mid-append) is truncated on load.
+"""
+
+import hashlib
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+CACHE_MAGIC = b"FREMBC01"
+EMBED_DIM = 128
+_RECORD = struct.Struct(f"<32sB3x4i{EMBED_DIM * 4}s")
+
+MISS = object()
+
+
+class EmbeddingCache:
+    """Append-only on-disk cache of face embeddings keyed by image content hash + parameters."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._entries: Dict[bytes, Tuple[Optional[np.ndarray], Optional[Tuple[int, int, int, int]]]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    @staticmethod
+    def make_key(content: bytes, **params) -> bytes:
+        """sha256 over the image bytes and the (sorted) parameters that affect the result."""
+        h = hashlib.sha256(hashlib.sha256(content).digest())
+        for name in sorted(params):
+            h.update(f"|{name}={params[name]!r}".encode("utf-8"))
+        return h.digest()
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        data = self.path.read_bytes()
+        if not data.startswith(CACHE_MAGIC):
+            raise ValueError(f"Not an embedding cache: {self.path}")
+        n = (len(data) - len(CACHE_MAGIC)) // _RECORD.size
+        end = len(CACHE_MAGIC) + n * _RECORD.size
+        if end != len(data):
+            # Drop a torn tail so later appends stay record-aligned
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+        for i in range(n):
+            off = len(CACHE_MAGIC) + i * _RECORD.size
+            key, usable, t, r, b, l, vec = _RECORD.unpack_from(data, off)
+            if usable:
+                self._entries[key] = (np.frombuffer(vec, dtype="<f4").copy(), (t, r, b, l))
+            else:
+                self._entries[key] = (None, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: bytes) -> bool:
+        return key in self._entries
+
+    def get(self, key: bytes):
+        """Return (embedding, box) — (None, None) for a cached rejection — or MISS."""
+        entry = self._entries.get(key, MISS)
+        with self._lock:
+            if entry is MISS:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def put(self, key: bytes, emb: Optional[np.ndarray], box: Optional[Tuple[int, int, int, int]]) -> None:
+        """Record a result and append it to the file (one write per record)."""
+        if emb is not None:
+            emb = np.asarray(emb, dtype="<f4").reshape(-1)
+            if emb.shape[0] != EMBED_DIM:
+                raise ValueError(f"Embedding dim {emb.shape[0]} != {EMBED_DIM}")
+            rec = _RECORD.pack(key, 1, *[int(v) for v in box], emb.tobytes())
+        else:
+            rec = _RECORD.pack(key, 0, 0, 0, 0, 0, b"\0" * (EMBED_DIM * 4))
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (None, None) if emb is None else (emb.copy(), tuple(int(v) for v in box))
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            new_file = not self.path.exists()
+            with open(self.path, "ab") as f:
+                if new_file:
+                    f.write(CACHE_MAGIC)
+                f.write(rec)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "bytes": os.path.getsize(self.path) if self.path.exists() else 0}
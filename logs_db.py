@@ -2,6 +2,9 @@ import os
 import mysql.connector
 from datetime import datetime, timezone
 from pathlib import Path
+
+import ann_index
+import template_gallery
 # from zoneinfo import ZoneInfo  # available in Python 3.9+
 
 CREATE_TABLE_SQL = """
@@ -149,6 +152,12 @@ def fetch_users(limit: int = 50, templates_dir: str = "user_templates") -> List[
         # Directory missing or not a folder → nothing to return
         return []
 
+    # Packed gallery present → names come from its index, plus users whose .npy is newer
+    gallery = template_gallery.open_gallery(base)
+    if gallery is not None:
+        names = sorted(set(gallery.names) | set(template_gallery.newer_npy_users(base, gallery)), key=str.lower)
+        return [{"name": n} for n in names[:max(0, int(limit))]]
+
     # Find all .npy files (recursively), ignore hidden files
     npy_files = [
         p for p in base.rglob("*.npy")
@@ -171,7 +180,8 @@ def fetch_users(limit: int = 50, templates_dir: str = "user_templates") -> List[
 
 def delete_user(name: str, templates_dir: str = "user_templates", recursive: bool = True) -> int:
     """
-    Delete .npy file(s) whose filename (without extension) equals `name` inside `templates_dir`.
+    Delete .npy file(s) whose filename (without extension) equals `name` inside `templates_dir`,
+    along with <name>.enroll.npz, and drop the user from the packed gallery and ANN index if they exist.
 
     Args:
         name: The target filename stem to delete (e.g., 'omar' deletes 'omar.npy').
@@ -179,16 +189,25 @@ def delete_user(name: str, templates_dir: str = "user_templates", recursive: boo
         recursive: If True, search subdirectories; if False, only the top level.
 
     Returns:
-        The number of files deleted (0 if none found).
+        The number of files/gallery entries deleted (0 if none found).
     """
     base = Path(templates_dir)
     if not base.is_dir() or not name:
         return 0
 
-    iterator = base.rglob("*.npy") if recursive else base.glob("*.npy")
-    targets = [p for p in iterator if p.is_file() and p.stem == name]
-
     deleted = 0
+    if template_gallery.remove_user(base / template_gallery.GALLERY_FILENAME, name):
+        deleted += 1
+    ann_index.update_user(base, name, None)
+
+    if recursive:
+        targets = [p for p in base.rglob("*.npy") if p.is_file() and p.stem == name]
+    else:
+        # Flat layout: <templates_dir>/<name>.npy, no directory listing needed
+        targets = [p for p in [base / f"{name}.npy"] if p.is_file()]
+    # Raw enrollment embeddings kept for incremental updates
+    targets += [p for p in [base / f"{name}.enroll.npz"] if p.is_file()]
+
     for p in targets:
         try:
             p.unlink()
@@ -0,0 +1,188 @@
+"""
+In-process metrics registry with Prometheus text exposition
+
+Hot-path updates (Counter.inc, Histogram.observe) only append a tuple to a
+collections.deque, which is atomic in CPython, so request threads never wait
+on a lock. Events are folded into the counters/histograms when /metrics is
+scraped, or opportunistically by whichever thread finds the backlog above
+DRAIN_EVERY (with a non-blocking lock attempt, so nobody waits there either).
+
+Usage
+-----
+from metrics import REGISTRY, record_verification
+record_verification(result, endpoint="face-recognition")
+REGISTRY.render()   # text/plain; version=0.0.4
+"""
+
+import bisect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Seconds; covers 1 ms scoring up to multi-second CNN detections
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DRAIN_EVERY = 4096
+
+_COUNTER, _HISTOGRAM = 0, 1
+
+
+def _labels_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    esc = [(k, v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for k, v in items]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in esc) + "}"
+
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+class Counter:
+    def __init__(self, registry: "Registry", name: str, doc: str):
+        self.registry, self.name, self.doc = registry, name, doc
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        self.registry._push((_COUNTER, self, _labels_key(labels), amount))
+
+    def _apply(self, key, amount: float) -> None:
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def _render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        for key, v in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {_fmt(v)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, registry: "Registry", name: str, doc: str, buckets=DEFAULT_BUCKETS):
+        self.registry, self.name, self.doc = registry, name, doc
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts (+Inf last), sum, count]
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        self.registry._push((_HISTOGRAM, self, _labels_key(labels), value))
+
+    def _apply(self, key, value: float) -> None:
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def _render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, n) in sorted(self.values.items()):
+            cum = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                cum += c
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', _fmt(le)))} {cum}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {n}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._events: deque = deque()
+        self._drain_lock = threading.Lock()
+        self._metrics: Dict[str, object] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+    def counter(self, name: str, doc: str) -> Counter:
+        return self._metrics.setdefault(name, Counter(self, name, doc))
+
+    def histogram(self, name: str, doc: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(self, name, doc, buckets))
+
+    def gauge_callback(self, name: str, doc: str, fn: Callable[[], float]) -> None:
+        """Gauge whose value is read from fn() at scrape time (e.g. a queue depth)."""
+        self._gauges[name] = (doc, fn)
+
+    def _push(self, event) -> None:
+        self._events.append(event)
+        if len(self._events) > DRAIN_EVERY and self._drain_lock.acquire(blocking=False):
+            try:
+                self._drain()
+            finally:
+                self._drain_lock.release()
+
+    def _drain(self) -> None:
+        events = self._events
+        while True:
+            try:
+                _, metric, key, value = events.popleft()
+            except IndexError:
+                return
+            metric._apply(key, value)
+
+    def render(self) -> str:
+        """Fold pending events and return the Prometheus text exposition."""
+        with self._drain_lock:
+            self._drain()
+            lines: List[str] = []
+            for name in sorted(self._metrics):
+                lines.extend(self._metrics[name]._render())
+        for name in sorted(self._gauges):
+            doc, fn = self._gauges[name]
+            try:
+                value = float(fn())
+            except Exception:
+                continue
+            lines += [f"# HELP {name} {doc}", f"# TYPE {name} gauge", f"{name} {_fmt(value)}"]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("face_stage_seconds", "Verification pipeline stage latency (detect, embed, score, pipeline)")
+DECISIONS = REGISTRY.counter("face_decisions_total", "Verification/identification outcomes by endpoint")
+REJECTS = REGISTRY.counter("face_rejects_total", "Images that produced no score, by reason")
+DB_LOG_SECONDS = REGISTRY.histogram("face_db_log_seconds", "Latency of logging a face event to the database")
+SPACES_UPLOAD_SECONDS = REGISTRY.histogram("face_spaces_upload_seconds", "Latency of archiving an image to Spaces")
+SERVICE_REJECTIONS = REGISTRY.counter("face_service_rejections_total", "Jobs refused by the verification service")
+
+_STAGES = (("detect_ms", "detect"), ("embed_ms", "embed"), ("score_ms", "score"), ("pipeline_ms", "pipeline"))
+
+
+def record_verification(result, endpoint: str) -> None:
+    """Record stage timings, the decision and any reject reason of a verify_user_image /
+    identify_image result (a dict, or a list of dicts from return_all=True)."""
+    if isinstance(result, list):
+        result = result[0] if result else None
+    if not result:
+        return
+    timing = result.get("timing") or {}
+    for key, stage in _STAGES:
+        if key in timing:
+            STAGE_SECONDS.observe(timing[key] / 1000.0, stage=stage, endpoint=endpoint)
+    reason = result.get("reason")
+    if reason:
+        REJECTS.inc(reason=reason, endpoint=endpoint)
+    if "decision" in result:
+        outcome = "accept" if result["decision"] else "reject"
+    else:
+        outcome = "identified" if result.get("identified") else "unknown"
+    DECISIONS.inc(outcome=outcome, endpoint=endpoint)
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels):
+    """Observe the seconds spent inside the `with` block into `histogram`."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - t0, **labels)
@@ -0,0 +1,180 @@
+"""
+In-memory name index for local_screening
+
+Holds the first column of the watchlist spreadsheet (data.xlsx) in memory and
+answers best_match(name) with exactly what
+
+    process.extractOne(name, names, scorer=fuzz.ratio)
+
+returned when the sheet was parsed on every request: the same (match, score,
+index), ties going to the earliest row. It is just faster:
+  - exact hit   : dict lookup, score 100.0
+  - otherwise   : rapidfuzz over names grouped by length. fuzz.ratio(a, b) can be
+                  at most 200 * min(len) / (len(a) + len(b)), so length groups that
+                  cannot beat the best score so far are never scored
+  - repeats     : small LRU of recent answers (logins retry the same name)
+
+The sheet is re-read when its (mtime_ns, size) changes. The parsed names are
+kept in a binary cache next to it (.<sheet>.names.npz), so a restart loads a
+large watchlist with np.load instead of openpyxl.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+CACHE_VERSION = 1
+_RESULT_CACHE_SIZE = 4096
+# Below this many names one rapidfuzz call over the whole list is already cheapest
+_BUCKET_MIN_NAMES = 2048
+
+
+def cache_path_for(sheet_path: Path) -> Path:
+    return sheet_path.with_name(f".{sheet_path.name}.names.npz")
+
+
+def _read_sheet(path: Path) -> List[str]:
+    import pandas as pd  # only on a cache miss; pandas + openpyxl are slow to import
+    df = pd.read_excel(path, usecols=[0], header=0)
+    return df.iloc[:, 0].dropna().astype(str).tolist()
+
+
+def _signature(path: Path) -> Tuple[int, int]:
+    st = path.stat()
+    return st.st_mtime_ns, st.st_size
+
+
+class _Snapshot:
+    """Immutable view of one version of the sheet."""
+
+    def __init__(self, names: List[str], sig: Tuple[int, int]):
+        self.names = names
+        self.sig = sig
+        self.exact: Dict[str, int] = {}
+        for i, n in enumerate(names):
+            self.exact.setdefault(n, i)
+        # Length groups, each in original row order: length -> (names, row indices)
+        by_len: Dict[int, List[int]] = {}
+        for i, n in enumerate(names):
+            by_len.setdefault(len(n), []).append(i)
+        self.groups = [(length, [names[i] for i in rows], rows) for length, rows in sorted(by_len.items())]
+        self.results: "OrderedDict[str, Optional[Tuple[str, float, int]]]" = OrderedDict()
+
+
+class NameIndex:
+    """Watchlist names from one spreadsheet, reloaded when the file changes."""
+
+    def __init__(self, path, use_disk_cache: bool = True):
+        self.path = Path(path)
+        self.use_disk_cache = use_disk_cache
+        self._lock = threading.Lock()
+        self._snap: Optional[_Snapshot] = None
+        self.reloads = 0
+
+    # Loading
+
+    def _load_names(self, sig: Tuple[int, int]) -> List[str]:
+        cache = cache_path_for(self.path)
+        if self.use_disk_cache and cache.exists():
+            try:
+                with np.load(cache, allow_pickle=False) as z:
+                    if int(z["version"]) == CACHE_VERSION and tuple(int(v) for v in z["sig"]) == sig:
+                        return z["names"].tolist()
+            except Exception:
+                pass  # unreadable or from another version: rebuild below
+        names = _read_sheet(self.path)
+        if self.use_disk_cache:
+            tmp = cache.with_name(f".{cache.stem}.{os.getpid()}.tmp.npz")
+            try:
+                np.savez(tmp, version=np.int64(CACHE_VERSION), sig=np.array(sig, dtype=np.int64),
+                         names=np.array(names, dtype=str))
+                os.replace(tmp, cache)
+            except OSError:
+                pass  # read-only deployment: keep serving from memory
+        return names
+
+    def refresh(self) -> _Snapshot:
+        """Current snapshot, re-reading the sheet if its mtime or size changed."""
+        sig = _signature(self.path)
+        snap = self._snap
+        if snap is not None and snap.sig == sig:
+            return snap
+        with self._lock:
+            if self._snap is None or self._snap.sig != sig:
+                self._snap = _Snapshot(self._load_names(sig), sig)
+                self.reloads += 1
+            return self._snap
+
+    @property
+    def names(self) -> List[str]:
+        return self.refresh().names
+
+    # Lookup
+
+    def best_match(self, name: str) -> Optional[Tuple[str, float, int]]:
+        """(match, score, row) of the best fuzz.ratio match, or None for an empty list;
+        identical to process.extractOne(name, names, scorer=fuzz.ratio)."""
+        snap = self.refresh()
+        with self._lock:
+            if name in snap.results:
+                snap.results.move_to_end(name)
+                return snap.results[name]
+        if not snap.names:
+            result = None
+        elif name and name in snap.exact:
+            i = snap.exact[name]
+            result = (snap.names[i], 100.0, i)
+        else:
+            result = self._fuzzy(snap, name)
+        with self._lock:
+            snap.results[name] = result
+            if len(snap.results) > _RESULT_CACHE_SIZE:
+                snap.results.popitem(last=False)
+        return result
+
+    @staticmethod
+    def _fuzzy(snap: _Snapshot, name: str) -> Tuple[str, float, int]:
+        from rapidfuzz import fuzz, process
+        if len(snap.names) < _BUCKET_MIN_NAMES or not name:
+            return process.extractOne(name, snap.names, scorer=fuzz.ratio)
+        q = len(name)
+        # Most promising lengths first: upper bound of fuzz.ratio for each group
+        groups = sorted(snap.groups, key=lambda g: -(200.0 * min(q, g[0]) / (q + g[0])))
+        best_score, best_row = -1.0, -1
+        for length, names, rows in groups:
+            bound = 200.0 * min(q, length) / (q + length)
+            if bound < best_score - 1e-9:
+                break
+            hit = process.extractOne(name, names, scorer=fuzz.ratio, score_cutoff=max(best_score, 0.0))
+            if hit is None:
+                continue
+            _, score, j = hit
+            if score > best_score or (score == best_score and rows[j] < best_row):
+                best_score, best_row = score, rows[j]
+        return snap.names[best_row], best_score, best_row
+
+    def stats(self) -> Dict:
+        snap = self._snap
+        return {"path": str(self.path), "names": len(snap.names) if snap else 0,
+                "reloads": self.reloads, "cached_results": len(snap.results) if snap else 0}
+
+
+# -----------------------------
+# Process-wide indexes
+# -----------------------------
+
+_indexes_lock = threading.Lock()
+_indexes: Dict[str, NameIndex] = {}
+
+
+def get_index(path) -> NameIndex:
+    """Shared NameIndex for a sheet path (one per process)."""
+    key = str(Path(path).resolve())
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = NameIndex(path)
+        return _indexes[key]
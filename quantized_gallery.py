@@ -0,0 +1,133 @@
+"""
+Quantized template gallery for 1:N search
+
+Keeps a compact copy of the stacked gallery (see load_gallery_matrix) for the
+first scoring pass:
+  - float16 : 2 bytes per value; cosine error ~1e-4 on user_templates
+  - int8    : 1 byte per value plus one float32 scale per row
+              (row = scale * q, q in [-127, 127]); cosine error ~3e-3
+int8 scores about as fast as float32 (rows are upcast in cache-sized chunks);
+numpy's float16 upcast is slow, so float16 trades latency for memory.
+See bench/bench_quantized.py.
+The first pass ranks users by their approximate max score; the best `rescore`
+users are then scored exactly against the float32 rows, so the returned
+scores are identical to exact search whenever the true top-k users survive
+the first pass (rescore >> top_k makes that the overwhelmingly common case).
+
+With a packed gallery (template_gallery.py) the float32 matrix is a memory map:
+only the rows of rescored users are paged in, and the resident per-worker copy
+is the quantized one.
+"""
+
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+QUANT_DTYPES = ("float16", "int8")
+_CHUNK_ROWS = 65536
+# Rows upcast per step of the first pass; small enough that the float32 buffer stays in cache
+_SCORE_CHUNK_ROWS = 1024
+
+
+def quantize_rows(T: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Return (Q, scales): Q in `dtype`, scales [N] float32 (all ones for float16)."""
+    T = np.asarray(T, dtype=np.float32)
+    if dtype == "float16":
+        return T.astype(np.float16), np.ones(T.shape[0], dtype=np.float32)
+    if dtype == "int8":
+        scales = np.abs(T).max(axis=1) / 127.0 if T.shape[0] else np.zeros(0, np.float32)
+        scales = np.maximum(scales, 1e-12).astype(np.float32)
+        Q = np.clip(np.rint(T / scales[:, None]), -127, 127).astype(np.int8)
+        return Q, scales
+    raise ValueError(f"Unsupported quantized dtype {dtype!r}; expected one of {QUANT_DTYPES}")
+
+
+class QuantizedGallery:
+    """Quantized [N, D] rows with the per-user offsets of the gallery they were built from."""
+
+    def __init__(self, names: List[str], Q: np.ndarray, scales: np.ndarray, offsets: np.ndarray):
+        self.names = list(names)
+        self.Q = Q
+        self.scales = np.asarray(scales, dtype=np.float32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_matrix(cls, names: List[str], T_all: np.ndarray, offsets: np.ndarray,
+                    dtype: str = "int8") -> "QuantizedGallery":
+        Q = np.empty(T_all.shape, dtype=np.float16 if dtype == "float16" else np.int8)
+        scales = np.empty(T_all.shape[0], dtype=np.float32)
+        # Chunked so a memory-mapped gallery is never fully materialized as float32
+        for s in range(0, T_all.shape[0], _CHUNK_ROWS):
+            Q[s:s + _CHUNK_ROWS], scales[s:s + _CHUNK_ROWS] = quantize_rows(T_all[s:s + _CHUNK_ROWS], dtype)
+        return cls(names, Q, scales, offsets)
+
+    @property
+    def dtype(self) -> str:
+        return "float16" if self.Q.dtype == np.float16 else "int8"
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.Q.nbytes + (self.scales.nbytes if self.dtype == "int8" else 0))
+
+    def approx_scores(self, q: np.ndarray) -> np.ndarray:
+        """Approximate cosine of unit vector q against every row ([N] float32)."""
+        q = np.asarray(q, dtype=np.float32)
+        n = self.Q.shape[0]
+        out = np.empty(n, dtype=np.float32)
+        buf = np.empty((min(n, _SCORE_CHUNK_ROWS), self.Q.shape[1]), dtype=np.float32)
+        for s in range(0, n, _SCORE_CHUNK_ROWS):
+            chunk = self.Q[s:s + _SCORE_CHUNK_ROWS]
+            b = buf[:chunk.shape[0]]
+            np.copyto(b, chunk, casting="unsafe")
+            np.dot(b, q, out=out[s:s + chunk.shape[0]])
+        if self.dtype == "int8":
+            out *= self.scales
+        return out
+
+    def rank(self, q: np.ndarray, T_all: np.ndarray, top_k: int = 5,
+             rescore: int = 32) -> Tuple[np.ndarray, np.ndarray]:
+        """Top_k users for unit vector q: approximate per-user max over the quantized rows,
+        then exact float32 rescoring of the best max(rescore, top_k) users. Returns
+        (user_indices, scores) sorted by descending exact score, like rank_users."""
+        n_users = len(self.offsets) - 1
+        if n_users <= 0 or self.Q.shape[0] == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        S = self.approx_scores(q)
+        starts, counts = self.offsets[:-1], np.diff(self.offsets)
+        approx = np.maximum.reduceat(S, np.minimum(starts, S.shape[0] - 1))
+        approx[counts == 0] = -np.inf
+        m = max(1, min(n_users, max(int(rescore), int(top_k))))
+        cand = np.argpartition(-approx, m - 1)[:m] if m < n_users else np.arange(n_users)
+        cand = cand[counts[cand] > 0]
+
+        # Exact float32 rescoring of the candidates' rows only
+        c_counts = counts[cand]
+        c_offsets = np.concatenate([[0], np.cumsum(c_counts)[:-1]])
+        rows = np.repeat(starts[cand] - c_offsets, c_counts) + np.arange(int(c_counts.sum()))
+        exact = np.maximum.reduceat(np.asarray(T_all[rows], dtype=np.float32) @ q, c_offsets)
+        order = np.argsort(-exact, kind="stable")[:max(1, int(top_k))]
+        return cand[order], exact[order]
+
+
+# -----------------------------
+# Process-wide quantized copies
+# -----------------------------
+
+_lock = threading.Lock()
+_quantized: Dict[Tuple[str, str], Tuple[np.ndarray, QuantizedGallery]] = {}
+
+
+def quantized_for(key: str, names: List[str], T_all: np.ndarray, offsets: np.ndarray,
+                  dtype: str) -> QuantizedGallery:
+    """Quantized copy of the gallery (names, T_all, offsets) stored under `key`
+    (e.g. the templates dir). Rebuilt when a different T_all object is passed, i.e.
+    when load_gallery_matrix has reloaded the gallery."""
+    with _lock:
+        entry = _quantized.get((key, dtype))
+        if entry is not None and entry[0] is T_all:
+            return entry[1]
+    G = QuantizedGallery.from_matrix(names, T_all, offsets, dtype)
+    with _lock:
+        _quantized[(key, dtype)] = (T_all, G)
+    return G
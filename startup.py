@@ -0,0 +1,113 @@
+"""
+Lazy imports and an import-time report for app.py
+
+lazy("cv2") returns a stand-in that imports the module on first attribute
+access, so `cv2 = lazy("cv2")` keeps every `cv2.xxx` call site unchanged while
+moving the import cost out of process start. Every lazy load is timed and
+tagged with the phase that triggered it ("import", "warmup" or "request"),
+which is what import_report() summarizes: a short, per-dependency version of
+`python -X importtime`, served by app.py at /debug/import-times.
+
+Times are cumulative (a module's time includes whatever it imports that was
+not loaded yet), so the first of two modules sharing a dependency pays for it.
+"""
+
+import importlib
+import sys
+import threading
+import time
+from typing import Dict, Iterable, List
+
+PROCESS_START = time.perf_counter()
+
+_lock = threading.RLock()
+_loads: List[Dict] = []
+_phase = "import"
+_marks: Dict[str, float] = {}
+
+
+def set_phase(phase: str) -> None:
+    """Tag subsequent lazy loads ("import" while modules load, then "warmup", then "request")."""
+    global _phase
+    _phase = phase
+
+
+def mark(name: str) -> None:
+    """Record a named point in startup (seconds since this module was first imported)."""
+    _marks[name] = time.perf_counter() - PROCESS_START
+
+
+def timed_import(name: str):
+    """importlib.import_module(name), recorded in the report."""
+    with _lock:
+        cached = name in sys.modules
+        t0 = time.perf_counter()
+        module = importlib.import_module(name)
+        t1 = time.perf_counter()
+        if not any(entry["module"] == name for entry in _loads):
+            _loads.append({"module": name, "ms": (t1 - t0) * 1000.0, "phase": _phase,
+                           "at_s": t0 - PROCESS_START, "already_loaded": cached})
+    return module
+
+
+class LazyModule:
+    """Module stand-in that imports `name` on first attribute access."""
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            module = self.__dict__["_module"] = timed_import(self.__dict__["_name"])
+        return module
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.__dict__["_module"] is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.is_loaded else "not loaded"
+        return f"<lazy module {self.__dict__['_name']!r} ({state})>"
+
+
+_lazy: Dict[str, LazyModule] = {}
+
+
+def lazy(name: str) -> LazyModule:
+    """Shared LazyModule for `name` (one per process, so every user sees the same load)."""
+    with _lock:
+        if name not in _lazy:
+            _lazy[name] = LazyModule(name)
+        return _lazy[name]
+
+
+def load_all(names: Iterable[str] = None) -> None:
+    """Import the given lazy modules now (default: every one registered)."""
+    for name in list(names if names is not None else _lazy):
+        lazy(name)._load()
+
+
+def import_report() -> Dict:
+    """Summary of startup: named marks, lazy loads by cost, and modules not loaded yet."""
+    with _lock:
+        loads = sorted(_loads, key=lambda entry: -entry["ms"])
+        by_phase: Dict[str, float] = {}
+        for entry in loads:
+            by_phase[entry["phase"]] = by_phase.get(entry["phase"], 0.0) + entry["ms"]
+        return {
+            "uptime_s": time.perf_counter() - PROCESS_START,
+            "marks_s": dict(_marks),
+            "phase": _phase,
+            "lazy_ms_by_phase": by_phase,
+            "loads": [dict(entry) for entry in loads],
+            "not_loaded": sorted(name for name, m in _lazy.items() if not m.is_loaded),
+            "modules_in_process": len(sys.modules),
+        }
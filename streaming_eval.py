@@ -0,0 +1,199 @@
+"""
+Streaming, resumable evaluation log
+
+Per-image verification results are appended to a run directory as fixed-size
+chunks instead of being kept in memory:
+
+  <run_dir>/chunk_000000.npz ...  idx [m] (position in the test list), owner [m]
+                                  (-1 = image unusable), scores [m, n_users] float32,
+                                  det_embed_ms [m], score_ms [m]
+  <run_dir>/checkpoint.json       {"fingerprint", "n_done", "n_chunks", ...}
+
+Each chunk is written to a temp file and renamed, then the checkpoint is
+rewritten the same way, so after a crash the checkpoint names exactly the
+chunks that are complete; --resume continues at n_done and chunks past
+n_chunks (a torn run) are discarded.
+
+Metrics are then computed in one pass over the chunks with fixed-bin
+histograms (ScoreHistogram), so memory does not grow with the number of
+trials. ROC points sit at histogram bin edges: TPR/FPR at those thresholds
+are exact, only the set of candidate thresholds is discretized (1e-4 wide
+bins by default).
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
+
+import numpy as np
+
+CHECKPOINT_FILENAME = "checkpoint.json"
+LOG_VERSION = 1
+
+
+def fingerprint(*parts) -> str:
+    """sha256 over the reprs / bytes of everything that must match for a resume to be valid."""
+    h = hashlib.sha256()
+    for p in parts:
+        if isinstance(p, np.ndarray):
+            h.update(np.ascontiguousarray(p).tobytes())
+        else:
+            h.update(repr(p).encode("utf-8"))
+        h.update(b"|")
+    return h.hexdigest()
+
+
+class ScoreLog:
+    """Append-only chunked log of per-image results with a resumable checkpoint."""
+
+    def __init__(self, run_dir, fingerprint: str, resume: bool = False):
+        self.dir = Path(run_dir)
+        self.fingerprint = fingerprint
+        self.n_done = 0
+        self.n_chunks = 0
+        ckpt = self.dir / CHECKPOINT_FILENAME
+        if ckpt.exists():
+            state = json.loads(ckpt.read_text())
+            if not resume:
+                raise FileExistsError(f"{self.dir} already holds an evaluation log; pass resume or use a new directory")
+            if state.get("fingerprint") != fingerprint or state.get("version") != LOG_VERSION:
+                raise ValueError(f"Cannot resume {self.dir}: users, templates, test set or settings changed")
+            self.n_done = int(state["n_done"])
+            self.n_chunks = int(state["n_chunks"])
+        self.dir.mkdir(parents=True, exist_ok=True)
+        # Chunks past the checkpoint belong to a run that died before checkpointing them
+        for p in self.dir.glob("chunk_*.npz"):
+            if int(p.stem.split("_")[1]) >= self.n_chunks:
+                p.unlink()
+
+    def _chunk_path(self, i: int) -> Path:
+        return self.dir / f"chunk_{i:06d}.npz"
+
+    def append_chunk(self, idx: np.ndarray, owner: np.ndarray, scores: np.ndarray,
+                     det_embed_ms: np.ndarray, score_ms: np.ndarray) -> None:
+        """Persist one chunk, then advance the checkpoint past it."""
+        path = self._chunk_path(self.n_chunks)
+        tmp = path.with_name(f".{path.stem}.{os.getpid()}.tmp.npz")
+        np.savez(tmp, idx=np.asarray(idx, np.int64), owner=np.asarray(owner, np.int32),
+                 scores=np.asarray(scores, np.float32), det_embed_ms=np.asarray(det_embed_ms, np.float32),
+                 score_ms=np.asarray(score_ms, np.float32))
+        os.replace(tmp, path)
+        self.n_chunks += 1
+        self.n_done = int(idx[-1]) + 1 if len(idx) else self.n_done
+        self._write_checkpoint()
+
+    def _write_checkpoint(self) -> None:
+        ckpt = self.dir / CHECKPOINT_FILENAME
+        tmp = ckpt.with_name(f".{ckpt.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({"version": LOG_VERSION, "fingerprint": self.fingerprint,
+                                   "n_done": self.n_done, "n_chunks": self.n_chunks}, indent=2))
+        os.replace(tmp, ckpt)
+
+    def chunks(self) -> Iterator[Dict[str, np.ndarray]]:
+        """Yield the checkpointed chunks in order, one at a time."""
+        for i in range(self.n_chunks):
+            with np.load(self._chunk_path(i), allow_pickle=False) as z:
+                yield {k: z[k] for k in z.files}
+
+
+class ScoreHistogram:
+    """Fixed-bin histogram with exact count/sum/min/max, for streaming summaries."""
+
+    def __init__(self, edges: np.ndarray):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.n = 0
+        self.total = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    @classmethod
+    def linear(cls, lo: float, hi: float, n_bins: int) -> "ScoreHistogram":
+        return cls(np.linspace(lo, hi, n_bins + 1))
+
+    @classmethod
+    def log(cls, lo: float, hi: float, n_bins: int) -> "ScoreHistogram":
+        return cls(np.geomspace(lo, hi, n_bins + 1))
+
+    def add(self, x: np.ndarray) -> None:
+        x = np.asarray(x, dtype=np.float64).ravel()
+        if x.size == 0:
+            return
+        # Bin b holds edges[b] <= x < edges[b + 1]; out-of-range values go to the end bins
+        b = np.clip(np.searchsorted(self.edges, x, side="right") - 1, 0, len(self.counts) - 1)
+        self.counts += np.bincount(b, minlength=len(self.counts))
+        self.n += x.size
+        self.total += float(x.sum())
+        self.min = min(self.min, float(x.min()))
+        self.max = max(self.max, float(x.max()))
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.n if self.n else float("nan")
+
+    def percentile(self, q: float) -> float:
+        """Percentile q (0-100), interpolated within the bin that contains it."""
+        if self.n == 0:
+            return float("nan")
+        target = q / 100.0 * self.n
+        cum = np.cumsum(self.counts)
+        b = int(np.searchsorted(cum, max(target, 1e-12), side="left"))
+        b = min(b, len(self.counts) - 1)
+        before = cum[b - 1] if b > 0 else 0
+        frac = (target - before) / self.counts[b] if self.counts[b] else 0.0
+        v = self.edges[b] + frac * (self.edges[b + 1] - self.edges[b])
+        return float(min(max(v, self.min), self.max))
+
+
+def roc_from_histograms(genuine: ScoreHistogram, impostor: ScoreHistogram
+                        ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """(thresholds, tpr, fpr, tp, fp) like advance_face_recognition.roc_curve, with thresholds
+    at the lower edges of the non-empty bins (descending) and the leading "accept nothing" point."""
+    assert np.array_equal(genuine.edges, impostor.edges)
+    nz = np.flatnonzero((genuine.counts + impostor.counts) > 0)[::-1]
+    tp = np.cumsum(genuine.counts[nz])
+    fp = np.cumsum(impostor.counts[nz])
+    P = max(1, genuine.n)
+    N = max(1, impostor.n)
+    top = genuine.edges[nz[0] + 1] if nz.size else genuine.edges[-1]
+    thresholds = np.r_[top, genuine.edges[nz]]
+    tp = np.r_[0, tp]
+    fp = np.r_[0, fp]
+    return thresholds, tp / P, fp / N, tp, fp
+
+
+def histogram_summary(h: ScoreHistogram, prefix: str) -> Dict[str, float]:
+    """Same keys as advance_face_recognition._score_summary, from a histogram."""
+    if h.n == 0:
+        return {}
+    out = {f"{prefix}_mean": h.mean}
+    for q, name in ((0.1, "p0.1"), (1, "p1"), (50, "p50"), (99, "p99"), (99.9, "p99.9")):
+        out[f"{prefix}_{name}"] = h.percentile(q)
+    out[f"{prefix}_max"] = h.max
+    return out
+
+
+def accumulate(log: ScoreLog, score_bins: int = 20000) -> Dict[str, object]:
+    """One pass over the log: genuine/impostor score and timing histograms plus counts."""
+    genuine = ScoreHistogram.linear(-1.0, 1.0 + 1e-6, score_bins)
+    impostor = ScoreHistogram.linear(-1.0, 1.0 + 1e-6, score_bins)
+    det_ms = ScoreHistogram.log(1e-3, 1e6, 3000)
+    score_ms = ScoreHistogram.log(1e-6, 1e6, 3000)
+    n_images = n_unusable = 0
+    for chunk in log.chunks():
+        owner = chunk["owner"]
+        ok = owner >= 0
+        n_images += int(owner.size)
+        n_unusable += int((~ok).sum())
+        S = chunk["scores"][ok]
+        own = owner[ok]
+        mask = np.zeros(S.shape, dtype=bool)
+        mask[np.arange(S.shape[0]), own] = True
+        genuine.add(S[mask])
+        impostor.add(S[~mask])
+        det_ms.add(chunk["det_embed_ms"][ok])
+        score_ms.add(chunk["score_ms"][ok])
+    return {"genuine": genuine, "impostor": impostor, "det_embed_ms": det_ms, "score_ms": score_ms,
+            "n_images": n_images, "n_unusable": n_unusable}
@@ -0,0 +1,337 @@
+"""
+Packed template gallery
+
+One file holds every user's templates so lookups don't need a directory scan
+and worker processes can share the same pages through np.memmap.
+
+Updates rewrite the file and os.replace it. Read-modify-write updates
+(upsert_users / remove_user) hold an exclusive lock on .<gallery>.lock so
+concurrent enrollments in different processes don't drop each other's users.
+Windows refuses to replace a file that is still mapped, so there the gallery
+is read into memory instead of mapped (see TemplateGallery).
+
+File layout (little-endian)
+---------------------------
+  header   : magic b"FRGALLRY", version (u16), dim (u16), n_users (u32),
+             n_rows (u64), index_nbytes (u64)
+  index    : UTF-8 JSON  {"users": [[name, start_row, n_rows], ...]}
+  padding  : zero bytes up to a 64-byte boundary
+  matrix   : float32 [n_rows, dim], rows L2-normalized, grouped per user
+
+Usage
+-----
+python template_gallery.py pack user_templates          # per-user .npy -> user_templates/gallery.frg
+python template_gallery.py export user_templates/gallery.frg out_dir
+python template_gallery.py info user_templates/gallery.frg
+"""
+
+import argparse
+import contextlib
+import gc
+import json
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+GALLERY_FILENAME = "gallery.frg"
+GALLERY_MAGIC = b"FRGALLRY"
+GALLERY_VERSION = 1
+_HEADER = struct.Struct("<8sHHIQQ")
+_ALIGN = 64
+# Mapped files can't be replaced on Windows while any process still maps them
+MMAP_DEFAULT = os.name != "nt"
+_REPLACE_RETRIES = 20
+
+
+def _normalize_rows(T: np.ndarray, name: str) -> np.ndarray:
+    T = np.asarray(T)
+    if T.ndim != 2 or T.shape[1] not in (128, 512):
+        raise ValueError(f"Template shape invalid for {name}: {T.shape}")
+    T = T.astype(np.float32)
+    norms = np.linalg.norm(T, axis=1, keepdims=True) + 1e-12
+    return T / norms
+
+
+class TemplateGallery:
+    """Read-only view over a packed gallery file.
+
+    `matrix` is a read-only float32 [n_rows, dim] array, memory-mapped when `mmap`
+    is True (default everywhere but Windows) and read into memory otherwise;
+    `get(user)` returns a zero-copy slice of it. Users occupy contiguous rows in
+    `names` order and `offsets[i]:offsets[i + 1]` are the rows of `names[i]`.
+    `mtime_ns` is the file's modification time when it was opened.
+    """
+
+    def __init__(self, path, mmap: bool = None):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self.mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+            raw = f.read(_HEADER.size)
+            if len(raw) != _HEADER.size:
+                raise ValueError(f"Truncated gallery header: {self.path}")
+            magic, version, dim, n_users, n_rows, index_nbytes = _HEADER.unpack(raw)
+            if magic != GALLERY_MAGIC:
+                raise ValueError(f"Not a template gallery: {self.path}")
+            if version != GALLERY_VERSION:
+                raise ValueError(f"Unsupported gallery version {version}: {self.path}")
+            index = json.loads(f.read(index_nbytes).decode("utf-8"))
+
+        self.version = int(version)
+        self.dim = int(dim)
+        self.names: List[str] = [u[0] for u in index["users"]]
+        self._rows: Dict[str, Tuple[int, int]] = {u[0]: (int(u[1]), int(u[2])) for u in index["users"]}
+        if len(self.names) != n_users:
+            raise ValueError(f"Gallery index does not match header: {self.path}")
+        self.offsets = np.zeros(len(self.names) + 1, dtype=np.int64)
+        for i, name in enumerate(self.names):
+            self.offsets[i + 1] = self.offsets[i] + self._rows[name][1]
+
+        data_offset = _data_offset(index_nbytes)
+        if n_rows == 0:
+            self.matrix = np.zeros((0, self.dim), dtype=np.float32)
+        elif MMAP_DEFAULT if mmap is None else mmap:
+            self.matrix = np.memmap(self.path, dtype="<f4", mode="r",
+                                    offset=data_offset, shape=(int(n_rows), self.dim))
+        else:
+            self.matrix = np.fromfile(self.path, dtype="<f4", count=int(n_rows) * self.dim,
+                                      offset=data_offset).reshape(int(n_rows), self.dim)
+            if self.matrix.shape[0] != n_rows:
+                raise ValueError(f"Truncated gallery matrix: {self.path}")
+            self.matrix.flags.writeable = False
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, user: str) -> bool:
+        return user in self._rows
+
+    @property
+    def n_rows(self) -> int:
+        return int(self.matrix.shape[0])
+
+    def get(self, user: str) -> np.ndarray:
+        """Return the [K, dim] templates of `user` (raises KeyError if absent)."""
+        start, count = self._rows[user]
+        return self.matrix[start:start + count]
+
+    def to_dict(self) -> Dict[str, np.ndarray]:
+        return {name: np.array(self.get(name)) for name in self.names}
+
+
+def _data_offset(index_nbytes: int) -> int:
+    end = _HEADER.size + index_nbytes
+    return (end + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def write_gallery(path, templates: Dict[str, np.ndarray]) -> Path:
+    """Write `templates` ({user: [K, dim]}) as a packed gallery, atomically replacing `path`."""
+    path = Path(path)
+    names = sorted(templates, key=lambda n: (n.lower(), n))
+    mats = [_normalize_rows(templates[n], n) for n in names]
+    dims = {m.shape[1] for m in mats}
+    if len(dims) > 1:
+        raise ValueError(f"Mixed template dims in gallery: {sorted(dims)}")
+    dim = dims.pop() if dims else 128
+
+    users, start = [], 0
+    for name, m in zip(names, mats):
+        users.append([name, start, int(m.shape[0])])
+        start += int(m.shape[0])
+    index = json.dumps({"users": users}, ensure_ascii=False).encode("utf-8")
+    header = _HEADER.pack(GALLERY_MAGIC, GALLERY_VERSION, dim, len(names), start, len(index))
+    pad = _data_offset(len(index)) - _HEADER.size - len(index)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(index)
+        f.write(b"\0" * pad)
+        for m in mats:
+            f.write(np.ascontiguousarray(m, dtype="<f4").tobytes())
+    _replace(tmp, path)
+    return path
+
+
+def _replace(tmp: Path, path: Path) -> None:
+    """os.replace(tmp, path), first dropping this process's cached mapping of `path`.
+
+    A PermissionError (Windows: the file is still mapped or briefly open in a reader)
+    is retried with backoff before giving up; the temp file is removed on failure.
+    """
+    _release(path)
+    for attempt in range(_REPLACE_RETRIES):
+        try:
+            os.replace(tmp, path)
+            return
+        except PermissionError:
+            if attempt == _REPLACE_RETRIES - 1:
+                tmp.unlink(missing_ok=True)
+                raise
+            gc.collect()  # frees mappings whose last reference was just dropped
+            time.sleep(0.01 * (attempt + 1))
+
+
+@contextlib.contextmanager
+def gallery_lock(gallery_path):
+    """Exclusive cross-process lock on .<gallery>.lock, held for a read-modify-write of the gallery."""
+    gallery_path = Path(gallery_path)
+    gallery_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(gallery_path.with_name(f".{gallery_path.name}.lock"), "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # gives up after ~10 s
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+# -----------------------------
+# Import / export from per-user .npy files
+# -----------------------------
+
+def pack_templates_dir(templates_dir, gallery_path=None) -> Path:
+    """Pack every <templates_dir>/<user>.npy into one gallery (default <templates_dir>/gallery.frg)."""
+    src = Path(templates_dir)
+    templates = {p.stem: np.load(p) for p in sorted(src.glob("*.npy"))
+                 if p.is_file() and not p.name.startswith(".")}
+    return write_gallery(gallery_path or src / GALLERY_FILENAME, templates)
+
+
+def export_templates_dir(gallery_path, out_dir) -> List[Path]:
+    """Write each user of the gallery back out as <out_dir>/<user>.npy."""
+    G = TemplateGallery(gallery_path)
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    written = []
+    for name in G.names:
+        p = out / f"{name}.npy"
+        np.save(p, np.array(G.get(name)))
+        written.append(p)
+    return written
+
+
+def upsert_user(gallery_path, user: str, T: np.ndarray) -> Path:
+    """Add or replace one user's templates in an existing gallery (rewrites the file)."""
+    return upsert_users(gallery_path, {user: T})
+
+
+def upsert_users(gallery_path, templates: Dict[str, np.ndarray]) -> Path:
+    """upsert_user for many users with a single rewrite, under gallery_lock."""
+    with gallery_lock(gallery_path):
+        packed = TemplateGallery(gallery_path, mmap=False).to_dict() if Path(gallery_path).exists() else {}
+        packed.update(templates)
+        return write_gallery(gallery_path, packed)
+
+
+def remove_user(gallery_path, user: str) -> bool:
+    """Remove a user from the gallery. Returns False if the user was not in it."""
+    if not Path(gallery_path).exists():
+        return False
+    with gallery_lock(gallery_path):
+        templates = TemplateGallery(gallery_path, mmap=False).to_dict()
+        if templates.pop(user, None) is None:
+            return False
+        write_gallery(gallery_path, templates)
+    return True
+
+
+# -----------------------------
+# Process-wide open galleries
+# -----------------------------
+
+_open_lock = threading.Lock()
+_open_galleries: Dict[str, Tuple[Tuple[int, int], TemplateGallery]] = {}
+
+
+def _release(path) -> None:
+    """Forget this process's cached gallery for `path`, so its mapping can be freed."""
+    with _open_lock:
+        _open_galleries.pop(os.path.abspath(path), None)
+
+
+def open_gallery(templates_dir) -> Optional[TemplateGallery]:
+    """Return the gallery in `templates_dir`, or None if it has not been packed.
+
+    The mapping is shared per process and reopened only when the file's
+    (mtime_ns, size) changes, e.g. after an enrollment rewrote it.
+    """
+    path = Path(templates_dir) / GALLERY_FILENAME
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    sig = (st.st_mtime_ns, st.st_size)
+    key = os.path.abspath(path)
+    with _open_lock:
+        entry = _open_galleries.get(key)
+        if entry is not None and entry[0] == sig:
+            return entry[1]
+    G = TemplateGallery(path)
+    with _open_lock:
+        _open_galleries[key] = (sig, G)
+    return G
+
+
+def newer_npy_users(templates_dir, gallery: TemplateGallery) -> List[str]:
+    """Users whose <templates_dir>/<user>.npy is missing from `gallery` or was modified
+    after it was written (copied in, or committed by bulk_enroll before its index sync):
+    the .npy is then the current version of their templates."""
+    users = []
+    with os.scandir(templates_dir) as it:
+        for e in it:
+            if e.name.endswith(".npy") and not e.name.startswith(".") and e.is_file():
+                user = e.name[:-4]
+                if user not in gallery or e.stat().st_mtime_ns > gallery.mtime_ns:
+                    users.append(user)
+    return sorted(users)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pack/export per-user template files")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_pack = sub.add_parser("pack", help="Pack <dir>/*.npy into a gallery file")
+    p_pack.add_argument("templates_dir", type=str)
+    p_pack.add_argument("--out", type=str, default=None, help=f"Gallery path (default <dir>/{GALLERY_FILENAME})")
+    p_exp = sub.add_parser("export", help="Write a gallery back out as per-user .npy files")
+    p_exp.add_argument("gallery", type=str)
+    p_exp.add_argument("out_dir", type=str)
+    p_info = sub.add_parser("info", help="Print gallery header")
+    p_info.add_argument("gallery", type=str)
+    args = ap.parse_args()
+
+    if args.cmd == "pack":
+        path = pack_templates_dir(args.templates_dir, args.out)
+        G = TemplateGallery(path)
+        print(f"Packed {len(G)} users / {G.n_rows} templates (dim={G.dim}) into {path}")
+    elif args.cmd == "export":
+        written = export_templates_dir(args.gallery, args.out_dir)
+        print(f"Exported {len(written)} users to {args.out_dir}")
+    else:
+        G = TemplateGallery(args.gallery)
+        print(json.dumps({"path": str(G.path), "version": G.version, "dim": G.dim,
+                          "n_users": len(G), "n_rows": G.n_rows}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
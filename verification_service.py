@@ -0,0 +1,222 @@
+"""
+Verification worker pool
+
+Runs face verification/identification in a fixed pool of worker processes
+instead of the Flask request threads. Each worker imports dlib's models and
+opens the template gallery once, in the pool initializer, and then serves
+jobs from the executor's queue.
+
+Admission is bounded: at most `workers + max_queue` jobs may be in flight
+(running or queued). A submission beyond that raises ServiceBusy right away
+with the current queue depth, so an overloaded server answers 503 quickly
+instead of letting latency grow without bound. Callers wait at most
+`timeout` seconds for a result (ServiceTimeout otherwise).
+
+workers=0 runs jobs inline in the calling thread, with no timeout and no
+admission limit unless max_queue (FACE_QUEUE) is set explicitly, in which
+case at most 1 + max_queue jobs run at once; this is the default when
+FACE_WORKERS is unset, and then behaves like calling the functions directly.
+
+Usage
+-----
+FACE_WORKERS=4 FACE_QUEUE=8 FACE_TIMEOUT_S=10 python app.py
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Dict, Optional
+
+# Functions of advance_face_recognition a job may call
+JOB_FUNCTIONS = ("verify_user_image", "verify_user_images_batch", "identify_image")
+
+
+class ServiceBusy(Exception):
+    """Raised when a job is submitted while the service is at its in-flight limit."""
+
+    def __init__(self, in_flight: int, max_in_flight: int):
+        super().__init__(f"Verification service busy ({in_flight}/{max_in_flight} jobs in flight)")
+        self.in_flight = in_flight
+        self.max_in_flight = max_in_flight
+
+
+class ServiceTimeout(Exception):
+    """Raised when a job's result is not ready within the submission timeout."""
+
+    def __init__(self, timeout: float, in_flight: int):
+        super().__init__(f"Verification did not finish within {timeout:.1f}s")
+        self.timeout = timeout
+        self.in_flight = in_flight
+
+
+# -----------------------------
+# Worker side
+# -----------------------------
+
+def _worker_init(out_dir: str, quantized: Optional[str] = None, report=None) -> None:
+    """Pool initializer: load dlib models and the gallery once per worker process.
+    The warm-up timings (plus the worker's pid) are put on `report` when given."""
+    import cv2
+    # One process per core already; keep OpenCV from spawning its own thread pool in each
+    cv2.setNumThreads(1)
+    import advance_face_recognition as afr  # imports face_recognition, which loads the dlib models
+    # First detect/encode and the gallery load happen here, before real traffic
+    timings = afr.warm_up_models(out_dir, quantized=quantized)
+    if report is not None:
+        report.put(dict(timings, pid=os.getpid()))
+
+
+def _run_job(fn_name: str, kwargs: dict):
+    # Top-level so ProcessPoolExecutor can pickle it
+    import advance_face_recognition as afr
+    return getattr(afr, fn_name)(**kwargs)
+
+
+def _probe() -> int:
+    # No-op job: submitting one makes the executor start a worker (running _worker_init)
+    return os.getpid()
+
+
+# -----------------------------
+# Service
+# -----------------------------
+
+class VerificationService:
+    """Bounded front-end to a process pool running advance_face_recognition jobs."""
+
+    def __init__(self, workers: int, out_dir: str = "user_templates",
+                 max_queue: Optional[int] = None, timeout: float = 10.0, mp_context=None,
+                 quantized: Optional[str] = None):
+        self.workers = max(0, int(workers))
+        self.out_dir = out_dir
+        self.quantized = quantized
+        if max_queue is None and self.workers == 0:
+            self.max_in_flight = None  # inline and unbounded, like the request threads themselves
+        else:
+            max_queue = 2 * max(1, self.workers) if max_queue is None else max(0, int(max_queue))
+            self.max_in_flight = max(1, self.workers) + max_queue
+        self.timeout = float(timeout)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected_busy = 0
+        self._timeouts = 0
+        self._pool = None
+        self._warm_up_reports = None
+        if self.workers > 0:
+            self._warm_up_reports = (mp_context or multiprocessing).Queue()
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp_context,
+                                             initializer=_worker_init,
+                                             initargs=(out_dir, quantized, self._warm_up_reports))
+
+    def _admit(self) -> None:
+        with self._lock:
+            if self.max_in_flight is not None and self._in_flight >= self.max_in_flight:
+                self._rejected_busy += 1
+                raise ServiceBusy(self._in_flight, self.max_in_flight)
+            self._in_flight += 1
+
+    def _release(self, _future=None) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._completed += 1
+
+    def submit(self, fn_name: str, **kwargs) -> Future:
+        """Queue `advance_face_recognition.<fn_name>(**kwargs)`; raises ServiceBusy when saturated."""
+        if fn_name not in JOB_FUNCTIONS:
+            raise ValueError(f"Unknown job: {fn_name}")
+        self._admit()
+        if self._pool is None:
+            future: Future = Future()
+            try:
+                future.set_result(_run_job(fn_name, kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._release()
+            return future
+        try:
+            future = self._pool.submit(_run_job, fn_name, kwargs)
+        except Exception:
+            self._release()
+            raise
+        # Capacity is returned when the job finishes, even if its caller timed out
+        future.add_done_callback(self._release)
+        return future
+
+    def call(self, fn_name: str, timeout: Optional[float] = None, **kwargs):
+        """Submit a job and wait for its result (ServiceBusy / ServiceTimeout on overload)."""
+        timeout = self.timeout if timeout is None else timeout
+        future = self.submit(fn_name, **kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            future.cancel()  # only succeeds if it has not started yet
+            with self._lock:
+                self._timeouts += 1
+                in_flight = self._in_flight
+            raise ServiceTimeout(timeout, in_flight)
+
+    def verify(self, timeout: Optional[float] = None, **kwargs):
+        return self.call("verify_user_image", timeout=timeout, **kwargs)
+
+    def identify(self, timeout: Optional[float] = None, **kwargs):
+        return self.call("identify_image", timeout=timeout, **kwargs)
+
+    def warm_up(self, timeout: float = 300.0) -> Dict:
+        """Load models and the gallery before traffic (advance_face_recognition.warm_up_models).
+
+        Inline services warm the calling process. With a pool, the warm-up itself runs in
+        each worker's initializer; `workers` no-op probes are submitted at once so the
+        executor starts every worker, and the timings each initializer reported are
+        collected (one per worker, however the probes were distributed).
+        Returns {"workers_started": n, "steps": [warm-up timings of each worker]}.
+        """
+        if self._pool is None:
+            import advance_face_recognition as afr
+            return {"workers_started": 0, "steps": [afr.warm_up_models(self.out_dir, quantized=self.quantized)]}
+        deadline = time.monotonic() + timeout
+        steps = []
+        try:
+            for future in [self._pool.submit(_probe) for _ in range(self.workers)]:
+                future.result(timeout=max(0.0, deadline - time.monotonic()))
+            while len(steps) < self.workers:
+                steps.append(self._warm_up_reports.get(timeout=max(0.0, deadline - time.monotonic())))
+        except (FutureTimeout, queue.Empty):
+            raise ServiceTimeout(timeout, self.stats()["in_flight"])
+        return {"workers_started": len(steps), "steps": sorted(steps, key=lambda r: r["pid"])}
+
+    @property
+    def queue_depth(self) -> int:
+        """Jobs admitted but not yet running (0 while a worker is idle)."""
+        with self._lock:
+            return max(0, self._in_flight - max(1, self.workers))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"workers": self.workers, "in_flight": self._in_flight,
+                    "queue_depth": max(0, self._in_flight - max(1, self.workers)),
+                    "max_in_flight": self.max_in_flight, "completed": self._completed,
+                    "rejected_busy": self._rejected_busy, "timeouts": self._timeouts}
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+def from_env(out_dir: str = "user_templates", quantized: Optional[str] = None) -> VerificationService:
+    """Service configured by FACE_WORKERS (0 = inline), FACE_QUEUE and FACE_TIMEOUT_S.
+    `quantized` is the gallery copy each worker builds while warming up."""
+    workers = int(os.getenv("FACE_WORKERS", "0"))
+    max_queue = os.getenv("FACE_QUEUE")
+    service = VerificationService(workers, out_dir=out_dir,
+                                  max_queue=int(max_queue) if max_queue else None,
+                                  timeout=float(os.getenv("FACE_TIMEOUT_S", "10")), quantized=quantized)
+    logging.info(f"Verification service: {service.workers} worker(s), max {service.max_in_flight or 'unbounded'} in flight, "
+                 f"timeout {service.timeout:.1f}s")
+    return service